@@ -0,0 +1,748 @@
+"""
+cli.py is a non-interactive command line interface for running the routines of the other scripts over many cards
+"""
+import os
+import sys
+import json
+import argparse
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+from scripts.pipeline import STAGES, DEFAULT_STAGES, DEFAULT_PATHS, getCardName, listCards, runCards, \
+    getSideImageStage, readImageStage
+from scripts.service import runService
+from scripts.watcher import WATCH_STAGES, watchCalibrations
+from scripts.job_queue import runQueue
+from scripts.shared_functions import readJson, saveToFile, readImage, createImageDict
+from scripts.split_image import initSplitWorker, IMAGE_EXTENSIONS
+from scripts.tile_pyramid import TILE_FORMATS, exportImagePyramid
+from scripts.texture_extraction import saveTextures
+from scripts.synthetic_scene import generateSyntheticCard
+from scripts.benchmark import listTruthCards, runBenchmark, printBenchmark
+from scripts.segment_proposal import proposeCalibration, createDraftAnnotation
+from scripts.improve_edge import EDGE_OPERATORS
+from scripts.improve_edges import improveEdgesParallel
+
+
+def addPathsArguments(parser):
+    """
+    addPathsArguments adds to a parser the arguments which configure the folders of images and calibrations
+
+    Parameters
+    - parser:argparse.ArgumentParser, parser to add the arguments
+
+    Return
+    - :None
+    """
+    parser.add_argument("--main-folder", default=DEFAULT_PATHS['MAIN_FOLDER'],
+                        help="folder prepended to the images and calibrations folders")
+    parser.add_argument("--images", default=DEFAULT_PATHS['IMAGES'],
+                        help="folder of the images")
+    parser.add_argument("--calib", default=DEFAULT_PATHS['CALIB'],
+                        help="folder of the calibrations")
+    parser.add_argument("--calib-prefix", default=DEFAULT_PATHS['CALIB_PREFIX'],
+                        help="prefix of the annotated calibrations saved by TextureExtractor")
+    parser.add_argument("--memo", default=DEFAULT_PATHS['MEMO'],
+                        help="folder of the memoized values of the stages")
+
+
+def addRunArguments(parser):
+    """
+    addRunArguments adds to a parser the arguments which configure the options of runCard
+
+    Parameters
+    - parser:argparse.ArgumentParser, parser to add the arguments
+
+    Return
+    - :None
+    """
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of parallel processes")
+    parser.add_argument("--crops-only", action="store_true",
+                        help="save crop rectangles instead of the pieces when splitting")
+    parser.add_argument("--align-split", action="store_true",
+                        help="align the left and right pieces by phase correlation when splitting")
+    parser.add_argument("--no-memo", action="store_true",
+                        help="recompute every stage instead of reusing memoized values")
+    parser.add_argument("--disparity-level", type=int, default=1,
+                        help="number of halvings of the pieces before computing their disparity")
+    parser.add_argument("--guided-matching", action="store_true",
+                        help="propagate with matches guided by the epipolar geometry of the pair")
+    parser.add_argument("--slide-ends", action="store_true",
+                        help="also move the ends of the improved segments along their lines")
+    parser.add_argument("--edge-operator", choices=EDGE_OPERATORS, default="canny",
+                        help="operator finding the edge maps of the propose and improve stages")
+    parser.add_argument("--stream", action="store_true",
+                        help="release the images of each card as soon as the stages using them finish")
+    parser.add_argument("--memory-budget", type=int, default=None,
+                        help="maximum memory in MiB of each worker process, cards exceeding it fail")
+    parser.add_argument("--profile", action="store_true",
+                        help="add wall time, cpu time and counters of every stage to the summary")
+    parser.add_argument("--track-memory", action="store_true",
+                        help="also measure peak memory of every stage, slowing down python code")
+    parser.add_argument("--cprofile-dir", default=None,
+                        help="folder to dump the cProfile statistics of each card")
+    parser.add_argument("--diagnostics", default=None,
+                        help="folder to render the comparison figures of the improve and propagate stages")
+    parser.add_argument("--preview-max-side", type=int, default=None,
+                        help="also save downscaled previews of the figures with this maximum side in pixels")
+
+
+def getPaths(args):
+    """
+    getPaths creates the paths dictionary of the pipeline from the parsed arguments
+
+    Parameters
+    - args:argparse.Namespace, parsed arguments
+
+    Return
+    - :dict, folders of images and calibrations as in DEFAULT_PATHS
+    """
+    return {"MAIN_FOLDER": args.main_folder, "IMAGES": args.images,
+            "CALIB": args.calib, "CALIB_PREFIX": args.calib_prefix, "MEMO": args.memo}
+
+
+def writeSummary(summary, summary_path):
+    """
+    writeSummary writes the machine-readable summary of a command to a file or to the standard output
+
+    Parameters
+    - summary:dict, summary of the command
+    - summary_path:str, path of the json file, or - for the standard output
+
+    Return
+    - :None
+    """
+    if summary_path == "-":
+        json.dump(summary, sys.stdout, indent=4)
+        sys.stdout.write("\n")
+    else:
+        with open(summary_path, 'w') as file:
+            json.dump(summary, file, indent=4)
+
+
+def getStages(args):
+    """
+    getStages returns the stages selected on the arguments, exiting if any is invalid
+
+    Parameters
+    - args:argparse.Namespace, parsed arguments
+
+    Return
+    - stages:list, names of the stages, subset of STAGES
+    """
+    stages = args.stages.split(",")
+    invalid_stages = [stage for stage in stages if stage not in STAGES]
+    if invalid_stages:
+        raise SystemExit("Invalid stages: " + ", ".join(invalid_stages))
+    return stages
+
+
+def getOptions(args):
+    """
+    getOptions creates the options of runCard from the parsed arguments
+
+    Parameters
+    - args:argparse.Namespace, parsed arguments
+
+    Return
+    - :dict, options of the run
+    """
+    memory_budget = args.memory_budget * (1 << 20) if args.memory_budget is not None else None
+    return {"crops_only": args.crops_only, "align_split": args.align_split,
+            "disparity_level": args.disparity_level, "guided_matching": args.guided_matching,
+            "slide_ends": args.slide_ends, "edge_operator": args.edge_operator, "memo": not args.no_memo,
+            "stream": args.stream, "memory_budget": memory_budget,
+            "profile": args.profile or args.track_memory or args.cprofile_dir is not None,
+            "track_memory": args.track_memory, "cprofile_path": args.cprofile_dir,
+            "diagnostics_path": args.diagnostics, "preview_max_side": args.preview_max_side}
+
+
+def getCardNames(args, paths):
+    """
+    getCardNames returns the names of the cards given as arguments, plus every card if --all is given
+
+    Parameters
+    - args:argparse.Namespace, parsed arguments
+    - paths:dict, folders of images and calibrations as in DEFAULT_PATHS
+
+    Return
+    - card_names:list, names of the cards
+    """
+    card_names = [getCardName(image) for image in args.cards]
+    if args.all:
+        card_names += [card_name for card_name in listCards(paths)
+                       if card_name not in card_names]
+    return card_names
+
+
+def runCommand(args):
+    """
+    runCommand runs the selected stages over the cards given as arguments
+
+    Parameters
+    - args:argparse.Namespace, parsed arguments
+
+    Return
+    - :int, exit code, 1 if any card failed
+    """
+    paths = getPaths(args)
+    stages = getStages(args)
+    card_names = getCardNames(args, paths)
+    results = runCards(card_names, stages, paths, getOptions(args), args.workers)
+    failed = [result for result in results if result['status'] != "ok"]
+    writeSummary({"stages": stages, "cards": len(results), "failed": len(failed),
+                  "results": results}, args.summary)
+    return 1 if failed else 0
+
+
+def queueCommand(args):
+    """
+    queueCommand runs the selected stages over the cards as a queue of jobs, retrying failed cards and
+    resuming from the state file of a previous run
+
+    Parameters
+    - args:argparse.Namespace, parsed arguments
+
+    Return
+    - :int, exit code, 1 if any card failed
+    """
+    paths = getPaths(args)
+    stages = getStages(args)
+
+    def printProgress(result):
+        print(result['card'], result['status'], "after", result['attempts'], "attempts",
+              file=sys.stderr, flush=True)
+
+    results = runQueue(getCardNames(args, paths), stages, paths, getOptions(args), args.workers,
+                       args.retries, args.state, args.queue_size, printProgress)
+    failed = [result for result in results if result['status'] != "ok"]
+    writeSummary({"stages": stages, "cards": len(results), "failed": len(failed),
+                  "results": results}, args.summary)
+    return 1 if failed else 0
+
+
+def saveCardProposal(card_name, paths, overwrite, edge_operator="canny"):
+    """
+    saveCardProposal proposes the calibration segments of the left piece of a card and saves them as its
+    annotation, with a draft camera and no planes so TextureExtractor opens it, for annotators to correct,
+    returning a summary
+
+    Parameters
+    - card_name:str, name of the card
+    - paths:dict, folders of images and calibrations as in DEFAULT_PATHS
+    - overwrite:bool, to replace an existing annotation
+    - edge_operator:str, operator of findEdges computing the edges matrix
+
+    Return
+    - :dict, summary with keys card, status, outputs and error
+    """
+    output_path = paths['MAIN_FOLDER'] + paths['CALIB'] + paths['CALIB_PREFIX'] + card_name + "_left.json"
+    if os.path.exists(output_path) and not overwrite:
+        return {"card": card_name, "status": "skipped", "outputs": [], "error": None}
+    try:
+        params = getSideImageStage(card_name, "left", paths)['params']
+        img_calib = proposeCalibration(readImageStage(**params), params['image_name'], params['extension'],
+                                       edge_operator=edge_operator)
+        saveToFile(createDraftAnnotation(img_calib), output_path)
+        return {"card": card_name, "status": "ok", "outputs": [output_path], "error": None}
+    except Exception as ex:
+        return {"card": card_name, "status": "failed", "outputs": [], "error": str(ex)}
+
+
+def proposeCommand(args):
+    """
+    proposeCommand saves proposed calibration segments as the annotation of every card without one
+
+    Parameters
+    - args:argparse.Namespace, parsed arguments
+
+    Return
+    - :int, exit code, 1 if any card failed
+    """
+    paths = getPaths(args)
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=initSplitWorker) as executor:
+        results = list(executor.map(partial(saveCardProposal, paths=paths, overwrite=args.overwrite,
+                                            edge_operator=args.edge_operator),
+                                    getCardNames(args, paths)))
+    failed = [result for result in results if result['status'] == "failed"]
+    writeSummary({"cards": len(results), "failed": len(failed),
+                  "results": results}, args.summary)
+    return 1 if failed else 0
+
+
+def improveCommand(args):
+    """
+    improveCommand improves the segments of the calibrations given as arguments over a pool of processes
+    sharing the edge map of each image, saving each one over its annotation as the improving interface does,
+    so the calibrated <nomeImagem>.json of the pipeline is never overwritten
+
+    Parameters
+    - args:argparse.Namespace, parsed arguments
+
+    Return
+    - :int, exit code, 1 if any calibration failed
+    """
+    paths = getPaths(args)
+    calib_base_path = paths['MAIN_FOLDER'] + paths['CALIB']
+    calib_paths = [calib_path if os.path.dirname(calib_path) else calib_base_path + calib_path
+                   for calib_path in args.calibs]
+    if args.all:
+        calib_paths += [calib_base_path + filename for filename in sorted(os.listdir(calib_base_path))
+                        if filename.endswith(".json") and filename.startswith(paths['CALIB_PREFIX'])
+                        and calib_base_path + filename not in calib_paths]
+
+    images_path = paths['MAIN_FOLDER'] + paths['IMAGES']
+    results = improveEdgesParallel([readJson(calib_path) for calib_path in calib_paths],
+                                   lambda img_calib: createImageDict(readImage(img_calib, images_path)),
+                                   args.workers, args.max_images, args.slide_ends, args.edge_operator)
+    summaries = []
+    for calib_path, result in zip(calib_paths, results):
+        outputs = []
+        if result['img_calib'] is not None:
+            outputs.append(calib_path)
+            saveToFile(result['img_calib'], outputs[-1])
+        summaries.append({"calib": calib_path, "status": "ok" if result['error'] is None else "failed",
+                          "outputs": outputs, "error": result['error']})
+    failed = [summary for summary in summaries if summary['status'] != "ok"]
+    writeSummary({"calibs": len(summaries), "failed": len(failed),
+                  "results": summaries}, args.summary)
+    return 1 if failed else 0
+
+
+def saveCalibTextures(calib_path, images_path, output_path, scale, tile_size):
+    """
+    saveCalibTextures saves the textures of the planes of a calibration file, returning a summary
+
+    Parameters
+    - calib_path:str, path of the calibration with camera and planes
+    - images_path:str, folder of the images
+    - output_path:str, folder to save the textures
+    - scale:float, pixels of the texture per pixel of the canvas, None for the resolution of the image
+    - tile_size:int, maximum side of each warped tile
+
+    Return
+    - :dict, summary with keys calib, status, outputs and error
+    """
+    try:
+        outputs = saveTextures(readJson(calib_path), images_path,
+                               output_path, scale, tile_size)
+        return {"calib": calib_path, "status": "ok", "outputs": outputs, "error": None}
+    except Exception as ex:
+        return {"calib": calib_path, "status": "failed", "outputs": [], "error": str(ex)}
+
+
+def texturesCommand(args):
+    """
+    texturesCommand saves the textures of the planes of the calibrations given as arguments
+
+    Parameters
+    - args:argparse.Namespace, parsed arguments
+
+    Return
+    - :int, exit code, 1 if any calibration failed
+    """
+    paths = getPaths(args)
+    calib_base_path = paths['MAIN_FOLDER'] + paths['CALIB']
+    calib_paths = [calib_path if os.path.dirname(calib_path) else calib_base_path + calib_path
+                   for calib_path in args.calibs]
+    if args.all:
+        calib_paths += [calib_base_path + filename for filename in sorted(os.listdir(calib_base_path))
+                        if filename.endswith(".json") and not filename.startswith(paths['CALIB_PREFIX'])
+                        and calib_base_path + filename not in calib_paths]
+
+    images_path = paths['MAIN_FOLDER'] + paths['IMAGES']
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=initSplitWorker) as executor:
+        results = list(executor.map(partial(saveCalibTextures, images_path=images_path, output_path=args.output,
+                                            scale=args.scale, tile_size=args.tile_size), calib_paths))
+    failed = [result for result in results if result['status'] != "ok"]
+    writeSummary({"calibs": len(results), "failed": len(failed),
+                  "results": results}, args.summary)
+    return 1 if failed else 0
+
+
+def listImages(folder_path):
+    """
+    listImages returns the path of every image directly inside a folder
+
+    Parameters
+    - folder_path:str, path of the folder
+
+    Return
+    - :list, paths of the images
+    """
+    return [os.path.join(folder_path, filename) for filename in sorted(os.listdir(folder_path))
+            if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS]
+
+
+def saveImagePyramid(image_path, output_path, tile_size, tile_format, quality):
+    """
+    saveImagePyramid exports the pyramid of an image file, returning a summary
+
+    Parameters
+    - image_path:str, path of the image or texture
+    - output_path:str, folder to save the pyramid
+    - tile_size:int, side of the tiles
+    - tile_format:str, webp, jpg or png
+    - quality:int, quality of the lossy formats, from 0 to 100
+
+    Return
+    - :dict, summary with keys image, status, manifest and error
+    """
+    try:
+        manifest_path = exportImagePyramid(image_path, output_path, tile_size, tile_format, quality)
+        return {"image": image_path, "status": "ok", "manifest": manifest_path, "error": None}
+    except Exception as ex:
+        return {"image": image_path, "status": "failed", "manifest": None, "error": str(ex)}
+
+
+def pyramidsCommand(args):
+    """
+    pyramidsCommand exports the tile pyramids of the images and textures given as arguments
+
+    Parameters
+    - args:argparse.Namespace, parsed arguments
+
+    Return
+    - :int, exit code, 1 if any image failed
+    """
+    paths = getPaths(args)
+    images_path = paths['MAIN_FOLDER'] + paths['IMAGES']
+    image_paths = [image_path if os.path.dirname(image_path) else images_path + image_path
+                   for image_path in args.sources]
+    if args.all:
+        image_paths += listImages(images_path)
+    if args.textures is not None:
+        image_paths += listImages(args.textures)
+
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=initSplitWorker) as executor:
+        results = list(executor.map(partial(saveImagePyramid, output_path=args.output, tile_size=args.tile_size,
+                                            tile_format=args.format, quality=args.quality), image_paths))
+    failed = [result for result in results if result['status'] != "ok"]
+    writeSummary({"images": len(results), "failed": len(failed),
+                  "results": results}, args.summary)
+    return 1 if failed else 0
+
+
+def saveSyntheticCard(seed, paths, truth_path, prefix, card_options):
+    """
+    saveSyntheticCard creates and saves the synthetic card of a seed, returning a summary
+
+    Parameters
+    - seed:int, seed of the card, also part of its name
+    - paths:dict, folders of images and calibrations as in DEFAULT_PATHS
+    - truth_path:str, folder to save the ground truth
+    - prefix:str, prefix of the name of the card
+    - card_options:dict, keyword arguments of createSyntheticCard
+
+    Return
+    - :dict, summary with keys card, status, outputs and error
+    """
+    card_name = prefix + str(seed)
+    try:
+        outputs = generateSyntheticCard(seed, card_name, paths, truth_path, **card_options)
+        return {"card": card_name, "status": "ok", "outputs": outputs, "error": None}
+    except Exception as ex:
+        return {"card": card_name, "status": "failed", "outputs": [], "error": str(ex)}
+
+
+def synthCommand(args):
+    """
+    synthCommand creates synthetic cards with ground truth, with consecutive seeds
+
+    Parameters
+    - args:argparse.Namespace, parsed arguments
+
+    Return
+    - :int, exit code, 1 if any card failed
+    """
+    card_options = {"width": args.width, "height": args.height, "stereo": not args.mono,
+                    "baseline": args.baseline, "n_boxes": args.boxes, "noise": args.noise,
+                    "n_edges": args.edges}
+    seeds = range(args.seed, args.seed + args.count)
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=initSplitWorker) as executor:
+        results = list(executor.map(partial(saveSyntheticCard, paths=getPaths(args), truth_path=args.truth,
+                                            prefix=args.prefix, card_options=card_options), seeds))
+    failed = [result for result in results if result['status'] != "ok"]
+    writeSummary({"cards": len(results), "failed": len(failed),
+                  "results": results}, args.summary)
+    return 1 if failed else 0
+
+
+def benchmarkCommand(args):
+    """
+    benchmarkCommand benchmarks the stages over synthetic cards, printing a table of the times and errors
+
+    Parameters
+    - args:argparse.Namespace, parsed arguments
+
+    Return
+    - :int, exit code, 1 if any card failed
+    """
+    card_names = [getCardName(card) for card in args.cards]
+    if args.all:
+        card_names += [card_name for card_name in listTruthCards(args.truth)
+                       if card_name not in card_names]
+
+    def printProgress(result):
+        print(result['card'], result['status'], file=sys.stderr, flush=True)
+
+    options = {"align_split": args.align_split, "guided_matching": args.guided_matching,
+               "slide_ends": args.slide_ends, "edge_operator": args.edge_operator, "profile": args.profile}
+    results, summary = runBenchmark(card_names, getPaths(args), args.truth, options, printProgress)
+    printBenchmark(summary, sys.stderr)
+    failed = [result for result in results if result['status'] != "ok"]
+    writeSummary({"cards": len(results), "failed": len(failed), "summary": summary,
+                  "results": results}, args.summary)
+    return 1 if failed else 0
+
+
+def watchCommand(args):
+    """
+    watchCommand runs the selected stages over every card whose annotated calibrations change, printing
+    the summary of each finished card as a json line
+
+    Parameters
+    - args:argparse.Namespace, parsed arguments
+
+    Return
+    - :int, exit code
+    """
+    watchCalibrations(getStages(args), getPaths(args), getOptions(args), args.workers,
+                      args.interval, args.debounce)
+    return 0
+
+
+def serveCommand(args):
+    """
+    serveCommand runs the local HTTP service until interrupted
+
+    Parameters
+    - args:argparse.Namespace, parsed arguments
+
+    Return
+    - :int, exit code
+    """
+    runService(args.host, args.port, args.workers, getPaths(args), args.allowed_origin, args.edge_operator)
+    return 0
+
+
+def createParser():
+    """
+    createParser creates the parser of every command of the interface
+
+    Parameters
+    - :None
+
+    Return
+    - parser:argparse.ArgumentParser
+    """
+    parser = argparse.ArgumentParser(
+        description="Headless interface of SMTools.")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    run_parser = subparsers.add_parser(
+        "run", help="run stages of the pipeline over many cards")
+    run_parser.add_argument("cards", nargs="*",
+                            help="stereo images (or names of cards) to process")
+    run_parser.add_argument("--all", action="store_true",
+                            help="process every stereo image in the images folder")
+    run_parser.add_argument("--stages", default=",".join(DEFAULT_STAGES),
+                            help="comma separated stages among " + ", ".join(STAGES))
+    addRunArguments(run_parser)
+    run_parser.add_argument("--summary", default="-",
+                            help="path of the json summary, - for standard output")
+    addPathsArguments(run_parser)
+    run_parser.set_defaults(func=runCommand)
+
+    queue_parser = subparsers.add_parser(
+        "queue", help="run stages over a collection as resumable jobs with retries")
+    queue_parser.add_argument("cards", nargs="*",
+                              help="stereo images (or names of cards) to process")
+    queue_parser.add_argument("--all", action="store_true",
+                              help="process every stereo image in the images folder")
+    queue_parser.add_argument("--stages", default=",".join(DEFAULT_STAGES),
+                              help="comma separated stages among " + ", ".join(STAGES))
+    queue_parser.add_argument("--retries", type=int, default=2,
+                              help="attempts of a failed card after the first one")
+    queue_parser.add_argument("--state", default=None,
+                              help="json file with the progress of the run, finished cards are skipped when resuming")
+    queue_parser.add_argument("--queue-size", type=int, default=None,
+                              help="maximum number of queued cards, twice the workers by default")
+    queue_parser.add_argument("--summary", default="-",
+                              help="path of the json summary, - for standard output")
+    addRunArguments(queue_parser)
+    addPathsArguments(queue_parser)
+    queue_parser.set_defaults(func=queueCommand)
+
+    watch_parser = subparsers.add_parser(
+        "watch", help="run stages over every card whose annotated calibrations change")
+    watch_parser.add_argument("--stages", default=",".join(WATCH_STAGES),
+                              help="comma separated stages among " + ", ".join(STAGES))
+    watch_parser.add_argument("--interval", type=float, default=1.0,
+                              help="seconds between scans of the calibrations folder")
+    watch_parser.add_argument("--debounce", type=float, default=2.0,
+                              help="seconds without changes before a card is run")
+    addRunArguments(watch_parser)
+    addPathsArguments(watch_parser)
+    watch_parser.set_defaults(func=watchCommand)
+
+    propose_parser = subparsers.add_parser(
+        "propose", help="save proposed calibration segments as the annotation of cards without one")
+    propose_parser.add_argument("cards", nargs="*",
+                                help="stereo images (or names of cards) to process")
+    propose_parser.add_argument("--all", action="store_true",
+                                help="process every stereo image in the images folder")
+    propose_parser.add_argument("--overwrite", action="store_true",
+                                help="replace the existing annotations too")
+    propose_parser.add_argument("--workers", type=int, default=1,
+                                help="number of parallel processes")
+    propose_parser.add_argument("--edge-operator", choices=EDGE_OPERATORS, default="canny",
+                                help="operator finding the edge maps of the images")
+    propose_parser.add_argument("--summary", default="-",
+                                help="path of the json summary, - for standard output")
+    addPathsArguments(propose_parser)
+    propose_parser.set_defaults(func=proposeCommand)
+
+    improve_parser = subparsers.add_parser(
+        "improve", help="improve the segments of many calibrations in place, sharing the edge maps between processes")
+    improve_parser.add_argument("calibs", nargs="*",
+                                help="calibrations with segments, relative to the calibrations folder")
+    improve_parser.add_argument("--all", action="store_true",
+                                help="process every annotation of the calibrations folder")
+    improve_parser.add_argument("--workers", type=int, default=None,
+                                help="number of parallel processes, defaults to the number of cores")
+    improve_parser.add_argument("--max-images", type=int, default=None,
+                                help="maximum number of edge maps shared at once, one more than the workers by default")
+    improve_parser.add_argument("--slide-ends", action="store_true",
+                                help="also move the ends of the improved segments along their lines")
+    improve_parser.add_argument("--edge-operator", choices=EDGE_OPERATORS, default="canny",
+                                help="operator finding the edge maps of the images")
+    improve_parser.add_argument("--summary", default="-",
+                                help="path of the json summary, - for standard output")
+    addPathsArguments(improve_parser)
+    improve_parser.set_defaults(func=improveCommand)
+
+    textures_parser = subparsers.add_parser(
+        "textures", help="extract the textures of the planes of calibrated images")
+    textures_parser.add_argument("calibs", nargs="*",
+                                 help="calibrations with camera and planes, relative to the calibrations folder")
+    textures_parser.add_argument("--all", action="store_true",
+                                 help="process every calibration of the calibrations folder")
+    textures_parser.add_argument("--output", default="textures/",
+                                 help="folder to save the textures")
+    textures_parser.add_argument("--scale", type=float, default=None,
+                                 help="pixels of texture per pixel of the 1200x800 canvas, "
+                                 "the resolution of the image by default")
+    textures_parser.add_argument("--tile-size", type=int, default=4096,
+                                 help="maximum side of each warped tile")
+    textures_parser.add_argument("--workers", type=int, default=1,
+                                 help="number of parallel processes")
+    textures_parser.add_argument("--summary", default="-",
+                                 help="path of the json summary, - for standard output")
+    addPathsArguments(textures_parser)
+    textures_parser.set_defaults(func=texturesCommand)
+
+    pyramids_parser = subparsers.add_parser(
+        "pyramids", help="export images and textures as pyramids of tiles for the web viewer")
+    pyramids_parser.add_argument("sources", nargs="*", metavar="images",
+                                 help="images or textures, relative to the images folder")
+    pyramids_parser.add_argument("--all", action="store_true",
+                                 help="export every image of the images folder")
+    pyramids_parser.add_argument("--textures", default=None,
+                                 help="folder of textures to export")
+    pyramids_parser.add_argument("--output", default="tiles/",
+                                 help="folder to save the pyramids")
+    pyramids_parser.add_argument("--tile-size", type=int, default=256,
+                                 help="side of the tiles")
+    pyramids_parser.add_argument("--format", default="webp", choices=list(TILE_FORMATS.keys()),
+                                 help="format of the tiles")
+    pyramids_parser.add_argument("--quality", type=int, default=80,
+                                 help="quality of the lossy formats, from 0 to 100")
+    pyramids_parser.add_argument("--workers", type=int, default=1,
+                                 help="number of parallel processes")
+    pyramids_parser.add_argument("--summary", default="-",
+                                 help="path of the json summary, - for standard output")
+    addPathsArguments(pyramids_parser)
+    pyramids_parser.set_defaults(func=pyramidsCommand)
+
+    synth_parser = subparsers.add_parser(
+        "synth", help="create synthetic cards of known cameras to benchmark the stages")
+    synth_parser.add_argument("--count", type=int, default=10,
+                              help="number of cards")
+    synth_parser.add_argument("--seed", type=int, default=0,
+                              help="seed of the first card, the next cards use the next seeds")
+    synth_parser.add_argument("--prefix", default="synth",
+                              help="prefix of the names of the cards, followed by their seed")
+    synth_parser.add_argument("--width", type=int, default=1600,
+                              help="width of each view")
+    synth_parser.add_argument("--height", type=int, default=1200,
+                              help="height of each view")
+    synth_parser.add_argument("--mono", action="store_true",
+                              help="render only the left view instead of a stereo card")
+    synth_parser.add_argument("--baseline", type=float, default=0.5,
+                              help="distance between the cameras of the views, the boxes are 4 to 18 units wide")
+    synth_parser.add_argument("--boxes", type=int, default=3,
+                              help="number of boxes of each scene")
+    synth_parser.add_argument("--noise", type=float, default=1.0,
+                              help="standard deviation in pixels of the 1200x800 canvas of the annotated points")
+    synth_parser.add_argument("--edges", type=int, default=4,
+                              help="maximum number of annotated segments of each axis")
+    synth_parser.add_argument("--truth", default="truth/",
+                              help="folder to save the ground truth")
+    synth_parser.add_argument("--workers", type=int, default=1,
+                              help="number of parallel processes")
+    synth_parser.add_argument("--summary", default="-",
+                              help="path of the json summary, - for standard output")
+    addPathsArguments(synth_parser)
+    synth_parser.set_defaults(func=synthCommand)
+
+    benchmark_parser = subparsers.add_parser(
+        "benchmark", help="measure time and error of the stages over synthetic cards")
+    benchmark_parser.add_argument("cards", nargs="*",
+                                  help="names of the synthetic cards")
+    benchmark_parser.add_argument("--all", action="store_true",
+                                  help="benchmark every card of the ground truth folder")
+    benchmark_parser.add_argument("--truth", default="truth/",
+                                  help="folder of the ground truth")
+    benchmark_parser.add_argument("--align-split", action="store_true",
+                                  help="align the left and right pieces by phase correlation when splitting")
+    benchmark_parser.add_argument("--guided-matching", action="store_true",
+                                  help="propagate with matches guided by the epipolar geometry of the pair")
+    benchmark_parser.add_argument("--slide-ends", action="store_true",
+                                  help="also move the ends of the improved segments along their lines")
+    benchmark_parser.add_argument("--edge-operator", choices=EDGE_OPERATORS, default="canny",
+                                  help="operator finding the edge maps of the propose and improve stages")
+    benchmark_parser.add_argument("--profile", action="store_true",
+                                  help="add the times and counters of the nested stages of each card")
+    benchmark_parser.add_argument("--summary", default="-",
+                                  help="path of the json summary, - for standard output")
+    addPathsArguments(benchmark_parser)
+    benchmark_parser.set_defaults(func=benchmarkCommand)
+
+    serve_parser = subparsers.add_parser(
+        "serve", help="serve the stages over HTTP for TextureExtractor")
+    serve_parser.add_argument("--host", default="127.0.0.1",
+                              help="address to listen on")
+    serve_parser.add_argument("--port", type=int, default=8001,
+                              help="port to listen on")
+    serve_parser.add_argument("--workers", type=int, default=None,
+                              help="number of worker processes, defaults to the number of cores")
+    serve_parser.add_argument("--allowed-origin", action="append", default=None,
+                              help="origin of a page allowed to call the service, can be repeated, "
+                                   "defaults to TextureExtractor at port 8000")
+    serve_parser.add_argument("--edge-operator", choices=EDGE_OPERATORS, default="canny",
+                              help="operator finding the edge maps of the images")
+    addPathsArguments(serve_parser)
+    serve_parser.set_defaults(func=serveCommand)
+    return parser
+
+
+def main(argv=None):
+    args = createParser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
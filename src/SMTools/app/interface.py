@@ -7,11 +7,14 @@ import json
 import cv2 as cv
 import copy
 
-from scripts.shared_functions import readImage, readJson, createImageDict, getStereoFilename, plotCalibSegs
-from scripts.improve_edges import improveJsonEdges
+from scripts.shared_functions import readImage, readJson, createImageDict, getStereoFilename, getCropsFilename
+from scripts.improve_edges import improveEdgesDict
 from scripts.camera_calibration import calibrateCamera
 from scripts.stereo_matching import stereoEdgesMatching
-from scripts.split_image import getStereoSplit
+from scripts.split_image import getStereoSplit, splitImageFolder
+from scripts.image_loader import loadImage
+from scripts.profiling import startProfiling, stopProfiling, printReport
+from scripts.diagnostics import submitCalibSegs, submitImprovement, waitDiagnostics
 
 
 PATHS = {
@@ -19,7 +22,8 @@ PATHS = {
     "IMAGES": "images/",
     "CALIB": "calib/",
     "CURRENT_IMAGE": "example_left.jpg",
-    "CURRENT_CALIB": "cab-example_left.json"
+    "CURRENT_CALIB": "cab-example_left.json",
+    "DIAGNOSTICS": "diagnostics/"
 }
 
 
@@ -87,6 +91,7 @@ def interfaceBegin(main_title_desc):
         print("\nOkay, returning to main menu.\n")
         time.sleep(1)
         return False
+    startProfiling()
     return True
 
 
@@ -100,6 +105,9 @@ def interfaceEnd():
     - :None
     """
     print("\nProcess complete. All results were saved.\n")
+    report = stopProfiling()
+    if report is not None:
+        printReport(report)
     input("\nPress ANY KEY to continue.\n")
 
 
@@ -148,21 +156,68 @@ def splitImageInterface():
     image_input_path = PATHS['MAIN_FOLDER'] + \
         PATHS['IMAGES'] + PATHS['CURRENT_IMAGE']
     image_base_name = ''.join(PATHS['CURRENT_IMAGE'].split(sep=".")[:-1])
+    crops_only = input(
+        "\nSave only crop rectangles instead of the images? (y/n)\n") == "y"
 
     try:
         print("Reading image at path", image_input_path, "...", end='')
-        img = cv.imread(image_input_path)
+        img = loadImage(image_input_path)
         print(" done.")
 
-        print("Splitting the image...", end='')
-        imgL, imgR, imgM = getStereoSplit(img)
-        print(" done.")
+        if crops_only:
+            print("Finding the crops of the image...", end='')
+            crops = getStereoSplit(img, crops_only=True)
+            print(" done.")
+
+            print("Saving output...", end='')
+            saveOutput(getCropsFilename(image_base_name), {"source": PATHS['CURRENT_IMAGE'], "crops": crops},
+                       "json", output_path=PATHS['MAIN_FOLDER'] + PATHS['IMAGES'])
+            print(" done.")
+        else:
+            print("Splitting the image...", end='')
+            imgL, imgR, imgM = getStereoSplit(img)
+            print(" done.")
+
+            print("Saving output...", end='')
+            saveOutput(image_base_name + "_left.jpg", imgL, "img")
+            saveOutput(image_base_name + "_right.jpg", imgR, "img")
+            saveOutput(image_base_name + "_middle.jpg", imgM, "img")
+            print(" done.")
+    except Exception as ex:
+        print("\nException ocurred:", ex)
+        print("\nFailed. Returning to main menu.\n")
+        input("\nPress START to continue.\n")
+        return
 
-        print("Saving output...", end='')
-        saveOutput(image_base_name + "_left.jpg", imgL, "img")
-        saveOutput(image_base_name + "_right.jpg", imgR, "img")
-        saveOutput(image_base_name + "_middle.jpg", imgM, "img")
+    interfaceEnd()
+
+
+def batchSplitInterface():
+    """
+    batchSplitInterface creates an interface for splitting every stereo image in the images folder of the environment variable
+
+    Parameters
+    - :None
+    Return
+    - :None
+    """
+    if not interfaceBegin("splitting all stereo images of a folder"):
+        return
+
+    image_base_path = PATHS['MAIN_FOLDER'] + PATHS['IMAGES']
+    crops_only = input(
+        "\nSave only crop rectangles instead of the images? (y/n)\n") == "y"
+
+    try:
+        print("Splitting every image at path", image_base_path, "...", end='')
+        results = splitImageFolder(
+            image_base_path, image_base_path, crops_only=crops_only)
         print(" done.")
+
+        failed = [result for result in results if result['error'] is not None]
+        print("\nSplitted", len(results) - len(failed), "images.")
+        for result in failed:
+            print("Failed on", result['image'], ":", result['error'])
     except Exception as ex:
         print("\nException ocurred:", ex)
         print("\nFailed. Returning to main menu.\n")
@@ -188,6 +243,7 @@ def improveEdgesInterface():
         PATHS['IMAGES']
     calib_input_path = PATHS['MAIN_FOLDER'] + \
         PATHS['CALIB'] + PATHS['CURRENT_CALIB']
+    diagnostics_base_path = PATHS['MAIN_FOLDER'] + PATHS['DIAGNOSTICS']
 
     try:
         print("Reading calibration at path", calib_input_path, "...", end='')
@@ -196,16 +252,26 @@ def improveEdgesInterface():
 
         print("Reading image through calibration data at path",
               image_base_path, "...", end='')
-        img = readImage(img_calib, image_base_path)
+        img_dict = createImageDict(readImage(img_calib, image_base_path))
         print(" done.")
 
         print("Improving edges...", end='')
-        img_calib = improveJsonEdges(img_calib, img)
+        img_calib_improved = improveEdgesDict(img_dict, img_calib)
+        submitImprovement(diagnostics_base_path + img_calib['nomeImagem'] + "_improvement.png",
+                          img_dict, img_calib, img_calib_improved)
         print(" done.")
 
         print("Saving output...", end='')
-        saveOutput(PATHS['CURRENT_CALIB'], img_calib, "json")
+        saveOutput(PATHS['CURRENT_CALIB'], img_calib_improved, "json")
+        print(" done.")
+
+        print("Waiting diagnostics rendering...", end='')
+        diagnostics_outputs, diagnostics_errors = waitDiagnostics()
         print(" done.")
+        print("\nDiagnostics saved at", diagnostics_base_path, ":",
+              len(diagnostics_outputs), "files.")
+        for error in diagnostics_errors:
+            print("Failed rendering diagnostics:", error)
     except Exception as ex:
         print("\nException ocurred:", ex)
         print("\nFailed. Returning to main menu.\n")
@@ -333,10 +399,11 @@ def fullPipelineInterface():
     calib_base_path = PATHS['MAIN_FOLDER'] + PATHS['CALIB']
     calib_input_path = calib_base_path + PATHS['CURRENT_CALIB']
     image_base_name = ''.join(PATHS['CURRENT_IMAGE'].split(sep=".")[:-1])
+    diagnostics_base_path = PATHS['MAIN_FOLDER'] + PATHS['DIAGNOSTICS']
 
     try:
         print("Reading image at path", image_input_path, "...", end='')
-        img = cv.imread(image_input_path)
+        img = loadImage(image_input_path)
         print(" done.")
 
         print("Splitting the image...", end='')
@@ -357,18 +424,21 @@ def fullPipelineInterface():
         imgL_calib = readJson(calib_input_path)
         print(" done.")
 
+        print("Creating image1 additional parameters...", end='')
+        imgL_dict = createImageDict(imgL)
+        print(" done.")
+
         print("Improving edges of left image...", end='')
-        imgL_calib = improveJsonEdges(imgL_calib, imgL)
+        imgL_calib_improved = improveEdgesDict(imgL_dict, imgL_calib)
+        submitImprovement(diagnostics_base_path + image_base_name + "_left_improvement.png",
+                          imgL_dict, imgL_calib, imgL_calib_improved)
+        imgL_calib = imgL_calib_improved
         print(" done.")
 
         print("Calibrating camera of left image...", end='')
         imgL_calib = calibrateCamera(imgL_calib)
         print(" done.")
 
-        print("Creating image1 additional parameters...", end='')
-        imgL_dict = createImageDict(imgL)
-        print(" done.")
-
         print("Creating calibration of image2 from image1...", end='')
         imgR_calib = copy.deepcopy(imgL_calib)
         imgR_calib['nomeImagem'] = getStereoFilename(imgL_calib['nomeImagem'])
@@ -384,10 +454,14 @@ def fullPipelineInterface():
             imgL_calib, imgL_dict, imgR_calib, imgR_dict)
         print(" done.")
 
-        plotCalibSegs([imgL_dict, imgR_dict], [imgL_calib, imgR_calib])
+        submitCalibSegs(diagnostics_base_path + image_base_name + "_propagation.png",
+                        [imgL_dict, imgR_dict], [imgL_calib, imgR_calib])
 
         print("Improving edges of right image...", end='')
-        imgR_calib = improveJsonEdges(imgR_calib, imgR)
+        imgR_calib_improved = improveEdgesDict(imgR_dict, imgR_calib)
+        submitImprovement(diagnostics_base_path + image_base_name + "_right_improvement.png",
+                          imgR_dict, imgR_calib, imgR_calib_improved)
+        imgR_calib = imgR_calib_improved
         print(" done.")
 
         print("Calibrating camera of right image...", end='')
@@ -399,7 +473,16 @@ def fullPipelineInterface():
         saveOutput(imgR_calib['nomeImagem'] + ".json", imgR_calib, "json")
         print(" done.")
 
-        plotCalibSegs([imgL_dict, imgR_dict], [imgL_calib, imgR_calib])
+        submitCalibSegs(diagnostics_base_path + image_base_name + "_calibration.png",
+                        [imgL_dict, imgR_dict], [imgL_calib, imgR_calib])
+
+        print("Waiting diagnostics rendering...", end='')
+        diagnostics_outputs, diagnostics_errors = waitDiagnostics()
+        print(" done.")
+        print("\nDiagnostics saved at", diagnostics_base_path, ":",
+              len(diagnostics_outputs), "files.")
+        for error in diagnostics_errors:
+            print("Failed rendering diagnostics:", error)
     except Exception as ex:
         print("\nException ocurred:", ex)
         print("\nFailed. Returning to main menu.\n")
@@ -417,7 +500,8 @@ OPTIONS_SCRIPTS = [("0", "Set Environment Variable (MANUAL)", setVariableInterfa
                    ("4", "Find Edges of Stereo Matching (SCRIPT)",
                     stereoMatchingInterface),
                    ("5", "Run Full Pipeline After TextureExtractor (SCRIPT)",
-                    fullPipelineInterface)]
+                    fullPipelineInterface),
+                   ("6", "Split All Images of Folder (SCRIPT)", batchSplitInterface)]
 
 
 def mainMenu():
@@ -452,6 +536,9 @@ def mainMenu():
             print("\nException ocurred:", ex)
             print("\nInvalid option.\n")
             time.sleep(1)
+        finally:
+            # Interfaces returning after an exception never reach interfaceEnd, which stops the profiling
+            stopProfiling()
 
 
 def main():
@@ -0,0 +1,260 @@
+"""
+benchmark.py is a collection of functions to benchmark the stages over synthetic cards of synthetic_scene.py,
+reporting the time of each stage alongside its error against the ground truth, so a faster stage can be checked
+not to be less accurate
+"""
+import os
+import copy
+import traceback
+import numpy as np
+
+from scripts.shared_functions import readJson, createImageDict, cropImage
+from scripts.image_loader import loadImage
+from scripts.improve_edges import improveEdgesDict
+from scripts.camera_calibration import calibrateCamera
+from scripts.split_image import getStereoSplit
+from scripts.pipeline import propagateStage
+from scripts.segment_proposal import proposeCalibration
+from scripts.profiling import startProfiling, stopProfiling, stageTimer
+
+
+def listTruthCards(truth_path):
+    """
+    listTruthCards returns the name of every card with a ground truth
+
+    Parameters
+    - truth_path:str, folder of the ground truth
+
+    Return
+    - :list, names of the cards
+    """
+    return [os.path.splitext(filename)[0] for filename in sorted(os.listdir(truth_path))
+            if filename.endswith(".json")]
+
+
+def getEdgesError(pontosguia, truth_edges):
+    """
+    getEdgesError returns the mean distance between the ends of the calibration segments and the lines of
+    their true edges, where the segments of each axis are in the order of the true edges
+
+    Parameters
+    - pontosguia:list, for each axis a list of points x,y on the canvas, two per segment
+    - truth_edges:list, for each axis a list of ends x,y on the canvas of the true edges
+
+    Return
+    - :float, mean distance in pixels of the canvas
+    """
+    distances = []
+    for points, edges in zip(pontosguia, truth_edges):
+        for j, (p, q) in enumerate(edges):
+            p, q = np.array(p), np.array(q)
+            normal = np.array([q[1] - p[1], p[0] - q[0]]) / np.linalg.norm(q - p)
+            ends = np.array(points[2 * j:2 * j + 2], dtype=np.float64)
+            distances += np.abs((ends - p) @ normal).tolist()
+    return float(np.mean(distances))
+
+
+def getEndsError(pontosguia, truth_ends):
+    """
+    getEndsError returns the mean distance between the ends of the calibration segments and the ends of the
+    visible part of their true edges, where the segments of each axis are in the order of the true edges
+
+    Parameters
+    - pontosguia:list, for each axis a list of points x,y on the canvas, two per segment
+    - truth_ends:list, for each axis a list of visible ends x,y on the canvas of the true edges
+
+    Return
+    - :float, mean distance in pixels of the canvas
+    """
+    distances = []
+    for points, ends in zip(pontosguia, truth_ends):
+        for j, edge_ends in enumerate(ends):
+            distances += np.linalg.norm(np.array(points[2 * j:2 * j + 2], dtype=np.float64) - edge_ends,
+                                        axis=1).tolist()
+    return float(np.mean(distances))
+
+
+def getCalibrationError(img_calib, truth_calib):
+    """
+    getCalibrationError compares a calibrated camera with the true one
+
+    Parameters
+    - img_calib:dict, object with data about an image calibration with camera
+    - truth_calib:dict, true camera with keys base and camera
+
+    Return
+    - :dict, keys axes_deg (largest angle between an axis and its true direction), focal (relative error of the
+    distance between camera and canvas) and center_px (distance of the optical centers), None if not finite
+    """
+    base = np.array(img_calib['base'], dtype=np.float64).reshape(3, 3)
+    truth_base = np.array(truth_calib['base'], dtype=np.float64).reshape(3, 3)
+    # The direction of each axis is only known up to its sign
+    cosines = np.clip(np.abs(np.sum(base * truth_base, axis=1)), 0, 1)
+    C, truth_C = np.array(img_calib['camera'], dtype=np.float64), np.array(truth_calib['camera'])
+    errors = {"axes_deg": np.degrees(np.max(np.arccos(cosines))),
+              "focal": abs(C[2] - truth_C[2]) / abs(truth_C[2]),
+              "center_px": np.linalg.norm(C[:2] - truth_C[:2])}
+    return {key: float(value) if np.isfinite(value) else None for key, value in errors.items()}
+
+
+def getCropsError(crops, truth_crops):
+    """
+    getCropsError returns the largest distance between the sides of the pieces found by the split and the true ones
+
+    Parameters
+    - crops:dict, keys left and right with rectangles [x0, y0, x1, y1]
+    - truth_crops:dict, keys left and right with the true rectangles
+
+    Return
+    - :float, distance in pixels of the card
+    """
+    return float(max(np.max(np.abs(np.array(crops[side]) - truth_crops[side])) for side in ["left", "right"]))
+
+
+def benchmarkCard(card_name, paths, truth_path, options=None):
+    """
+    benchmarkCard runs the stages over a synthetic card as the pipeline does, measuring each stage and its error,
+    where the stages after the split use the true pieces so their errors don't add up with the split error
+
+    Parameters
+    - card_name:str, name of the card
+    - paths:dict, folders of images and calibrations as in DEFAULT_PATHS
+    - truth_path:str, folder of the ground truth
+    - options:dict, options of the run (align_split, guided_matching, slide_ends, edge_operator, profile)
+
+    Return
+    - result:dict, summary with keys card, status, error, times (wall seconds of each stage) and errors, plus
+    the whole profile if options profile is set
+    """
+    options = options or {}
+    edge_operator = options.get('edge_operator', "canny")
+    images_path = paths['MAIN_FOLDER'] + paths['IMAGES']
+    calib_path = paths['MAIN_FOLDER'] + paths['CALIB']
+    result = {'card': card_name, 'status': "ok", 'error': None, 'times': {}, 'errors': {}}
+    errors = result['errors']
+    startProfiling()
+    try:
+        truth = readJson(os.path.join(truth_path, card_name + ".json"))
+        annotation = readJson(calib_path + paths['CALIB_PREFIX'] + card_name + "_left.json")
+        with stageTimer("load"):
+            if truth['stereo']:
+                img = loadImage(images_path + card_name + ".jpg")
+                views = {side: cropImage(img, truth['crops'][side]) for side in ["left", "right"]}
+            else:
+                views = {"left": loadImage(images_path + card_name + "_left.jpg")}
+            img_dicts = {side: createImageDict(view) for side, view in views.items()}
+        if truth['stereo']:
+            with stageTimer("split"):
+                crops = getStereoSplit(img, crops_only=True, align=options.get('align_split', False))
+            errors['split_px'] = getCropsError(crops, truth['crops'])
+
+        errors['annotation_px'] = getEdgesError(annotation['pontosguia'], truth['edges']['left'])
+        # Cards created before the visible ends were kept only measure the distance to the lines
+        has_ends = 'ends' in truth
+        if has_ends:
+            errors['annotation_ends_px'] = getEndsError(annotation['pontosguia'], truth['ends']['left'])
+        with stageTimer("calibrate_annotation"):
+            annotation_calib = calibrateCamera(copy.deepcopy(annotation))
+        errors.update({"annotation_" + key: value for key, value in
+                       getCalibrationError(annotation_calib, truth['calib']).items()})
+        with stageTimer("propose"):
+            proposal = proposeCalibration(img_dicts['left'], card_name + "_left", edge_operator=edge_operator)
+        with stageTimer("calibrate_proposal"):
+            proposal_calib = calibrateCamera(proposal)
+        errors.update({"proposal_" + key: value for key, value in
+                       getCalibrationError(proposal_calib, truth['calib']).items()})
+        with stageTimer("improve"):
+            improved = improveEdgesDict(img_dicts['left'], annotation, options.get('slide_ends', False), edge_operator)
+        errors['improve_px'] = getEdgesError(improved['pontosguia'], truth['edges']['left'])
+        if has_ends:
+            errors['improve_ends_px'] = getEndsError(improved['pontosguia'], truth['ends']['left'])
+        with stageTimer("calibrate"):
+            img_calib = calibrateCamera(improved)
+        errors.update({"calibrate_" + key: value for key, value in
+                       getCalibrationError(img_calib, truth['calib']).items()})
+
+        if truth['stereo']:
+            with stageTimer("propagate"):
+                right_calib = propagateStage(img_calib, img_dicts['left'], img_dicts['right'],
+                                             options.get('guided_matching', False))
+            errors['propagate_px'] = getEdgesError(right_calib['pontosguia'], truth['edges']['right'])
+            with stageTimer("improve_right"):
+                right_calib = improveEdgesDict(img_dicts['right'], right_calib, options.get('slide_ends', False),
+                                               edge_operator)
+            errors['improve_right_px'] = getEdgesError(right_calib['pontosguia'], truth['edges']['right'])
+            if has_ends:
+                errors['improve_right_ends_px'] = getEndsError(right_calib['pontosguia'], truth['ends']['right'])
+            with stageTimer("calibrate_right"):
+                right_calib = calibrateCamera(right_calib)
+            errors.update({"calibrate_right_" + key: value for key, value in
+                           getCalibrationError(right_calib, truth['calib']).items()})
+    except Exception:
+        result['status'] = "failed"
+        result['error'] = traceback.format_exc()
+    report = stopProfiling()
+    result['times'] = {record['stage']: record['wall'] for record in report['stages']
+                       if "/" not in record['stage']}
+    if options.get('profile', False):
+        result['profile'] = report
+    return result
+
+
+def summarizeBenchmark(results):
+    """
+    summarizeBenchmark aggregates the times and errors of every benchmarked card
+
+    Parameters
+    - results:list, summaries as returned by benchmarkCard
+
+    Return
+    - :dict, for each time and error the keys mean, median, max and count over the cards where it is known
+    """
+    values = {}
+    for result in results:
+        for group in ["times", "errors"]:
+            for key, value in result[group].items():
+                if value is not None:
+                    values.setdefault(group[:-1] + ":" + key, []).append(value)
+    return {key: {"mean": float(np.mean(value)), "median": float(np.median(value)),
+                  "max": float(np.max(value)), "count": len(value)}
+            for key, value in values.items()}
+
+
+def runBenchmark(card_names, paths, truth_path, options=None, on_result=None):
+    """
+    runBenchmark benchmarks the cards one at a time, so the times of the stages are not disturbed by each other
+
+    Parameters
+    - card_names:list, names of the cards
+    - paths:dict, folders of images and calibrations as in DEFAULT_PATHS
+    - truth_path:str, folder of the ground truth
+    - options:dict, options of the run (align_split, guided_matching, slide_ends, edge_operator, profile)
+    - on_result:function, called with the summary of each benchmarked card
+
+    Return
+    - results:list, one summary per card as returned by benchmarkCard
+    - summary:dict, aggregated times and errors as returned by summarizeBenchmark
+    """
+    results = []
+    for card_name in card_names:
+        results.append(benchmarkCard(card_name, paths, truth_path, options))
+        if on_result is not None:
+            on_result(results[-1])
+    return results, summarizeBenchmark([result for result in results if result['status'] == "ok"])
+
+
+def printBenchmark(summary, file=None):
+    """
+    printBenchmark prints the aggregated times and errors of a benchmark in a table
+
+    Parameters
+    - summary:dict, aggregated times and errors as returned by summarizeBenchmark
+    - file:file, where to print, standard output by default
+
+    Return
+    - :None
+    """
+    print("\n{:<36}{:>12}{:>12}{:>12}{:>8}".format("Metric", "Mean", "Median", "Max", "Cards"), file=file)
+    for key, value in summary.items():
+        print("{:<36}{:>12.4f}{:>12.4f}{:>12.4f}{:>8}".format(
+            key, value['mean'], value['median'], value['max'], value['count']), file=file)
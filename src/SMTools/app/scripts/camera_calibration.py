@@ -4,10 +4,14 @@ camera calibration through a dictionary of orthogonal line segments
 for each axis X, Y, Z
 """
 import sys
+import copy
 import numpy as np
 
 from scripts.shared_functions import saveToFile, readJson
+from scripts.profiling import stageTimer, countEvent
 
+# Axes whose vanishing points come from segments, for each missing axis of getCalibType
+MISSING_IDX_CASES = {None: [0, 1, 2], 0: [1, 2], 1: [0, 2], 2: [0, 1]}
 
 def getCalibType(img_calib):
     """
@@ -64,6 +68,78 @@ def lineIntersection(edge1, edge2):
     return intersection_point
 
 
+def getIntersections(edges1, edges2):
+    """
+    getIntersections finds the points on which pairs of edges intersect, as lineIntersection does for each pair
+
+    Parameters
+    - edges1:np.array, first edge of each pair as two points x,y, of shape (k,2,2) or (1,2,2)
+    - edges2:np.array, second edge of each pair as two points x,y, of shape (k,2,2) or (1,2,2)
+
+    Return
+    - points:np.array, x,y of the intersection points of shape (k,2)
+    - valid:np.array, boolean of shape (k,), False for parallel edges which never meet
+    """
+    p, q = edges1[:, 0].T, edges1[:, 1].T
+    r, s = edges2[:, 0].T, edges2[:, 1].T
+    a1 = triangleArea(p, q, r)
+    a2 = triangleArea(q, p, s)
+    # Parallel segments never meet, as two segments of whole pixels may be
+    valid = a1 + a2 != 0
+    amp = (a1 / np.where(valid, a1 + a2, 1))[:, None]
+    points = edges2[:, 0] * (1 - amp) + edges2[:, 1] * amp
+    return points, valid
+
+
+def getAxisEdges(pontosguia, dim):
+    """
+    getAxisEdges returns the calibration segments of an axis as an array
+
+    Parameters
+    - pontosguia:list, for each axis a list of points x,y, two per segment
+    - dim:int, index of the axis
+
+    Return
+    - :np.array, segments as two points x,y of shape (n,2,2)
+    """
+    return np.array(pontosguia[dim], dtype=np.float64).reshape(-1, 2, 2)
+
+
+def getAxisIntersections(edges):
+    """
+    getAxisIntersections finds the intersection of every pair of segments of an axis
+
+    Parameters
+    - edges:np.array, segments as two points x,y of shape (n,2,2)
+
+    Return
+    - points:np.array, x,y of the intersection of the segments i < j on [i, j], of shape (n,n,2)
+    - valid:np.array, boolean of shape (n,n), True for the pairs i < j which meet
+    """
+    points = np.zeros((len(edges), len(edges), 2))
+    valid = np.zeros((len(edges), len(edges)), dtype=bool)
+    # Pairs i < j in the order of rows, faster than np.triu_indices for the few segments of an axis
+    first, second = np.nonzero(np.tri(len(edges), k=-1, dtype=bool).T)
+    points[first, second], valid[first, second] = getIntersections(edges[first], edges[second])
+    return points, valid
+
+
+def getVanishingPoint(points, valid):
+    """
+    getVanishingPoint averages the intersections of the segments of an axis, in the order of the pairs
+
+    Parameters
+    - points:np.array, intersections as returned by getAxisIntersections, of shape (n,n,2)
+    - valid:np.array, pairs which meet as returned by getAxisIntersections, of shape (n,n)
+
+    Return
+    - :list, x,y of the vanishing point
+    """
+    if not np.any(valid):
+        raise ValueError("No intersecting calibration segments on an axis")
+    return np.mean(points[valid], axis=0).tolist()
+
+
 def getVanishingPoints(img_calib, missing_idx):
     """
     getVanishingPoints creates pontosfuga key on data, which are the vanishing points for each axis
@@ -75,24 +151,11 @@ def getVanishingPoints(img_calib, missing_idx):
     Return
     - :None
     """
-    missing_idx_cases = {None: [0, 1, 2], 0: [1, 2], 1: [0, 2], 2: [0, 1]}
-    dim_cases = missing_idx_cases[missing_idx]
     vanishing_points = []
-    for dim in dim_cases:
-        intersection_points = []
-        edges = [[img_calib['pontosguia'][dim][2*j], img_calib['pontosguia'][dim][2*j+1]]
-                 for j in range(len(img_calib['pontosguia'][dim])//2)]
-        for edge_index_1 in range(len(edges)):
-            for edge_index_2 in range(edge_index_1 + 1, len(edges)):
-                edge1 = edges[edge_index_1]
-                edge2 = edges[edge_index_2]
-                intersection_points.append(lineIntersection(edge1, edge2))
-        intersection_points = [np.array(p).reshape(-1, 2)
-                               for p in intersection_points]
-        intersection_points = np.concatenate(intersection_points, axis=0)
-        vanishing_point = np.mean(intersection_points, axis=0)
-        vanishing_point = vanishing_point.tolist()
-        vanishing_points.append(vanishing_point)
+    for dim in MISSING_IDX_CASES[missing_idx]:
+        points, valid = getAxisIntersections(getAxisEdges(img_calib['pontosguia'], dim))
+        countEvent("segment_intersections", int(np.sum(valid)))
+        vanishing_points.append(getVanishingPoint(points, valid))
     img_calib['pontosfuga'] = vanishing_points
 
 
@@ -190,7 +253,150 @@ def calibrateCamera(img_calib):
     - img_calib:dict, object with data about an image calibration (calibration segments + camera)
     """
     cab_type, missing_idx = getCalibType(img_calib)
-    getVanishingPoints(img_calib, missing_idx)
+    with stageTimer("getVanishingPoints"):
+        getVanishingPoints(img_calib, missing_idx)
+    with stageTimer("getOpticalCenter"):
+        getOpticalCenter(img_calib, missing_idx)
+    return img_calib
+
+
+def createCalibState(img_calib):
+    """
+    createCalibState creates the state of an incremental calibration, which keeps the intersections of every
+    pair of segments of each axis so changing a segment only computes the intersections of that segment
+
+    Parameters
+    - img_calib:dict, object with data about an image calibration (only calibration segments)
+
+    Return
+    - state:dict, keys img_calib (copy of the calibration), edges, points and valid (for each axis the segments
+    and their intersections as returned by getAxisIntersections)
+    """
+    state = {'img_calib': copy.deepcopy(img_calib), 'edges': [], 'points': [], 'valid': []}
+    for dim in range(3):
+        edges = getAxisEdges(img_calib['pontosguia'], dim)
+        points, valid = getAxisIntersections(edges)
+        state['edges'].append(edges)
+        state['points'].append(points)
+        state['valid'].append(valid)
+    return state
+
+
+def updateSegmentIntersections(state, dim, index):
+    """
+    updateSegmentIntersections computes the intersections of a segment with the other segments of its axis
+
+    Parameters
+    - state:dict, state of an incremental calibration as returned by createCalibState
+    - dim:int, index of the axis
+    - index:int, index of the segment on the axis
+
+    Return
+    - :None
+    """
+    edges, points, valid = state['edges'][dim], state['points'][dim], state['valid'][dim]
+    edge = edges[index:index + 1]
+    points[:index, index], valid[:index, index] = getIntersections(edges[:index], edge)
+    points[index, index + 1:], valid[index, index + 1:] = getIntersections(edge, edges[index + 1:])
+    countEvent("segment_intersections", len(edges) - 1)
+
+
+def moveSegment(state, dim, index, edge):
+    """
+    moveSegment moves a segment of an incremental calibration
+
+    Parameters
+    - state:dict, state of an incremental calibration as returned by createCalibState
+    - dim:int, index of the axis
+    - index:int, index of the segment on the axis
+    - edge:list, new segment as two points x,y
+
+    Return
+    - :None
+    """
+    state['img_calib']['pontosguia'][dim][2*index:2*index + 2] = copy.deepcopy(list(edge))
+    state['edges'][dim][index] = edge
+    updateSegmentIntersections(state, dim, index)
+
+
+def addSegment(state, dim, edge):
+    """
+    addSegment adds a segment to the end of an axis of an incremental calibration
+
+    Parameters
+    - state:dict, state of an incremental calibration as returned by createCalibState
+    - dim:int, index of the axis
+    - edge:list, segment as two points x,y
+
+    Return
+    - :None
+    """
+    state['img_calib']['pontosguia'][dim] += copy.deepcopy(list(edge))
+    state['edges'][dim] = np.concatenate([state['edges'][dim], np.array(edge, dtype=np.float64).reshape(1, 2, 2)])
+    state['points'][dim] = np.pad(state['points'][dim], ((0, 1), (0, 1), (0, 0)))
+    state['valid'][dim] = np.pad(state['valid'][dim], ((0, 1), (0, 1)))
+    updateSegmentIntersections(state, dim, len(state['edges'][dim]) - 1)
+
+
+def removeSegment(state, dim, index):
+    """
+    removeSegment removes a segment of an incremental calibration, keeping the intersections of the others
+
+    Parameters
+    - state:dict, state of an incremental calibration as returned by createCalibState
+    - dim:int, index of the axis
+    - index:int, index of the segment on the axis
+
+    Return
+    - :None
+    """
+    del state['img_calib']['pontosguia'][dim][2*index:2*index + 2]
+    state['edges'][dim] = np.delete(state['edges'][dim], index, axis=0)
+    state['points'][dim] = np.delete(np.delete(state['points'][dim], index, axis=0), index, axis=1)
+    state['valid'][dim] = np.delete(np.delete(state['valid'][dim], index, axis=0), index, axis=1)
+
+
+def updateCalibState(state, img_calib):
+    """
+    updateCalibState brings an incremental calibration to a new version of the calibration, moving, adding or
+    removing only the segments which differ from the current ones
+
+    Parameters
+    - state:dict, state of an incremental calibration as returned by createCalibState
+    - img_calib:dict, object with data about an image calibration (only calibration segments)
+
+    Return
+    - :None
+    """
+    pontosguia = state['img_calib']['pontosguia']
+    state['img_calib'] = dict(copy.deepcopy({key: value for key, value in img_calib.items()
+                                             if key != 'pontosguia'}), pontosguia=pontosguia)
+    for dim in range(3):
+        edges = getAxisEdges(img_calib['pontosguia'], dim)
+        n_common = min(len(edges), len(state['edges'][dim]))
+        for index in np.nonzero(np.any(edges[:n_common] != state['edges'][dim][:n_common], axis=(1, 2)))[0]:
+            moveSegment(state, dim, index, img_calib['pontosguia'][dim][2*index:2*index + 2])
+        for index in range(n_common, len(edges)):
+            addSegment(state, dim, img_calib['pontosguia'][dim][2*index:2*index + 2])
+        while len(state['edges'][dim]) > len(edges):
+            removeSegment(state, dim, len(state['edges'][dim]) - 1)
+
+
+def calibrateState(state):
+    """
+    calibrateState calibrates the camera of an incremental calibration from its kept intersections, giving the
+    same calibration as calibrateCamera over its segments
+
+    Parameters
+    - state:dict, state of an incremental calibration as returned by createCalibState
+
+    Return
+    - img_calib:dict, object with data about an image calibration (calibration segments + camera)
+    """
+    img_calib = dict(state['img_calib'], pontosguia=copy.deepcopy(state['img_calib']['pontosguia']))
+    cab_type, missing_idx = getCalibType(img_calib)
+    img_calib['pontosfuga'] = [getVanishingPoint(state['points'][dim], state['valid'][dim])
+                               for dim in MISSING_IDX_CASES[missing_idx]]
     getOpticalCenter(img_calib, missing_idx)
     return img_calib
 
@@ -0,0 +1,126 @@
+"""
+camera_projection.py is a collection of vectorized functions to use the camera of a calibration, mapping arrays of
+pixels to rays of the space, intersecting them with planes parallel to the axes and projecting points back,
+following projetarTela and desprojetarTela of TextureExtractor, where the camera is the origin of the space
+"""
+import numpy as np
+
+
+PLANE_AXES = {"YZ": 0, "XZ": 1, "XY": 2}
+
+
+def getCameraMatrix(img_calib):
+    """
+    getCameraMatrix returns the matrix whose columns are the X, Y and Z axes of the calibrated camera
+
+    Parameters
+    - img_calib:dict, object with data about an image calibration with camera
+
+    Return
+    - :np.array, of shape (3,3)
+    """
+    # Same layout as the column-major THREE.Matrix3 baseXYZ of TextureExtractor
+    return np.array(img_calib['base'], dtype=np.float64).reshape(3, 3).T
+
+
+def canvasToImage(points, img_dict):
+    """
+    canvasToImage converts points of the 1200x800 canvas to pixels of the image
+
+    Parameters
+    - points:np.array, x,y of the points on the canvas of shape (k,2)
+    - img_dict:dict, object with data about an image and its parameters
+
+    Return
+    - :np.array, x,y of the points on the image of shape (k,2)
+    """
+    offset = np.array([img_dict['wInicio'], img_dict['hInicio']], dtype=np.float64)
+    return (np.asarray(points, dtype=np.float64) - offset) / img_dict['cEscala']
+
+
+def imageToCanvas(points, img_dict):
+    """
+    imageToCanvas converts pixels of the image to points of the 1200x800 canvas
+
+    Parameters
+    - points:np.array, x,y of the points on the image of shape (k,2)
+    - img_dict:dict, object with data about an image and its parameters
+
+    Return
+    - :np.array, x,y of the points on the canvas of shape (k,2)
+    """
+    offset = np.array([img_dict['wInicio'], img_dict['hInicio']], dtype=np.float64)
+    return np.asarray(points, dtype=np.float64) * img_dict['cEscala'] + offset
+
+
+def projectPoints(points, img_calib):
+    """
+    projectPoints projects points of the space on the canvas of the image, as projetarTela of TextureExtractor
+
+    Parameters
+    - points:np.array, x,y,z of the points on the space of shape (k,3)
+    - img_calib:dict, object with data about an image calibration with camera
+
+    Return
+    - :np.array, x,y of the points on the canvas of shape (k,2), nan for points on the plane of the camera
+    """
+    C = np.array(img_calib['camera'], dtype=np.float64)
+    Q = np.asarray(points, dtype=np.float64) @ getCameraMatrix(img_calib).T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        depth = -C[2] / Q[:, 2:3]
+    return Q[:, :2] * depth + C[:2]
+
+
+def backProjectPoints(points, img_calib):
+    """
+    backProjectPoints returns the direction of the ray of the space through each point of the canvas, as
+    desprojetarTela of TextureExtractor, where every ray starts at the camera on the origin
+
+    Parameters
+    - points:np.array, x,y of the points on the canvas of shape (k,2)
+    - img_calib:dict, object with data about an image calibration with camera
+
+    Return
+    - :np.array, directions of the rays of shape (k,3), whose length is the distance to the canvas
+    """
+    C = np.array(img_calib['camera'], dtype=np.float64)
+    points = np.asarray(points, dtype=np.float64)
+    Q = np.empty((points.shape[0], 3))
+    Q[:, :2] = points - C[:2]
+    Q[:, 2] = -C[2]
+    return Q @ getCameraMatrix(img_calib)
+
+
+def intersectPlane(rays, plane, depth):
+    """
+    intersectPlane intersects rays starting at the camera with a plane parallel to two axes of the space
+
+    Parameters
+    - rays:np.array, directions of the rays of shape (k,3)
+    - plane:str, YZ, XZ or XY, or the index of the axis orthogonal to the plane
+    - depth:float, coordinate of the plane on the orthogonal axis
+
+    Return
+    - :np.array, x,y,z of the intersections of shape (k,3), nan for rays parallel to the plane
+    """
+    axis = PLANE_AXES.get(plane, plane)
+    rays = np.asarray(rays, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return rays * (depth / rays[:, axis:axis + 1])
+
+
+def backProjectToPlane(points, img_calib, plane, depth):
+    """
+    backProjectToPlane returns the points of the space on a plane parallel to two axes which project on the
+    given points of the canvas
+
+    Parameters
+    - points:np.array, x,y of the points on the canvas of shape (k,2)
+    - img_calib:dict, object with data about an image calibration with camera
+    - plane:str, YZ, XZ or XY, or the index of the axis orthogonal to the plane
+    - depth:float, coordinate of the plane on the orthogonal axis
+
+    Return
+    - :np.array, x,y,z of the points on the space of shape (k,3)
+    """
+    return intersectPlane(backProjectPoints(points, img_calib), plane, depth)
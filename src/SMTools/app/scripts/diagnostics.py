@@ -0,0 +1,160 @@
+"""
+diagnostics.py is a collection of functions to render the comparison plots of the other scripts into files, with
+a non-interactive backend on a background thread, so the stages never wait for rendering or need a display
+"""
+import os
+import copy
+from concurrent.futures import ThreadPoolExecutor, wait
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from scripts.shared_functions import drawCalibSegs
+from scripts.improve_edges import drawImprovement
+from scripts.improve_edge import drawSegs
+
+
+DIAGNOSTICS = {
+    "executor": None,
+    "futures": []
+}
+
+
+def renderFigure(draw, draw_args, filepath, nrows, ncols, figsize, preview_max_side=None):
+    """
+    renderFigure draws a figure with the Agg backend and saves it, optionally with a downscaled preview
+
+    Parameters
+    - draw:function, called as draw(axs, *draw_args) to fill the plot areas
+    - draw_args:tuple, arguments of draw
+    - filepath:str, path of the image file
+    - nrows:int, number of rows of plot areas
+    - ncols:int, number of columns of plot areas
+    - figsize:tuple, size of figure in inches
+    - preview_max_side:int, maximum side in pixels of the preview, None disables it
+
+    Return
+    - outputs:list, paths of the saved files
+    """
+    dpi = 80
+    fig = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(fig)
+    axs = fig.subplots(nrows, ncols)
+    draw(axs, *draw_args)
+    fig.tight_layout()
+
+    os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+    fig.savefig(filepath, dpi=dpi)
+    outputs = [filepath]
+    if preview_max_side is not None:
+        preview_dpi = min(dpi, preview_max_side / max(figsize))
+        preview_path = os.path.splitext(filepath)[0] + "_preview.png"
+        fig.savefig(preview_path, dpi=preview_dpi)
+        outputs.append(preview_path)
+    return outputs
+
+
+def submitFigure(draw, draw_args, filepath, nrows, ncols, figsize, preview_max_side=None):
+    """
+    submitFigure schedules renderFigure on the background thread and returns immediately
+
+    Parameters
+    - draw:function, called as draw(axs, *draw_args) to fill the plot areas
+    - draw_args:tuple, arguments of draw, which must not be modified until rendered
+    - filepath:str, path of the image file
+    - nrows:int, number of rows of plot areas
+    - ncols:int, number of columns of plot areas
+    - figsize:tuple, size of figure in inches
+    - preview_max_side:int, maximum side in pixels of the preview, None disables it
+
+    Return
+    - :concurrent.futures.Future, resolves to the paths of the saved files
+    """
+    if DIAGNOSTICS["executor"] is None:
+        # A single thread since matplotlib isn't thread-safe
+        DIAGNOSTICS["executor"] = ThreadPoolExecutor(max_workers=1)
+    future = DIAGNOSTICS["executor"].submit(renderFigure, draw, draw_args, filepath,
+                                            nrows, ncols, figsize, preview_max_side)
+    DIAGNOSTICS["futures"].append(future)
+    return future
+
+
+def submitCalibSegs(filepath, img_dict_list, img_calib_list, preview_max_side=None):
+    """
+    submitCalibSegs schedules the rendering of the calibration segments of multiple images
+
+    Parameters
+    - filepath:str, path of the image file
+    - img_dict_list:list, list of objects with data about an image and its parameters
+    - img_calib_list:list, list of objects with data about an image calibration
+    - preview_max_side:int, maximum side in pixels of the preview, None disables it
+
+    Return
+    - :concurrent.futures.Future, resolves to the paths of the saved files
+    """
+    img_dict_list = [{"img_canvas": img_dict["img_canvas"]}
+                     for img_dict in img_dict_list]
+    return submitFigure(drawCalibSegs, (img_dict_list, copy.deepcopy(img_calib_list)), filepath,
+                        1, len(img_dict_list), (10, 20), preview_max_side)
+
+
+def submitImprovement(filepath, img_dict, img_calib, img_calib_improved, preview_max_side=None):
+    """
+    submitImprovement schedules the rendering of calibration segments before and after improvement
+
+    Parameters
+    - filepath:str, path of the image file
+    - img_dict:dict, object with data about an image and its parameters
+    - img_calib:dict, object with data about an image calibration
+    - img_calib_improved:dict, object with data about an image calibration with segments improved
+    - preview_max_side:int, maximum side in pixels of the preview, None disables it
+
+    Return
+    - :concurrent.futures.Future, resolves to the paths of the saved files
+    """
+    draw_args = ({"img_canvas": img_dict["img_canvas"]}, copy.deepcopy(img_calib),
+                 copy.deepcopy(img_calib_improved))
+    return submitFigure(drawImprovement, draw_args, filepath, 1, 2, (10, 20), preview_max_side)
+
+
+def submitSegs(filepath, p0, p1, best_p0, best_p1, edgesMatrix, image, preview_max_side=None):
+    """
+    submitSegs schedules the rendering of the comparison between an edge and its improved version
+
+    Parameters
+    - filepath:str, path of the image file
+    - p0:list, x,y of old p0
+    - p1:list, x,y of old p1
+    - best_p0:list, x,y of new p0
+    - best_p1:list, x,y of new p1
+    - edgesMatrix:np.array, [0,1] array of shape (m,n)
+    - image:np.array, array of shape (m,n,3) indicating RGB image
+    - preview_max_side:int, maximum side in pixels of the preview, None disables it
+
+    Return
+    - :concurrent.futures.Future, resolves to the paths of the saved files
+    """
+    draw_args = (list(p0), list(p1), list(best_p0), list(best_p1), edgesMatrix, image)
+    return submitFigure(drawSegs, draw_args, filepath, 2, 1, (20, 5), preview_max_side)
+
+
+def waitDiagnostics():
+    """
+    waitDiagnostics waits for every scheduled rendering to finish
+
+    Parameters
+    - :None
+
+    Return
+    - outputs:list, paths of the saved files
+    - errors:list, text of the exceptions raised while rendering
+    """
+    futures = DIAGNOSTICS["futures"]
+    DIAGNOSTICS["futures"] = []
+    wait(futures)
+    outputs, errors = [], []
+    for future in futures:
+        if future.exception() is not None:
+            errors.append(str(future.exception()))
+        else:
+            outputs += future.result()
+    return outputs, errors
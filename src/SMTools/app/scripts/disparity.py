@@ -0,0 +1,232 @@
+"""
+disparity.py is a collection of functions to compute the dense disparity of the pieces of a stereo card, rectifying
+them with the fundamental matrix of their SIFT matches and running a semi-global matcher over bands of rows in parallel
+"""
+import json
+import numpy as np
+import cv2 as cv
+from concurrent.futures import ThreadPoolExecutor
+
+from scripts.stereo_matching import sift
+from scripts.profiling import stageTimer, countEvent
+
+
+def getPyramidLevel(img, level):
+    """
+    getPyramidLevel returns an image with its sides halved level times
+
+    Parameters
+    - img:np.array, of shape (m,n,3)
+    - level:int, number of halvings, 0 for the original image
+
+    Return
+    - :np.array, of shape (m/2^level,n/2^level,3)
+    """
+    if level == 0:
+        return img
+    factor = 2 ** level
+    return cv.resize(img, (img.shape[1] // factor, img.shape[0] // factor), interpolation=cv.INTER_AREA)
+
+
+def isRectificationValid(H, size, max_area_ratio=2):
+    """
+    isRectificationValid tells if a rectifying homography keeps the image roughly in place, since uncalibrated
+    rectification becomes unstable when the epipoles are nearly at infinity, as for the pieces of a stereo card
+
+    Parameters
+    - H:np.array, homography of shape (3,3)
+    - size:tuple, width and height of the image
+    - max_area_ratio:float, maximum ratio between the areas of the warped and original images
+
+    Return
+    - :bool
+    """
+    w, h = size
+    corners = np.float64([[0, 0], [w, 0], [w, h], [0, h]]).reshape(-1, 1, 2)
+    warped = cv.perspectiveTransform(corners, H).reshape(-1, 2)
+    if not np.all(np.isfinite(warped)):
+        return False
+    area_ratio = cv.contourArea(warped.astype(np.float32)) / (w * h)
+    return 1 / max_area_ratio < area_ratio < max_area_ratio and cv.isContourConvex(warped.astype(np.float32))
+
+
+def alignRows(pts1, pts2, threshold=1.5):
+    """
+    alignRows finds the affine transformation of the rows of img2 which best aligns them with the rows of img1,
+    keeping the columns, so the disparities of the matches are preserved
+
+    Parameters
+    - pts1:np.array, x,y of the matches on img1 of shape (k,2)
+    - pts2:np.array, x,y of the matches on img2 of shape (k,2)
+    - threshold:float, maximum vertical distance in pixels of an inlier
+
+    Return
+    - :np.array, homography of shape (3,3) from img2 to its aligned version
+    """
+    A = np.concatenate([pts2, np.ones((len(pts2), 1))], axis=1)
+    inliers = np.ones(len(pts2), dtype=bool)
+    # Least squares refitted on the inliers of the previous fit
+    for _ in range(5):
+        row = np.linalg.lstsq(A[inliers], pts1[inliers, 1], rcond=None)[0]
+        inliers = np.abs(A @ row - pts1[:, 1]) < max(threshold, 3 * np.median(np.abs(A @ row - pts1[:, 1])))
+    return np.array([[1, 0, 0], row, [0, 0, 1]], dtype=np.float64)
+
+
+def rectifyPair(img1, img2, pts1, pts2, threshold=1.5):
+    """
+    rectifyPair warps two images so their epipolar lines are horizontal, through the fundamental matrix of
+    their matches and uncalibrated rectification, or by aligning the rows of img2 with img1 when the
+    uncalibrated rectification distorts the images
+
+    Parameters
+    - img1:np.array, of shape (m,n,3)
+    - img2:np.array, of shape (m,n,3)
+    - pts1:np.array, x,y of the matches on img1 of shape (k,2)
+    - pts2:np.array, x,y of the matches on img2 of shape (k,2)
+    - threshold:float, maximum distance in pixels of an inlier to its epipolar line
+
+    Return
+    - rect1:np.array, img1 rectified on the size of img1
+    - rect2:np.array, img2 rectified on the size of img1
+    - H1:np.array, homography of shape (3,3) from img1 to rect1
+    - H2:np.array, homography of shape (3,3) from img2 to rect2
+    - disparities:np.array, disparity of each inlier match after rectification
+    - method:str, uncalibrated or rows
+    """
+    pts1, pts2 = np.float64(pts1), np.float64(pts2)
+    if len(pts1) < 8:
+        raise ValueError("Not enough matches to rectify the pair: " + str(len(pts1)))
+    F, mask = cv.findFundamentalMat(pts1, pts2, cv.FM_RANSAC, threshold, 0.999)
+    if F is None or F.shape != (3, 3):
+        raise ValueError("Couldn't find the fundamental matrix of the pair")
+    inliers = mask.ravel() == 1
+    pts1, pts2 = pts1[inliers], pts2[inliers]
+    countEvent("rectification_inliers", len(pts1))
+
+    size = (img1.shape[1], img1.shape[0])
+    ok, H1, H2 = cv.stereoRectifyUncalibrated(pts1, pts2, F, size, threshold=threshold)
+    method = "uncalibrated"
+    if not ok or not isRectificationValid(H1, size) or not isRectificationValid(H2, size):
+        H1, H2 = np.eye(3), alignRows(pts1, pts2, threshold)
+        method = "rows"
+    rect1 = cv.warpPerspective(img1, H1, size)
+    rect2 = cv.warpPerspective(img2, H2, size)
+    rect_pts1 = cv.perspectiveTransform(pts1.reshape(-1, 1, 2), H1).reshape(-1, 2)
+    rect_pts2 = cv.perspectiveTransform(pts2.reshape(-1, 1, 2), H2).reshape(-1, 2)
+    return rect1, rect2, H1, H2, rect_pts1[:, 0] - rect_pts2[:, 0], method
+
+
+def getDisparityRange(disparities, margin=8):
+    """
+    getDisparityRange returns the search range of the matcher from the disparities of the matches, ignoring outliers
+
+    Parameters
+    - disparities:np.array, disparity of each match
+    - margin:int, pixels added to both ends of the range
+
+    Return
+    - min_disparity:int, minimum disparity searched
+    - num_disparities:int, number of disparities searched, multiple of 16
+    """
+    low, high = np.percentile(disparities, [1, 99])
+    min_disparity = int(np.floor(low)) - margin
+    num_disparities = int(np.ceil((high + margin - min_disparity) / 16)) * 16
+    return min_disparity, max(16, num_disparities)
+
+
+def computeDisparity(rect1, rect2, min_disparity, num_disparities, block_size=5, band_rows=256, workers=4):
+    """
+    computeDisparity computes the disparity of rect1 with a semi-global matcher over bands of rows, matched on a
+    pool of threads, where each band is extended by a margin so the borders of the bands are seamless
+
+    Parameters
+    - rect1:np.array, rectified image of shape (m,n,3)
+    - rect2:np.array, rectified image of shape (m,n,3)
+    - min_disparity:int, minimum disparity searched
+    - num_disparities:int, number of disparities searched, multiple of 16
+    - block_size:int, odd side of the matched blocks
+    - band_rows:int, rows of each band
+    - workers:int, number of threads
+
+    Return
+    - disparity:np.array, float16 of shape (m,n), nan where no disparity was found
+    """
+    gray1 = cv.cvtColor(rect1, cv.COLOR_BGR2GRAY)
+    gray2 = cv.cvtColor(rect2, cv.COLOR_BGR2GRAY)
+    height = gray1.shape[0]
+    margin = 4 * block_size
+
+    def matchBand(y0):
+        y1 = min(y0 + band_rows, height)
+        top, bottom = max(0, y0 - margin), min(height, y1 + margin)
+        matcher = cv.StereoSGBM_create(minDisparity=min_disparity, numDisparities=num_disparities,
+                                       blockSize=block_size, P1=8 * block_size ** 2, P2=32 * block_size ** 2,
+                                       uniquenessRatio=10, speckleWindowSize=100, speckleRange=2,
+                                       mode=cv.STEREO_SGBM_MODE_SGBM_3WAY)
+        band = matcher.compute(gray1[top:bottom], gray2[top:bottom])
+        return band[y0 - top:y1 - top]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        bands = list(executor.map(matchBand, range(0, height, band_rows)))
+    disparity = np.concatenate(bands, axis=0)
+    invalid = disparity < min_disparity * 16
+    disparity = (disparity / 16).astype(np.float16)
+    disparity[invalid] = np.nan
+    return disparity
+
+
+def computePairDisparity(img1, img2, level=1, block_size=5, band_rows=256, workers=4):
+    """
+    computePairDisparity rectifies two pieces of a stereo card and computes their disparity at a level of their
+    pyramid, where the matches are also found at that level
+
+    Parameters
+    - img1:np.array, left piece of shape (m,n,3)
+    - img2:np.array, right piece of shape (m,n,3)
+    - level:int, number of halvings of the pieces before matching
+    - block_size:int, odd side of the matched blocks
+    - band_rows:int, rows of each band
+    - workers:int, number of threads
+
+    Return
+    - disparity:np.array, float16 disparity of the rectified img1 at the level, nan where not found
+    - info:dict, json serializable parameters of the disparity (level, rectification, H1, H2, min_disparity,
+    num_disparities)
+    """
+    img1, img2 = getPyramidLevel(img1, level), getPyramidLevel(img2, level)
+    with stageTimer("disparity_matches"):
+        pts1, pts2 = sift(img1, img2)
+    with stageTimer("rectification"):
+        rect1, rect2, H1, H2, disparities, method = rectifyPair(
+            img1, img2, pts1, pts2)
+    min_disparity, num_disparities = getDisparityRange(disparities)
+    with stageTimer("sgbm"):
+        disparity = computeDisparity(rect1, rect2, min_disparity, num_disparities,
+                                     block_size, band_rows, workers)
+    # Pixels of the rectified image outside of img1
+    outside = cv.warpPerspective(np.ones(img1.shape[:2], dtype=np.uint8), H1,
+                                 (img1.shape[1], img1.shape[0])) == 0
+    disparity[outside] = np.nan
+    info = {"level": level, "shape": list(disparity.shape), "rectification": method,
+            "H1": H1.tolist(), "H2": H2.tolist(),
+            "min_disparity": min_disparity, "num_disparities": num_disparities,
+            "valid": float(np.mean(~np.isnan(disparity)))}
+    return disparity, info
+
+
+def saveDisparity(disparity, info, filepath):
+    """
+    saveDisparity saves a disparity as <filepath>.npy and its parameters as <filepath>.json
+
+    Parameters
+    - disparity:np.array, float16 disparity
+    - info:dict, json serializable parameters of the disparity
+    - filepath:str, path of the files without extension
+
+    Return
+    - :list, paths of the saved files
+    """
+    np.save(filepath + ".npy", disparity)
+    with open(filepath + ".json", 'w') as file:
+        json.dump(info, file, indent=4)
+    return [filepath + ".npy", filepath + ".json"]
@@ -0,0 +1,161 @@
+"""
+image_loader.py is a collection of functions to decode images only once, keeping the decoded arrays in an
+in-process LRU cache and optionally in memory-mapped .npy files on disk, with support for reduced-resolution decoding
+"""
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+import cv2 as cv
+import numpy as np
+
+
+CACHE_CONFIG = {
+    "MAX_BYTES": 1024 * 1024 * 1024,
+    "NPY_FOLDER": None
+}
+
+# Reduction factors supported natively by the JPEG decoder of opencv
+REDUCED_FLAGS = {1: cv.IMREAD_COLOR,
+                 2: cv.IMREAD_REDUCED_COLOR_2,
+                 4: cv.IMREAD_REDUCED_COLOR_4,
+                 8: cv.IMREAD_REDUCED_COLOR_8}
+
+_IMAGE_CACHE = OrderedDict()
+_IMAGE_CACHE_BYTES = [0]
+_IMAGE_CACHE_LOCK = threading.Lock()
+
+
+def setImageCache(max_bytes=None, npy_folder=None):
+    """
+    setImageCache changes the limits of the in-process cache and the folder for memory-mapped .npy files
+
+    Parameters
+    - max_bytes:int, maximum amount of bytes kept in the in-process cache (0 disables it)
+    - npy_folder:str, folder for the .npy files, an empty string disables the disk cache
+
+    Return
+    - :None
+    """
+    if max_bytes is not None:
+        CACHE_CONFIG["MAX_BYTES"] = max_bytes
+        with _IMAGE_CACHE_LOCK:
+            evictImages(max_bytes)
+    if npy_folder is not None:
+        CACHE_CONFIG["NPY_FOLDER"] = npy_folder if npy_folder != "" else None
+
+
+def clearImageCache():
+    """
+    clearImageCache drops every decoded image kept in the in-process cache
+
+    Parameters
+    - :None
+
+    Return
+    - :None
+    """
+    with _IMAGE_CACHE_LOCK:
+        _IMAGE_CACHE.clear()
+        _IMAGE_CACHE_BYTES[0] = 0
+
+
+def evictImages(max_bytes):
+    """
+    evictImages removes the least recently used images until the cache holds at most max_bytes,
+    must be called holding the cache lock
+
+    Parameters
+    - max_bytes:int, amount of bytes allowed in cache
+
+    Return
+    - :None
+    """
+    while _IMAGE_CACHE and _IMAGE_CACHE_BYTES[0] > max_bytes:
+        _, (_, nbytes) = _IMAGE_CACHE.popitem(last=False)
+        _IMAGE_CACHE_BYTES[0] -= nbytes
+
+
+def getImageKey(img_path, reduce=1):
+    """
+    getImageKey creates a key which changes whenever the file at img_path is modified
+
+    Parameters
+    - img_path:str, path of the image file
+    - reduce:int, reduction factor of the decoding
+
+    Return
+    - key:str, hexadecimal digest identifying the decoded image
+    """
+    stat = os.stat(img_path)
+    key_text = "|".join([os.path.abspath(img_path), str(stat.st_mtime_ns),
+                         str(stat.st_size), str(reduce)])
+    key = hashlib.sha1(key_text.encode()).hexdigest()
+    return key
+
+
+def decodeImage(img_path, reduce=1):
+    """
+    decodeImage reads an image from disk, using the reduced decoding of opencv when possible
+
+    Parameters
+    - img_path:str, path of the image file
+    - reduce:int, reduction factor, one of 1, 2, 4 or 8
+
+    Return
+    - img:np.array, uint8 of shape (m/reduce,n/reduce,3)
+    """
+    if reduce not in REDUCED_FLAGS:
+        raise ValueError("Reduction factor must be one of " +
+                         str(list(REDUCED_FLAGS.keys())))
+    img = cv.imread(img_path, REDUCED_FLAGS[reduce])
+    if img is None:
+        raise FileNotFoundError("Couldn't decode image at " + img_path)
+    return img
+
+
+def loadImage(img_path, reduce=1):
+    """
+    loadImage returns the decoded image at img_path, decoding it only if it isn't already on one of the caches.
+    The returned array is read-only since it is shared between every caller
+
+    Parameters
+    - img_path:str, path of the image file
+    - reduce:int, reduction factor, one of 1, 2, 4 or 8
+
+    Return
+    - img:np.array, uint8 of shape (m/reduce,n/reduce,3)
+    """
+    key = getImageKey(img_path, reduce)
+    with _IMAGE_CACHE_LOCK:
+        if key in _IMAGE_CACHE:
+            _IMAGE_CACHE.move_to_end(key)
+            return _IMAGE_CACHE[key][0]
+
+    img = None
+    npy_folder = CACHE_CONFIG["NPY_FOLDER"]
+    if npy_folder is not None:
+        npy_path = os.path.join(npy_folder, key + ".npy")
+        if os.path.exists(npy_path):
+            img = np.load(npy_path, mmap_mode='r')
+        else:
+            img = decodeImage(img_path, reduce)
+            os.makedirs(npy_folder, exist_ok=True)
+            tmp_path = npy_path + "." + str(os.getpid()) + ".tmp"
+            with open(tmp_path, 'wb') as file:
+                np.save(file, img)
+            os.replace(tmp_path, npy_path)
+            img = np.load(npy_path, mmap_mode='r')
+    else:
+        img = decodeImage(img_path, reduce)
+        img.flags.writeable = False
+
+    # Memory-mapped images live on the page cache, so they don't count to the in-process budget
+    nbytes = 0 if isinstance(img, np.memmap) else img.nbytes
+    if 0 < CACHE_CONFIG["MAX_BYTES"] and nbytes <= CACHE_CONFIG["MAX_BYTES"]:
+        with _IMAGE_CACHE_LOCK:
+            if key not in _IMAGE_CACHE:
+                _IMAGE_CACHE[key] = (img, nbytes)
+                _IMAGE_CACHE_BYTES[0] += nbytes
+                evictImages(CACHE_CONFIG["MAX_BYTES"])
+    return img
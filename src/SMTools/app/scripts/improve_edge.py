@@ -2,12 +2,19 @@
 improve_edge.py is an optimized set of scripts with numba in order to find the best
 pixels for an edge in order to maximize the sum of edge detection pixels across the segment
 """
+import heapq
+from concurrent.futures import ThreadPoolExecutor
 import matplotlib.pyplot as plt
 import cv2 as cv
 import numpy as np
 from scipy.ndimage import gaussian_filter
 from numba import jit
 
+from scripts.profiling import countEvent
+
+
+EDGE_OPERATORS = ["canny", "likelihood"]
+
 
 def toRGB(image):
     """
@@ -23,6 +30,51 @@ def toRGB(image):
     return np.concatenate(3 * [image.reshape((image.shape[0], image.shape[1], 1))], axis=2).astype(np.uint8)
 
 
+@jit(nopython=True)
+def scoreLine(x0, y0, x1, y1, edges):
+    """
+    scoreLine returns the mean of a [0,1] matrix of edges detection over the bresenham pixels between two points
+
+    Parameters
+    - x0:int, x coordinate of the first point
+    - y0:int, y coordinate of the first point
+    - x1:int, x coordinate of the second point
+    - y1:int, y coordinate of the second point
+    - edges:np.array, of shape (m,n) of [0,1] values
+
+    Return
+    - :float, mean of edges along the line
+    """
+    # SOURCE BEGIN
+    # https://en.wikipedia.org/wiki/Bresenham%27s_line_algorithm
+    dx = abs(x1 - x0)
+    sx = 1 if x0 < x1 else -1
+    dy = -abs(y1 - y0)
+    sy = 1 if y0 < y1 else -1
+    error = dx + dy
+
+    score = 0
+    count = 0
+    while True:
+        score += edges[y0, x0]
+        count += 1
+        if x0 == x1 and y0 == y1:
+            break
+        e2 = 2 * error
+        if e2 >= dy:
+            if x0 == x1:
+                break
+            error = error + dy
+            x0 = x0 + sx
+        if e2 <= dx:
+            if y0 == y1:
+                break
+            error = error + dx
+            y0 = y0 + sy
+    # SOURCE END
+    return score / count
+
+
 @jit(nopython=True)
 def optimizePoints(p0_list, p1_list, edges):
     """
@@ -44,41 +96,7 @@ def optimizePoints(p0_list, p1_list, edges):
     best_p1 = None
     for cur_p0 in p0_list:
         for cur_p1 in p1_list:
-            x0, y0, x1, y1 = cur_p0[0], cur_p0[1], cur_p1[0], cur_p1[1]
-
-            # SOURCE BEGIN
-            # https://en.wikipedia.org/wiki/Bresenham%27s_line_algorithm
-            dx = abs(x1 - x0)
-            sx = 1 if x0 < x1 else -1
-            dy = -abs(y1 - y0)
-            sy = 1 if y0 < y1 else -1
-            error = dx + dy
-
-            xcoordinates = []
-            ycoordinates = []
-            while True:
-                xcoordinates.append(x0)
-                ycoordinates.append(y0)
-                if x0 == x1 and y0 == y1:
-                    break
-                e2 = 2 * error
-                if e2 >= dy:
-                    if x0 == x1:
-                        break
-                    error = error + dy
-                    x0 = x0 + sx
-                if e2 <= dx:
-                    if y0 == y1:
-                        break
-                    error = error + dx
-                    y0 = y0 + sy
-            # SOURCE END
-
-            score = 0
-            for i in range(len(xcoordinates)):
-                score += edges[ycoordinates[i], xcoordinates[i]]
-            score = score / len(xcoordinates)
-
+            score = scoreLine(cur_p0[0], cur_p0[1], cur_p1[0], cur_p1[1], edges)
             if score > best_score:
                 best_score = score
                 best_p0 = cur_p0
@@ -86,6 +104,249 @@ def optimizePoints(p0_list, p1_list, edges):
     return best_p0, best_p1, best_score
 
 
+@jit(nopython=True)
+def getPairsBand(p0_list, p1_list, i_lo, i_hi, j_lo, j_hi, transposed):
+    """
+    getPairsBand returns the rows where the lines between p0_list[i_lo:i_hi] and p1_list[j_lo:j_hi] may have
+    their pixel, for each column of their major axis
+
+    Parameters
+    - p0_list:np.array, of shape (n0,2) of consecutive pixels x,y
+    - p1_list:np.array, of shape (n1,2) of consecutive pixels x,y
+    - i_lo:int, first index of p0_list
+    - i_hi:int, index after the last of p0_list
+    - j_lo:int, first index of p1_list
+    - j_hi:int, index after the last of p1_list
+    - transposed:bool, True if the major axis of the lines is y instead of x
+
+    Return
+    - col_lo:int, first column crossed by the lines
+    - rows:np.array, int of shape (n,2) with the first and last row of each column from col_lo
+    - du:int, shortest length of the lines along the major axis, -1 if they do not all have this major axis
+    """
+    u = 1 if transposed else 0
+    v = 1 - u
+
+    pu_min, pu_max = p0_list[i_lo, u], p0_list[i_lo, u]
+    pv_min, pv_max = p0_list[i_lo, v], p0_list[i_lo, v]
+    for i in range(i_lo + 1, i_hi):
+        pu_min, pu_max = min(pu_min, p0_list[i, u]), max(pu_max, p0_list[i, u])
+        pv_min, pv_max = min(pv_min, p0_list[i, v]), max(pv_max, p0_list[i, v])
+    qu_min, qu_max = p1_list[j_lo, u], p1_list[j_lo, u]
+    qv_min, qv_max = p1_list[j_lo, v], p1_list[j_lo, v]
+    for j in range(j_lo + 1, j_hi):
+        qu_min, qu_max = min(qu_min, p1_list[j, u]), max(qu_max, p1_list[j, u])
+        qv_min, qv_max = min(qv_min, p1_list[j, v]), max(qv_max, p1_list[j, v])
+    col_lo = min(pu_min, qu_min)
+    rows = np.empty((max(pu_max, qu_max) + 1 - col_lo, 2), dtype=np.int64)
+
+    # Lines going both ways along the major axis are only bounded by the box of their points
+    if qu_min - pu_max > 0:
+        du = qu_min - pu_max
+    elif qu_max - pu_min < 0:
+        du = pu_min - qu_max
+    else:
+        rows[:, 0] = min(pv_min, qv_min)
+        rows[:, 1] = max(pv_max, qv_max)
+        return col_lo, rows, -1
+    dv = max(abs(qv_min - pv_max), abs(qv_max - pv_min))
+
+    # Pixels of each range may leave the chord between its first and last pixels, each line keeps its pixels
+    # within half a pixel of the line between its points, both deviations growing with the slope
+    margin = 0.5
+    for p_list, lo, hi in ((p0_list, i_lo, i_hi), (p1_list, j_lo, j_hi)):
+        if hi - lo > 2:
+            slope = (p_list[hi - 1, u] - p_list[lo, u]) / (p_list[hi - 1, v] - p_list[lo, v])
+            for k in range(lo + 1, hi - 1):
+                margin = max(margin, 0.5 + abs(p_list[k, u] - p_list[lo, u] - (p_list[k, v] - p_list[lo, v]) * slope))
+    margin *= max(1.0, dv / du)
+
+    # At a fixed column the line is monotonic in the position of each point along the chord, so its range is
+    # given by the four corner lines
+    a_u, a_v = p0_list[i_lo, u], p0_list[i_lo, v]
+    b_u, b_v = p0_list[i_hi - 1, u], p0_list[i_hi - 1, v]
+    c_u, c_v = p1_list[j_lo, u], p1_list[j_lo, v]
+    d_u, d_v = p1_list[j_hi - 1, u], p1_list[j_hi - 1, v]
+    slope_ac = (c_v - a_v) / (c_u - a_u)
+    slope_ad = (d_v - a_v) / (d_u - a_u)
+    slope_bc = (c_v - b_v) / (c_u - b_u)
+    slope_bd = (d_v - b_v) / (d_u - b_u)
+    for k in range(len(rows)):
+        col = col_lo + k
+        pos_ac = a_v + (col - a_u) * slope_ac
+        pos_ad = a_v + (col - a_u) * slope_ad
+        pos_bc = b_v + (col - b_u) * slope_bc
+        pos_bd = b_v + (col - b_u) * slope_bd
+        lo = min(min(pos_ac, pos_ad), min(pos_bc, pos_bd))
+        hi = max(max(pos_ac, pos_ad), max(pos_bc, pos_bd))
+        rows[k, 0] = int(np.ceil(lo - margin - 1e-6))
+        rows[k, 1] = int(np.floor(hi + margin + 1e-6))
+    # Every line takes exactly one pixel per column only along its major axis
+    return col_lo, rows, du if dv <= du else -1
+
+
+@jit(nopython=True)
+def createBandTable(edges, col_lo, rows, transposed):
+    """
+    createBandTable returns a sparse table of the maximum edge value over every power of two of consecutive rows
+    of a band, to get the maximum over any range of rows of a column with two lookups
+
+    Parameters
+    - edges:np.array, of shape (m,n) of [0,1] values
+    - col_lo:int, first column of the band
+    - rows:np.array, int of shape (n,2) with the first and last row of each column from col_lo
+    - transposed:bool, True if the columns are rows of edges
+
+    Return
+    - table:np.array, of shape (levels,n,width) where table[l,k,r] is the maximum of 2**l rows from rows[k,0]+r
+    """
+    size_v, size_u = (edges.shape[1], edges.shape[0]) if transposed else (edges.shape[0], edges.shape[1])
+    width = 1
+    for k in range(len(rows)):
+        rows[k, 0] = max(rows[k, 0], 0)
+        rows[k, 1] = min(rows[k, 1], size_v - 1)
+        width = max(width, rows[k, 1] - rows[k, 0] + 1)
+    levels = 1
+    while (1 << levels) <= width:
+        levels += 1
+
+    table = np.zeros((levels, len(rows), width))
+    for k in range(len(rows)):
+        col = col_lo + k
+        if col < 0 or col >= size_u:
+            continue
+        for r in range(rows[k, 1] - rows[k, 0] + 1):
+            row = rows[k, 0] + r
+            table[0, k, r] = edges[col, row] if transposed else edges[row, col]
+    for level in range(1, levels):
+        step = 1 << (level - 1)
+        for k in range(len(rows)):
+            for r in range(width):
+                if r + step < width:
+                    table[level, k, r] = max(table[level - 1, k, r], table[level - 1, k, r + step])
+                else:
+                    table[level, k, r] = table[level - 1, k, r]
+    return table
+
+
+@jit(nopython=True)
+def boundPairs(p0_list, p1_list, i_lo, i_hi, j_lo, j_hi, table, col_lo, rows, transposed):
+    """
+    boundPairs returns an upper bound of the score of every pair between p0_list[i_lo:i_hi] and
+    p1_list[j_lo:j_hi], as the sum over the columns of the major axis of the maximum edge value
+    the lines can cross, divided by the shortest line
+
+    Parameters
+    - p0_list:np.array, of shape (n0,2) of consecutive pixels x,y
+    - p1_list:np.array, of shape (n1,2) of consecutive pixels x,y
+    - i_lo:int, first index of p0_list
+    - i_hi:int, index after the last of p0_list
+    - j_lo:int, first index of p1_list
+    - j_hi:int, index after the last of p1_list
+    - table:np.array, sparse table of the band of all the pairs as returned by createBandTable
+    - col_lo:int, first column of the band of all the pairs
+    - rows:np.array, int of shape (n,2) with the first and last row of the band of all the pairs
+    - transposed:bool, True if the major axis of the lines is y instead of x
+
+    Return
+    - :float, upper bound of the scores, inf if the lines do not share a major axis
+    """
+    node_col_lo, node_rows, du = getPairsBand(p0_list, p1_list, i_lo, i_hi, j_lo, j_hi, transposed)
+    if du < 0:
+        return np.inf
+
+    total = 0.0
+    for k in range(len(node_rows)):
+        # The band of all the pairs holds every pixel, so the rows out of it can be dropped
+        band_k = node_col_lo + k - col_lo
+        lo = max(node_rows[k, 0], rows[band_k, 0])
+        hi = min(node_rows[k, 1], rows[band_k, 1])
+        if lo > hi:
+            continue
+        level = 0
+        while (2 << level) <= hi - lo + 1:
+            level += 1
+        total += max(table[level, band_k, lo - rows[band_k, 0]],
+                     table[level, band_k, hi + 1 - (1 << level) - rows[band_k, 0]])
+    return total / (du + 1)
+
+
+@jit(nopython=True)
+def optimizePointsBound(p0_list, p1_list, edges, leaf_pairs=4):
+    """
+    optimizePointsBound finds the same pair as optimizePoints with a branch and bound search, splitting the
+    ranges of p0_list and p1_list and skipping the ranges whose upper bound cannot beat the best pair found
+
+    Parameters
+    - p0_list:np.array, of shape (n0,2) of consecutive pixels x,y
+    - p1_list:np.array, of shape (n1,2) of consecutive pixels x,y
+    - edges:np.array, of shape (m,n) of [0,1] values
+    - leaf_pairs:int, number of pairs under which a range is scored exhaustively
+
+    Return
+    - best_p0:list, list of len 2 indicating x,y
+    - best_p1:list, list of len 2 indicating x,y
+    - best_score:float, best score found in optimization step
+    - evaluated:int, number of pairs scored
+    """
+    n0 = len(p0_list)
+    n1 = len(p1_list)
+    height, width = edges.shape
+    inside = True
+    for p in (p0_list, p1_list):
+        for k in range(len(p)):
+            if p[k, 0] < 0 or p[k, 0] >= width or p[k, 1] < 0 or p[k, 1] >= height:
+                inside = False
+    if not inside:
+        best_p0, best_p1, best_score = optimizePoints(p0_list, p1_list, edges)
+        return best_p0, best_p1, float(best_score), n0 * n1
+
+    transposed = abs(p1_list[n1 // 2, 1] - p0_list[n0 // 2, 1]) > abs(p1_list[n1 // 2, 0] - p0_list[n0 // 2, 0])
+    col_lo, rows, du = getPairsBand(p0_list, p1_list, 0, n0, 0, n1, transposed)
+    table = createBandTable(edges, col_lo, rows, transposed)
+
+    # Best first search, the heap keeps the ranges still to explore sorted by their negated bound
+    heap = [(-np.inf, 0, n0, 0, n1)]
+    best_score = 0.0
+    best_i = -1
+    best_j = -1
+    evaluated = 0
+    while len(heap) > 0:
+        bound, i_lo, i_hi, j_lo, j_hi = heapq.heappop(heap)
+        bound = -bound
+        # The margin covers the different summation order of bound and score
+        if bound * (1 + 1e-9) < best_score or (best_i < 0 and bound <= 0):
+            break
+
+        if (i_hi - i_lo) * (j_hi - j_lo) <= leaf_pairs:
+            for i in range(i_lo, i_hi):
+                for j in range(j_lo, j_hi):
+                    score = scoreLine(p0_list[i, 0], p0_list[i, 1], p1_list[j, 0], p1_list[j, 1], edges)
+                    evaluated += 1
+                    # Ties keep the first pair in the order of optimizePoints
+                    if score > best_score or (score == best_score and best_i >= 0 and
+                                              (i < best_i or (i == best_i and j < best_j))):
+                        best_score = score
+                        best_i = i
+                        best_j = j
+            continue
+
+        if i_hi - i_lo >= j_hi - j_lo:
+            mid = (i_lo + i_hi) // 2
+            children = ((i_lo, mid, j_lo, j_hi), (mid, i_hi, j_lo, j_hi))
+        else:
+            mid = (j_lo + j_hi) // 2
+            children = ((i_lo, i_hi, j_lo, mid), (i_lo, i_hi, mid, j_hi))
+        for c_i_lo, c_i_hi, c_j_lo, c_j_hi in children:
+            bound = boundPairs(p0_list, p1_list, c_i_lo, c_i_hi, c_j_lo, c_j_hi, table, col_lo, rows, transposed)
+            if bound * (1 + 1e-9) >= best_score:
+                heapq.heappush(heap, (-bound, c_i_lo, c_i_hi, c_j_lo, c_j_hi))
+
+    if best_i < 0:
+        return None, None, best_score, evaluated
+    return p0_list[best_i], p1_list[best_j], best_score, evaluated
+
+
 def segsPlot(p0, p1, best_p0, best_p1, edgesMatrix, image, fig_size=(20, 10)):
     """
     segsPlot creates a matplotlib image with the comparison between previous edge and its improved version
@@ -103,6 +364,29 @@ def segsPlot(p0, p1, best_p0, best_p1, edgesMatrix, image, fig_size=(20, 10)):
     - :None
     """
     fig, axs = plt.subplots(2, 1, figsize=fig_size, dpi=80)
+    drawSegs(axs, p0, p1, best_p0, best_p1, edgesMatrix, image)
+    plt.subplots_adjust(left=None, bottom=None, right=None,
+                        top=None, wspace=None, hspace=None)
+    plt.tight_layout()
+    plt.show()
+
+
+def drawSegs(axs, p0, p1, best_p0, best_p1, edgesMatrix, image):
+    """
+    drawSegs draws the comparison between previous edge and its improved version over the image and the edges matrix
+
+    Parameters
+    - axs:list, two matplotlib plot areas
+    - p0:list, x,y of old p0
+    - p1:list, x,y of old p1
+    - best_p0:list, x,y of new p0
+    - best_p1:list, x,y of new p1
+    - edgesMatrix:np.array, [0,1] array of shape (m,n)
+    - image:np.array, array of shape (m,n,3) indicating RGB image
+
+    Return
+    - :None
+    """
     min_x = min(int(np.min([best_p0[0], best_p1[0]]) - 10),
                 int(np.min([p0[0], p1[0]]) - 10))
     min_y = min(int(np.min([best_p0[1], best_p1[1]]) - 10),
@@ -125,11 +409,6 @@ def segsPlot(p0, p1, best_p0, best_p1, edgesMatrix, image, fig_size=(20, 10)):
     axs[1].plot(previous_edge['x'], previous_edge['y'], c='r')
     axs[1].plot(improved_edge['x'], improved_edge['y'], c='g')
 
-    plt.subplots_adjust(left=None, bottom=None, right=None,
-                        top=None, wspace=None, hspace=None)
-    plt.tight_layout()
-    plt.show()
-
 
 def bresenham(p0, p1):
     """
@@ -210,6 +489,49 @@ def createPointsOrt(p0, p1, radius):
     return p0_arr.astype(np.int32), p1_arr.astype(np.int32)
 
 
+def slideEnds(p0, p1, edgesMatrix, radius, level=0.5):
+    """
+    slideEnds moves the ends of a segment along its line up to radius pixels inwards or outwards, to the extent
+    of the line with the highest sum of edge values above level times their mean over the segment, where each
+    end is found on its own from the cumulative profile of edges along the line
+
+    Parameters
+    - p0:np.array, x,y of the first end
+    - p1:np.array, x,y of the second end
+    - edgesMatrix:np.array, of shape (m,n), has values on [0,1] for edge likelihood
+    - radius:float, maximum distance in pixels that each end slides
+    - level:float, fraction of the mean edge value over the segment that a pixel must exceed to be included
+
+    Return
+    - p0:np.array, x,y of the first end
+    - p1:np.array, x,y of the second end
+    """
+    height, width = edgesMatrix.shape
+    length = np.linalg.norm(p1 - p0)
+    if length == 0:
+        return p0, p1
+    direction = (p1 - p0) / length
+    pixels = bresenham(np.round(p0 - radius * direction), np.round(p1 + radius * direction))
+    pixels = pixels[(pixels[:, 0] >= 0) & (pixels[:, 0] < width) & (pixels[:, 1] >= 0) & (pixels[:, 1] < height)]
+    profile = edgesMatrix[pixels[:, 1], pixels[:, 0]]
+    t = (pixels - p0) @ direction
+
+    segment = profile[(t >= 0) & (t <= length)]
+    if len(segment) == 0 or np.mean(segment) <= 0:
+        return p0, p1
+    # The sum over pixels a to b is gain[b + 1] - gain[a], so the first end minimizes gain[a] and
+    # the second end maximizes gain[b + 1]
+    gain = np.concatenate([[0], np.cumsum(profile - level * np.mean(segment))])
+    first = np.flatnonzero((np.abs(t) <= radius) & (t < length / 2))
+    last = np.flatnonzero((np.abs(t - length) <= radius) & (t > length / 2))
+    if len(first) == 0 or len(last) == 0:
+        return p0, p1
+    a = first[np.argmin(gain[first])]
+    b = last[np.argmax(gain[last + 1])]
+    # The ends stay on the line of the segment instead of the pixels of the profile
+    return np.int32(np.round(p0 + t[a] * direction)), np.int32(np.round(p0 + t[b] * direction))
+
+
 def cannyGaussian(img):
     """
     cannyGaussian uses Canny edge detection algorithm and gaussian blur to find edges matrix of an img
@@ -230,26 +552,104 @@ def cannyGaussian(img):
     return edgesMatrix
 
 
-def improveEdges(img, edges, plot=False, edgesMatrix=None):
+def edgeLikelihood(img, orientation=False, workers=None, tile_rows=256):
+    """
+    edgeLikelihood finds the same edges matrix as cannyGaussian on float32, where after Canny each tile of rows is
+    blurred and scaled to [0,1] by a single separable filter written into the result, so there is no full size
+    temporary, and the tiles are processed in parallel threads, one on workers limited to one opencv thread, where
+    the serial Canny pass over the whole image takes most of the time and bounds the speedup to about 1.5x
+
+    Parameters
+    - img:np.array, of shape (m,n,3)
+    - orientation:bool, to also return the orientation of the gradient of the grey image
+    - workers:int, number of threads, defaults to the number of threads of opencv
+    - tile_rows:int, number of rows of each tile
+
+    Return
+    - edgesMatrix:np.array, float32 of shape (m,n) indicating edges likelihood on a scale [0,1]
+    - angles:np.array, float32 of shape (m,n) with the angle of the gradient in radians on [0,2pi), only if
+    orientation is True
+    """
+    height, width = img.shape[:2]
+    mid = cv.Canny(img, 30, 150)
+    # Same kernel as the gaussian of cannyGaussian, the division by 255 is done by the vertical pass
+    kernel = np.exp(-0.5 * np.arange(-2, 3) ** 2)
+    kernel = kernel / kernel.sum()
+    kernel_x = kernel.astype(np.float32)
+    kernel_y = (kernel / 255).astype(np.float32)
+
+    edgesMatrix = np.empty((height, width), dtype=np.float32)
+    angles = np.empty((height, width), dtype=np.float32) if orientation else None
+
+    def processTile(r0):
+        r1 = min(r0 + tile_rows, height)
+        # Rows around the tile are read so the border of the image is only reflected on its first and last rows
+        h0, h1 = max(r0 - 2, 0), min(r1 + 2, height)
+        blurred = cv.sepFilter2D(mid[h0:h1], cv.CV_32F, kernel_x, kernel_y, borderType=cv.BORDER_REFLECT)
+        edgesMatrix[r0:r1] = blurred[r0 - h0:r1 - h0]
+        if orientation:
+            h0, h1 = max(r0 - 1, 0), min(r1 + 1, height)
+            grey = img[h0:h1] if img.ndim == 2 else cv.cvtColor(img[h0:h1], cv.COLOR_BGR2GRAY)
+            dx = cv.Sobel(grey, cv.CV_32F, 1, 0, ksize=3)
+            dy = cv.Sobel(grey, cv.CV_32F, 0, 1, ksize=3)
+            angles[r0:r1] = cv.phase(dx, dy)[r0 - h0:r1 - h0]
+
+    workers = workers or cv.getNumThreads()
+    starts = range(0, height, tile_rows)
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(processTile, starts))
+    else:
+        for r0 in starts:
+            processTile(r0)
+
+    if orientation:
+        return edgesMatrix, angles
+    return edgesMatrix
+
+
+def findEdges(img, operator="canny"):
+    """
+    findEdges finds the edges matrix of an img with one of EDGE_OPERATORS, where canny is cannyGaussian and
+    likelihood is the float32 edgeLikelihood
+
+    Parameters
+    - img:np.array, of shape (m,n,3)
+    - operator:str, canny or likelihood
+
+    Return
+    - edgesMatrix:np.array, a numpy array indicating edges likelihood on a scale [0,1] of shape (m,n)
+    """
+    if operator == "canny":
+        return cannyGaussian(img)
+    if operator == "likelihood":
+        return edgeLikelihood(img)
+    raise ValueError("Unknown edge operator " + str(operator) + ", expected one of " + ", ".join(EDGE_OPERATORS))
+
+
+def improveEdges(img, edges, plot=False, edgesMatrix=None, search="bound", slide=False):
     """
     improveEdges merges all previous functions into a pipeline to, given an image and a list of edges, optimize
     each one with edgesMatrix as edge likelihood
 
     Parameters
-    - img:np.array, of shape (m,n,3)
+    - img:np.array, of shape (m,n,3), only needed to compute edgesMatrix or to plot
     - edges:list, list of len number of edges, where each item are two points x,y on list, e.g. [[[], []], [[], []], ...]
     - plot:bool, to plot or not the result
     - edgesMatrix:np.array, of shape (m,n), has values on [0,1] for edge likelihood
+    - search:str, "bound" to skip the pairs that cannot beat the best one or "exhaustive" to score every pair,
+    both find the same edges
+    - slide:bool, to also move the ends of each improved segment along its line, up to a tenth of its length
 
     Return
     - improvedEdges:list, list of len number of edges, where each item are two points x,y on list, e.g. [[[], []], [[], []], ...]
     """
-    height = img.shape[0]
-    width = img.shape[1]
-
     if type(edgesMatrix) == type(None):
         edgesMatrix = cannyGaussian(img)
 
+    height = edgesMatrix.shape[0]
+    width = edgesMatrix.shape[1]
+
     improvedEdges = []
     for p0, p1 in edges:
         p0 = np.array(p0)
@@ -259,8 +659,27 @@ def improveEdges(img, edges, plot=False, edgesMatrix=None):
         best_p1 = p1
         rOrt = np.ceil(min(width, height) / 100)
         p0_listOrt, p1_listOrt = createPointsOrt(p0, p1, rOrt)
-        best_p0, best_p1, best_score = optimizePoints(
-            p0_listOrt, p1_listOrt, edgesMatrix)
+        if search == "exhaustive":
+            best_p0, best_p1, best_score = optimizePoints(
+                p0_listOrt, p1_listOrt, edgesMatrix)
+            scored = len(p0_listOrt) * len(p1_listOrt)
+        else:
+            best_p0, best_p1, best_score, scored = optimizePointsBound(
+                p0_listOrt, p1_listOrt, edgesMatrix)
+        if best_p0 is None:
+            # No edge pixel around the segment, it is kept as annotated
+            best_p0, best_p1 = p0, p1
+        elif slide:
+            rSlide = max(rOrt, np.linalg.norm(best_p1 - best_p0) / 10)
+            best_p0, best_p1 = slideEnds(best_p0, best_p1, edgesMatrix, rSlide)
+            # The moved ends are snapped again to the best pixels around them, refitting the line to its new extent
+            p0_listSnap, p1_listSnap = createPointsOrt(best_p0, best_p1, 2)
+            snap_p0, snap_p1, _, _ = optimizePointsBound(p0_listSnap, p1_listSnap, edgesMatrix)
+            if snap_p0 is not None:
+                best_p0, best_p1 = snap_p0, snap_p1
+        countEvent("segments_improved")
+        countEvent("candidate_pairs", len(p0_listOrt) * len(p1_listOrt))
+        countEvent("candidate_pairs_scored", scored)
         improvedEdges.append([list(best_p0), list(best_p1)])
 
         if plot:
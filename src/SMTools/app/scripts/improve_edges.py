@@ -1,45 +1,199 @@
 """
 improve_edges.py makes a routine involving the edge improvent algorithm from improve_edge.py
 """
+import os
 import matplotlib.pyplot as plt
 import copy
+import numpy as np
+import cv2 as cv
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
-from scripts.improve_edge import improveEdges, cannyGaussian
+from scripts.improve_edge import improveEdges, findEdges
 from scripts.shared_functions import readImage, saveToFile, readJson, createImageDict, plotEdge
+from scripts.shared_arrays import shareArray, attachArray, detachArray, releaseArray
+from scripts.profiling import stageTimer
 
 
-def improveEdgesDict(img_dict, img_calib):
+def getImageEdges(img_dict, img_calib, dim):
     """
-    improveEdgesDict takes parameters about an image and its calibration and optimize each calibration segment
+    getImageEdges converts the calibration segments of an axis from the canvas to pixels of the image
+
+    Parameters
+    - img_dict:dict, object with data about an image and its parameters
+    - img_calib:dict, object with data about an image calibration
+    - dim:int, index of the axis
+
+    Return
+    - edges:list, list of len number of segments, where each item are two points x,y on list
+    """
+    cEscala, wInicio, hInicio = img_dict['cEscala'], img_dict['wInicio'], img_dict['hInicio']
+    points = [[int((1 / cEscala) * (x - wInicio)), int((1 / cEscala) * (y - hInicio))]
+              for x, y in img_calib['pontosguia'][dim]]
+    return [[points[2*j], points[2*j + 1]] for j in range(int(len(points) / 2))]
+
+
+def getCanvasPoints(img_dict, edges):
+    """
+    getCanvasPoints converts segments in pixels of the image to points of the canvas, as on pontosguia
+
+    Parameters
+    - img_dict:dict, object with data about an image and its parameters
+    - edges:list, list of len number of segments, where each item are two points x,y on list
+
+    Return
+    - :list, points x,y of the canvas, two per segment
+    """
+    cEscala, wInicio, hInicio = img_dict['cEscala'], img_dict['wInicio'], img_dict['hInicio']
+    return [[int(cEscala * x + wInicio), int(cEscala * y + hInicio)] for edge in edges for x, y in edge]
+
+
+def improveEdgesDict(img_dict, img_calib, slide=False, edge_operator="canny"):
+    """
+    improveEdgesDict takes parameters about an image and its calibration and optimize each calibration segment,
+    reusing the key edgesMatrix of the image dict when already computed
 
     Parameters
     - img_dict:dict, object with data about an image and its parameters
     - img_calib:dict, object with data about an image calibration 
+    - slide:bool, to also move the ends of each segment along its line
+    - edge_operator:str, operator of findEdges computing the edges matrix when missing
 
     Return
     - img_calib_improved:dict, object with data about an image calibration with segments improved
     """
     img_calib_improved = copy.deepcopy(img_calib)
-    edgesMatrix = cannyGaussian(img_dict['img'])
-    cEscala, wInicio, hInicio = img_dict['cEscala'], img_dict['wInicio'], img_dict['hInicio']
+    edgesMatrix = img_dict.get('edgesMatrix')
+    if edgesMatrix is None:
+        with stageTimer("findEdges"):
+            edgesMatrix = findEdges(img_dict['img'], edge_operator)
 
     for i in range(0, 3):
-        img_calib_improved['pontosguia'][i] = [[int((1 / cEscala) * (x - wInicio)),
-                                                int((1 / cEscala) * (y - hInicio))]
-                                               for x, y in img_calib_improved['pontosguia'][i]]
+        edges = getImageEdges(img_dict, img_calib, i)
+        with stageTimer("improveEdges"):
+            best_edges = improveEdges(
+                img_dict['img'], edges, plot=False, edgesMatrix=edgesMatrix, slide=slide)
+        img_calib_improved['pontosguia'][i] = getCanvasPoints(img_dict, best_edges)
+    return img_calib_improved
 
-        edges = [[img_calib_improved['pontosguia'][i][2*j],
-                  img_calib_improved['pontosguia'][i][2*j + 1]]
-                 for j in range(int(len(img_calib_improved['pontosguia'][i]) / 2))]
 
-        best_edges = improveEdges(
-            img_dict['img'], edges, plot=False, edgesMatrix=edgesMatrix)
+def initImproveWorker(edge_operator="canny"):
+    """
+    initImproveWorker limits opencv to one thread and compiles the numba kernel of improveEdges, for both
+    writeable and shared read-only edge maps, before the first task of a worker
 
-        img_calib_improved['pontosguia'][i] = [
-            point for edge in best_edges for point in edge]
-        img_calib_improved['pontosguia'][i] = [[int(cEscala * x + wInicio), int(cEscala * y + hInicio)]
-                                               for x, y in img_calib_improved['pontosguia'][i]]
-    return img_calib_improved
+    Parameters
+    - edge_operator:str, operator of findEdges, whose type of edge map is compiled
+
+    Return
+    - :None
+    """
+    cv.setNumThreads(1)
+    # edgeLikelihood returns float32 while cannyGaussian returns float64, each compiling its own kernel
+    edgesMatrix = np.zeros((32, 32), dtype=np.float32 if edge_operator == "likelihood" else np.float64)
+    edgesMatrix[16, :] = 1
+    improveEdges(None, [[[4, 15], [28, 17]]], edgesMatrix=edgesMatrix)
+    edgesMatrix.flags.writeable = False
+    improveEdges(None, [[[4, 15], [28, 17]]], edgesMatrix=edgesMatrix)
+
+
+def improveSharedEdges(handle, edges, slide=False):
+    """
+    improveSharedEdges optimizes segments of an image on a worker, over a zero-copy view of the shared edge map
+    which is detached after the task, since the worker is not told when the parent releases it
+
+    Parameters
+    - handle:dict, shared edges matrix as returned by shareArray
+    - edges:list, list of len number of segments, where each item are two points x,y on list
+    - slide:bool, to also move the ends of each segment along its line
+
+    Return
+    - :list, improved segments as returned by improveEdges
+    """
+    edgesMatrix = attachArray(handle)
+    try:
+        return improveEdges(None, edges, edgesMatrix=edgesMatrix, slide=slide)
+    finally:
+        del edgesMatrix
+        detachArray(handle)
+
+
+def improveEdgesParallel(img_calibs, loadImageDict, workers=None, max_images=None, slide=False,
+                         edge_operator="canny"):
+    """
+    improveEdgesParallel improves the calibration segments of many images over a pool of processes, where the edge
+    map of each image is computed once and placed in shared memory, so every worker refining one of its axes reads
+    the same pages instead of receiving a copy, and at most max_images edge maps are shared at once
+
+    Parameters
+    - img_calibs:list, objects with data about image calibrations (only calibration segments)
+    - loadImageDict:function, returns the image dict of a calibration, called only when its image is started
+    - workers:int, number of worker processes, defaults to the number of cores
+    - max_images:int, maximum number of images being improved at once, one more than the workers by default
+    - slide:bool, to also move the ends of each segment along its line
+    - edge_operator:str, operator of findEdges computing the edge maps
+
+    Return
+    - results:list, for each calibration a dict with keys img_calib (improved calibration, None if failed) and error
+    """
+    workers = workers or os.cpu_count() or 1
+    max_images = max_images or workers + 1
+    results = []
+    running = {}
+    tasks = {}
+
+    def finishImage(index):
+        image = running.pop(index)
+        releaseArray(image['handle'])
+        results[index] = {'img_calib': image['img_calib'], 'error': image['error']}
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=initImproveWorker,
+                                 initargs=(edge_operator,)) as executor:
+            def collect():
+                done, _ = wait(list(tasks.keys()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, dim = tasks.pop(future)
+                    image = running[index]
+                    image['pending'] -= 1
+                    try:
+                        image['img_calib']['pontosguia'][dim] = getCanvasPoints(image['img_dict'], future.result())
+                    except Exception as ex:
+                        image['error'] = str(ex)
+                    if image['pending'] == 0:
+                        if image['error'] is not None:
+                            image['img_calib'] = None
+                        finishImage(index)
+
+            for index, img_calib in enumerate(img_calibs):
+                results.append(None)
+                while len(running) >= max_images:
+                    collect()
+                try:
+                    img_dict = loadImageDict(img_calib)
+                    edgesMatrix = img_dict.get('edgesMatrix')
+                    if edgesMatrix is None:
+                        with stageTimer("findEdges"):
+                            edgesMatrix = findEdges(img_dict['img'], edge_operator)
+                    handle = shareArray(edgesMatrix)
+                except Exception as ex:
+                    results[index] = {'img_calib': None, 'error': str(ex)}
+                    continue
+                del edgesMatrix
+                img_calib = copy.deepcopy(img_calib)
+                # Only the parameters of the canvas are kept, the image and its private edge map are released
+                running[index] = {'handle': handle, 'img_calib': img_calib, 'error': None, 'pending': 3,
+                                  'img_dict': {key: img_dict[key] for key in ['cEscala', 'wInicio', 'hInicio']}}
+                for dim in range(3):
+                    tasks[executor.submit(improveSharedEdges, handle, getImageEdges(img_dict, img_calib, dim),
+                                          slide)] = (index, dim)
+                del img_dict
+            while tasks:
+                collect()
+    finally:
+        # Blocks of images left running by a failed pool
+        for image in running.values():
+            releaseArray(image['handle'])
+    return results
 
 
 def plotImprovement(img_dict, img_calib, img_calib_improved):
@@ -54,8 +208,25 @@ def plotImprovement(img_dict, img_calib, img_calib_improved):
     Return
     - :None
     """
-    img = img_dict["img_canvas"].copy()
     fig, axs = plt.subplots(1, 2, figsize=(10, 20), dpi=80)
+    drawImprovement(axs, img_dict, img_calib, img_calib_improved)
+    plt.show()
+
+
+def drawImprovement(axs, img_dict, img_calib, img_calib_improved):
+    """
+    drawImprovement draws calibration segments before and after improvement on two plot areas
+
+    Parameters
+    - axs:list, two matplotlib plot areas
+    - img_dict:dict, object with data about an image and its parameters
+    - img_calib:dict, object with data about an image calibration 
+    - img_calib_improved:dict, object with data about an image calibration with segments improved
+
+    Return
+    - :None
+    """
+    img = img_dict["img_canvas"].copy()
     axs[0].imshow(img)
     axs[1].imshow(img)
     for i, c in enumerate(['r', 'g', 'b']):
@@ -67,7 +238,6 @@ def plotImprovement(img_dict, img_calib, img_calib_improved):
             plotEdge(p0, p1, c, axs[0])
         for p0, p1 in edges_improved:
             plotEdge(p0, p1, c, axs[1])
-    plt.show()
 
 
 def improveJsonEdges(img_calib, img, plot=True):
@@ -0,0 +1,175 @@
+"""
+job_queue.py is a job queue to run the stages of pipeline.py over a whole collection, where each card is a job
+executed on a pool of processes, with a bounded queue, retries of failed cards and a state file to resume the run
+"""
+import os
+import time
+import asyncio
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from scripts.shared_functions import readJson, saveToFile
+from scripts.pipeline import runCard, submitCardFigures, initCardWorker
+from scripts.diagnostics import waitDiagnostics
+
+
+def readQueueState(state_path):
+    """
+    readQueueState returns the state of a previous run, or an empty state if there is none
+
+    Parameters
+    - state_path:str, path of the json state file, None disables it
+
+    Return
+    - :dict, object with key cards, the state of each job indexed by name of card (status, attempts, error, time
+    and the stages run)
+    """
+    if state_path is None or not os.path.exists(state_path):
+        return {"cards": {}}
+    return readJson(state_path)
+
+
+def saveQueueState(state, state_path):
+    """
+    saveQueueState saves the state of the run atomically, so an interrupted write never corrupts it
+
+    Parameters
+    - state:dict, object with key cards, the state of each job indexed by name of card
+    - state_path:str, path of the json state file
+
+    Return
+    - :None
+    """
+    tmp_path = state_path + ".tmp"
+    saveToFile(state, tmp_path)
+    os.replace(tmp_path, state_path)
+
+
+async def runJobs(card_names, stages, paths=None, options=None, workers=1, retries=2, state_path=None,
+                  queue_size=None, on_result=None):
+    """
+    runJobs runs the selected stages over many cards, with workers jobs at a time, retrying failed cards
+    and skipping the cards already finished on the state file with every selected stage
+
+    Parameters
+    - card_names:list, names of the cards
+    - stages:list, names of the stages to run, subset of STAGES
+    - paths:dict, folders of images and calibrations as in DEFAULT_PATHS
+    - options:dict, options of the run as in runCard, plus preview_max_side for the diagnostics
+    - workers:int, number of processes
+    - retries:int, attempts of a failed card after the first one
+    - state_path:str, path of the json state file, None disables resuming
+    - queue_size:int, maximum number of queued cards, twice workers by default
+    - on_result:function, called with the summary of each finished card
+
+    Return
+    - results:list, one summary per card run as returned by runCard, with key attempts
+    """
+    options = options or {}
+    loop = asyncio.get_running_loop()
+    # A single thread for file writes keeps the saves of the state file in order
+    io_executor = ThreadPoolExecutor(max_workers=1)
+    state = await loop.run_in_executor(io_executor, readQueueState, state_path)
+    queue = asyncio.Queue(maxsize=queue_size or 2 * workers)
+    results = []
+
+    def createPool():
+        return ProcessPoolExecutor(max_workers=workers, initializer=initCardWorker,
+                                   initargs=(options.get('memory_budget'),))
+
+    pool = {"executor": createPool()}
+
+    def failedResult(card_name, error):
+        return {'card': card_name, 'status': "failed", 'steps': [], 'outputs': [], 'error': error}
+
+    async def runAttempt(card_name):
+        executor = pool["executor"]
+        try:
+            return await loop.run_in_executor(executor, runCard, card_name, stages, paths, options)
+        except BrokenProcessPool as ex:
+            # A worker died (e.g. out of memory), the pool is replaced for the next attempts
+            if pool["executor"] is executor:
+                pool["executor"] = createPool()
+                executor.shutdown(wait=False)
+            return failedResult(card_name, "Worker process died: " + str(ex))
+        except Exception:
+            # runCard catches the errors of the stages, these come from sending the card to the pool
+            return failedResult(card_name, traceback.format_exc())
+
+    async def runJob(card_name):
+        for attempt in range(retries + 1):
+            result = await runAttempt(card_name)
+            if result['status'] == "ok":
+                break
+            if attempt < retries:
+                await asyncio.sleep(min(2 ** attempt, 30))
+        result['attempts'] = attempt + 1
+        figures = result.pop('figures', [])
+        try:
+            submitCardFigures(figures, options.get('preview_max_side'))
+        except Exception:
+            result.update({'status': "failed", 'error': traceback.format_exc()})
+        return result
+
+    async def saveResult(card_name, result):
+        state["cards"][card_name] = {'status': result['status'], 'attempts': result['attempts'],
+                                     'error': result['error'], 'time': time.time(), 'stages': list(stages)}
+        if state_path is not None:
+            await loop.run_in_executor(io_executor, saveQueueState,
+                                       {"cards": dict(state["cards"])}, state_path)
+
+    async def consume():
+        # Any error of a card is recorded as its failure, since once every consumer stopped the queue
+        # would wait forever
+        while True:
+            card_name = await queue.get()
+            try:
+                result = await runJob(card_name)
+                results.append(result)
+                try:
+                    await saveResult(card_name, result)
+                    if on_result is not None:
+                        on_result(result)
+                except Exception:
+                    result.update({'status': "failed", 'error': traceback.format_exc()})
+                    try:
+                        await saveResult(card_name, result)
+                    except Exception:
+                        pass
+            except Exception:
+                results.append(dict(failedResult(card_name, traceback.format_exc()), attempts=0))
+            finally:
+                queue.task_done()
+
+    def isFinished(card_name):
+        card_state = state["cards"].get(card_name, {})
+        return card_state.get('status') == "ok" and set(stages) <= set(card_state.get('stages', []))
+
+    consumers = [asyncio.ensure_future(consume()) for _ in range(workers)]
+    try:
+        for card_name in card_names:
+            if isFinished(card_name):
+                continue
+            # Waits while the queue is full, so cards are never listed far ahead of the workers
+            await queue.put(card_name)
+        await queue.join()
+    finally:
+        for consumer in consumers:
+            consumer.cancel()
+        pool["executor"].shutdown()
+    await loop.run_in_executor(io_executor, waitDiagnostics)
+    io_executor.shutdown()
+    return results
+
+
+def runQueue(card_names, stages, paths=None, options=None, workers=1, retries=2, state_path=None,
+             queue_size=None, on_result=None):
+    """
+    runQueue runs runJobs on a new event loop, see runJobs
+
+    Return
+    - results:list, one summary per card run as returned by runCard, with key attempts
+    """
+    return asyncio.run(runJobs(card_names, stages, paths, options, workers, retries, state_path,
+                               queue_size, on_result))
@@ -0,0 +1,623 @@
+"""
+pipeline.py is a collection of functions to run the stages of SMTools over stereo cards without user interaction,
+where a card is identified by the name of its stereo image and goes through the graph of stages
+split image -> improve edges -> calibrate camera -> propagate to pair -> improve edges -> calibrate camera
+and a card without annotation may start from proposed segments instead of annotated ones
+"""
+import os
+import copy
+import resource
+import traceback
+import cv2 as cv
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+
+from scripts.shared_functions import readJson, readImage, saveToFile, createImageDict, getStereoFilename, getCropsFilename, cropImage
+from scripts.image_loader import loadImage, setImageCache, clearImageCache
+from scripts.improve_edges import improveEdgesDict
+from scripts.camera_calibration import calibrateCamera
+from scripts.stereo_matching import stereoEdgesMatching
+from scripts.split_image import getStereoSplit, listStereoImages, initSplitWorker
+from scripts.stage_graph import createStage, runGraph
+from scripts.disparity import computePairDisparity, saveDisparity
+from scripts.segment_proposal import proposeCalibration
+from scripts.profiling import startProfiling, stopProfiling
+from scripts.diagnostics import submitCalibSegs, submitImprovement, waitDiagnostics
+
+
+STAGES = ["split", "propose", "improve", "calibrate", "propagate", "disparity"]
+
+# Stages run when none is selected, propose and disparity are only run on request
+DEFAULT_STAGES = ["split", "improve", "calibrate", "propagate"]
+
+# Each step is a stage applied to a side of the card, in order of execution
+STEPS = [("split", None),
+         ("propose", "left"),
+         ("improve", "left"),
+         ("calibrate", "left"),
+         ("propagate", "right"),
+         ("improve", "right"),
+         ("calibrate", "right"),
+         ("disparity", None)]
+
+# Version of the algorithm of each stage, part of its memo key, so it must be increased whenever the default
+# result of the stage changes and the values memoized by previous versions must not be reused
+STAGE_VERSIONS = {
+    "split": 1,
+    "propose": 1,
+    "improve": 1,
+    "calibrate": 1,
+    "propagate": 1,
+    "disparity": 1
+}
+
+DEFAULT_PATHS = {
+    "MAIN_FOLDER": "",
+    "IMAGES": "images/",
+    "CALIB": "calib/",
+    "CALIB_PREFIX": "cab-",
+    "MEMO": "memo/"
+}
+
+
+def getCardName(image_name):
+    """
+    getCardName returns the name of a card from its stereo image filename or path
+
+    Parameters
+    - image_name:str, filename, path or name of the stereo image
+
+    Return
+    - :str, name of the card
+    """
+    base_name = os.path.basename(image_name)
+    if os.path.splitext(base_name)[1] != "":
+        base_name = os.path.splitext(base_name)[0]
+    return base_name
+
+
+def listCards(paths):
+    """
+    listCards returns the name of every card with a stereo image inside the images folder
+
+    Parameters
+    - paths:dict, folders of images and calibrations as in DEFAULT_PATHS
+
+    Return
+    - :list, names of the cards
+    """
+    image_base_path = paths['MAIN_FOLDER'] + paths['IMAGES']
+    return [getCardName(image_path) for image_path in listStereoImages(image_base_path, recursive=False)]
+
+
+def findStereoImage(card_name, paths):
+    """
+    findStereoImage returns the path of the stereo image of a card
+
+    Parameters
+    - card_name:str, name of the card
+    - paths:dict, folders of images and calibrations as in DEFAULT_PATHS
+
+    Return
+    - :str, path of the stereo image
+    """
+    image_base_path = paths['MAIN_FOLDER'] + paths['IMAGES']
+    for extension in [".jpg", ".jpeg", ".png", ".tif", ".tiff"]:
+        image_path = image_base_path + card_name + extension
+        if os.path.exists(image_path):
+            return image_path
+    raise FileNotFoundError("Couldn't find stereo image of card " + card_name)
+
+
+def splitStage(image_path, images_path, card_name, crops_only, align=False):
+    """
+    splitStage splits the stereo image of a card, saving its pieces or their crop rectangles
+
+    Parameters
+    - image_path:str, path of the stereo image
+    - images_path:str, folder to save the pieces
+    - card_name:str, name of the card
+    - crops_only:bool, to save only the sidecar json with the crop rectangles
+    - align:bool, to align the left and right pieces by phase correlation
+
+    Return
+    - crops:dict, crop rectangles of the pieces
+    """
+    img = loadImage(image_path)
+    crops = getStereoSplit(img, crops_only=True, align=align)
+    if crops_only:
+        saveToFile({"source": os.path.basename(image_path), "crops": crops},
+                   images_path + getCropsFilename(card_name))
+    else:
+        for side in ["left", "right", "middle"]:
+            output_path = images_path + card_name + "_" + side + ".jpg"
+            if not cv.imwrite(output_path, cropImage(img, crops[side])):
+                raise IOError("Couldn't write image at " + output_path)
+    return crops
+
+
+def splitImageStage(crops, image_path, side):
+    """
+    splitImageStage returns a piece of the stereo image just splitted as a view of the source, with its parameters
+
+    Parameters
+    - crops:dict, crop rectangles of the pieces
+    - image_path:str, path of the stereo image
+    - side:str, left or right
+
+    Return
+    - :dict, object with data about an image and its parameters
+    """
+    return createImageDict(cropImage(loadImage(image_path), crops[side]))
+
+
+def readImageStage(image_name, extension, images_path, reduce=1):
+    """
+    readImageStage reads a piece of a stereo image, with its parameters
+
+    Parameters
+    - image_name:str, name of the piece
+    - extension:str, extension of the piece
+    - images_path:str, folder of the images
+    - reduce:int, reduction factor of the decoding (1, 2, 4 or 8)
+
+    Return
+    - :dict, object with data about an image and its parameters
+    """
+    img_calib = {'nomeImagem': image_name, 'extensao': extension}
+    return createImageDict(readImage(img_calib, images_path, reduce))
+
+
+def proposeStage(img_dict, image_name, extension, edge_operator="canny"):
+    """
+    proposeStage proposes the calibration segments of an image without annotation
+
+    Parameters
+    - img_dict:dict, object with data about an image and its parameters
+    - image_name:str, name of the image
+    - extension:str, extension of the image
+    - edge_operator:str, operator of findEdges computing the edges matrix
+
+    Return
+    - :dict, object with data about an image calibration (only calibration segments)
+    """
+    return proposeCalibration(img_dict, image_name, extension, edge_operator=edge_operator)
+
+
+def improveStage(img_calib, img_dict, slide=False, edge_operator="canny"):
+    """
+    improveStage improves the calibration segments of an image
+
+    Parameters
+    - img_calib:dict, object with data about an image calibration
+    - img_dict:dict, object with data about an image and its parameters
+    - slide:bool, to also move the ends of each segment along its line
+    - edge_operator:str, operator of findEdges computing the edges matrix
+
+    Return
+    - :dict, object with data about an image calibration
+    """
+    return improveEdgesDict(img_dict, img_calib, slide, edge_operator)
+
+
+def calibrateStage(img_calib):
+    """
+    calibrateStage calibrates the camera of an image
+
+    Parameters
+    - img_calib:dict, object with data about an image calibration
+
+    Return
+    - :dict, object with data about an image calibration
+    """
+    return calibrateCamera(copy.deepcopy(img_calib))
+
+
+def propagateStage(img1_calib, img1_dict, img2_dict, guided=False):
+    """
+    propagateStage creates the calibration of an image through stereo matching with its pair
+
+    Parameters
+    - img1_calib:dict, object with data about the calibration of the pair
+    - img1_dict:dict, object with data about the pair and its parameters
+    - img2_dict:dict, object with data about the image and its parameters
+    - guided:bool, to match with siftGuided and move the edges onto their epipolar lines
+
+    Return
+    - :dict, object with data about an image calibration
+    """
+    img2_calib = copy.deepcopy(img1_calib)
+    img2_calib['nomeImagem'] = getStereoFilename(img1_calib['nomeImagem'])
+    return stereoEdgesMatching(copy.deepcopy(img1_calib), img1_dict, img2_calib, img2_dict, guided)
+
+
+def disparityStage(img1_dict, img2_dict, output_path, level, reduce=1):
+    """
+    disparityStage computes the disparity between the pieces of a card and saves it
+
+    Parameters
+    - img1_dict:dict, object with data about the left image and its parameters
+    - img2_dict:dict, object with data about the right image and its parameters
+    - output_path:str, path of the disparity files without extension
+    - level:int, number of halvings of the pieces before matching
+    - reduce:int, reduction factor the pieces were already decoded with, a power of two up to 2^level
+
+    Return
+    - info:dict, parameters of the disparity with its files on key outputs
+    """
+    disparity, info = computePairDisparity(
+        img1_dict['img'], img2_dict['img'], level - (reduce.bit_length() - 1))
+    info['level'] = level
+    info['outputs'] = saveDisparity(disparity, info, output_path)
+    return info
+
+
+def getSideImageStage(card_name, side, paths, reduce=1):
+    """
+    getSideImageStage creates the stage which reads an already splitted piece of a card, hashing the files it depends on
+
+    Parameters
+    - card_name:str, name of the card
+    - side:str, left or right
+    - paths:dict, folders of images and calibrations as in DEFAULT_PATHS
+    - reduce:int, reduction factor of the decoding (1, 2, 4 or 8), the stage is named image_<side>_reduced if not 1
+
+    Return
+    - :dict, object with data about a stage
+    """
+    image_base_path = paths['MAIN_FOLDER'] + paths['IMAGES']
+    image_name = card_name + "_" + side
+    extension, files = "jpg", []
+    for candidate in ["jpg", "jpeg", "png", "tif", "tiff"]:
+        if os.path.exists(image_base_path + image_name + "." + candidate):
+            extension, files = candidate, [
+                image_base_path + image_name + "." + candidate]
+            break
+    crops_path = image_base_path + getCropsFilename(card_name)
+    if not files and os.path.exists(crops_path):
+        files = [crops_path, image_base_path +
+                 readJson(crops_path)['source']]
+    params = {'image_name': image_name, 'extension': extension, 'images_path': image_base_path}
+    if reduce == 1:
+        return createStage("image_" + side, readImageStage, memo=False, files=files, params=params)
+    params['reduce'] = reduce
+    return createStage("image_" + side + "_reduced", readImageStage, memo=False, files=files, params=params)
+
+
+def getEdgeParams(options):
+    """
+    getEdgeParams returns the parameters of the propose and improve stages selecting the edge operator, empty for
+    the default one
+
+    Parameters
+    - options:dict, options of the run with optional key edge_operator, one of EDGE_OPERATORS
+
+    Return
+    - :dict, with key edge_operator only when it isn't canny
+    """
+    edge_operator = options.get('edge_operator', "canny")
+    return {} if edge_operator == "canny" else {'edge_operator': edge_operator}
+
+
+def buildCardGraph(card_name, stages, paths, options):
+    """
+    buildCardGraph creates the graph of stages of a card for the selected stages, where every stage reads
+    the latest calibration of its side, starting from the annotations, and the parameter of an option is only
+    set when the option is enabled, so the memoized values of the default mode stay valid
+
+    Parameters
+    - card_name:str, name of the card
+    - stages:list, names of the stages to run, subset of STAGES
+    - paths:dict, folders of images and calibrations as in DEFAULT_PATHS
+    - options:dict, options of the run (crops_only, align_split, disparity_level, guided_matching, slide_ends,
+    edge_operator)
+
+    Return
+    - graph:dict, stages indexed by name
+    - steps:list, name of the stage of each step, or None if the step is skipped
+    - current:dict, name of the stage with the latest calibration of each side
+    """
+    image_base_path = paths['MAIN_FOLDER'] + paths['IMAGES']
+    calib_base_path = paths['MAIN_FOLDER'] + paths['CALIB']
+    graph = {}
+
+    if "split" in stages:
+        image_path = findStereoImage(card_name, paths)
+        crops_only = options.get('crops_only', False)
+        outputs = [image_base_path + getCropsFilename(card_name)] if crops_only else \
+            [image_base_path + card_name + "_" + side + ".jpg" for side in ["left", "right", "middle"]]
+        params = {'image_path': image_path, 'images_path': image_base_path,
+                  'card_name': card_name, 'crops_only': crops_only}
+        if options.get('align_split', False):
+            params['align'] = True
+        graph["split"] = createStage("split", splitStage, files=[image_path], outputs=outputs, params=params,
+                                     version=STAGE_VERSIONS["split"])
+        for side in ["left", "right"]:
+            graph["image_" + side] = createStage("image_" + side, splitImageStage, deps=["split"], memo=False,
+                                                 params={'image_path': image_path, 'side': side})
+    else:
+        for side in ["left", "right"]:
+            graph["image_" + side] = getSideImageStage(card_name, side, paths)
+
+    current = {}
+    for side in ["left", "right"]:
+        annotation_path = calib_base_path + \
+            paths['CALIB_PREFIX'] + card_name + "_" + side + ".json"
+        current[side] = None
+        if os.path.exists(annotation_path):
+            current[side] = "annotation_" + side
+            graph[current[side]] = createStage(current[side], readJson, memo=False, files=[annotation_path],
+                                               params={'filepath': annotation_path})
+
+    steps = []
+    for stage, side in STEPS:
+        if stage not in stages:
+            continue
+        if stage == "split":
+            steps.append("split")
+            continue
+        if stage == "disparity":
+            output_path = image_base_path + card_name + "_disparity"
+            level = options.get('disparity_level', 1)
+            params = {'output_path': output_path, 'level': level}
+            deps = ["image_left", "image_right"]
+            if "split" not in stages and level > 0:
+                # Pieces read from disk are decoded directly at the halved resolution the matching uses
+                params['reduce'] = 2 ** min(level, 3)
+                deps = []
+                for image_side in ["left", "right"]:
+                    graph["image_" + image_side + "_reduced"] = getSideImageStage(card_name, image_side, paths,
+                                                                                  params['reduce'])
+                    deps.append("image_" + image_side + "_reduced")
+            graph["disparity"] = createStage("disparity", disparityStage, deps=deps, params=params,
+                                             outputs=[output_path + ".npy", output_path + ".json"],
+                                             version=STAGE_VERSIONS["disparity"])
+            steps.append("disparity")
+            continue
+        name = stage + "_" + side
+        if stage == "propose" and current[side] is None:
+            # An annotation is always preferred, the proposal only replaces a missing one
+            params = {'image_name': card_name + "_" + side,
+                      'extension': graph["image_" + side]['params'].get('extension', "jpg")}
+            params.update(getEdgeParams(options))
+            graph[name] = createStage(name, proposeStage, deps=["image_" + side], params=params,
+                                      version=STAGE_VERSIONS["propose"])
+        elif stage == "improve" and current[side] is not None:
+            params = {'slide': True} if options.get('slide_ends', False) else {}
+            params.update(getEdgeParams(options))
+            graph[name] = createStage(name, improveStage, params=params,
+                                      deps=[current[side], "image_" + side], version=STAGE_VERSIONS["improve"])
+        elif stage == "calibrate" and current[side] is not None:
+            graph[name] = createStage(name, calibrateStage,
+                                      deps=[current[side]], version=STAGE_VERSIONS["calibrate"])
+        elif stage == "propagate" and current["left"] is not None:
+            params = {'guided': True} if options.get('guided_matching', False) else None
+            graph[name] = createStage(name, propagateStage, params=params,
+                                      deps=[current["left"], "image_left", "image_" + side],
+                                      version=STAGE_VERSIONS["propagate"])
+        else:
+            steps.append(None)
+            continue
+        current[side] = name
+        steps.append(name)
+    return graph, steps, current
+
+
+def getCardFigures(card_name, graph, values, status, diagnostics_path):
+    """
+    getCardFigures lists the comparison figures of every improve and propagate stage computed on a run
+
+    Parameters
+    - card_name:str, name of the card
+    - graph:dict, stages indexed by name
+    - values:dict, value of each evaluated stage indexed by name
+    - status:dict, computed or cached for each evaluated stage indexed by name
+    - diagnostics_path:str, folder to save the figures
+
+    Return
+    - figures:list, dicts with keys kind, filepath and args of each figure
+    """
+    figures = []
+    for name, stage_status in status.items():
+        if stage_status != "computed":
+            continue
+        filepath = os.path.join(diagnostics_path, card_name + "_" + name + ".png")
+        deps = graph[name]['deps']
+        if name.startswith("improve_"):
+            img_dict = {'img_canvas': values[deps[1]]['img_canvas']}
+            figures.append({'kind': "improvement", 'filepath': filepath,
+                            'args': (img_dict, values[deps[0]], values[name])})
+        elif name.startswith("propagate_"):
+            img_dict_list = [{'img_canvas': values[dep]['img_canvas']}
+                             for dep in deps[1:]]
+            figures.append({'kind': "calib_segs", 'filepath': filepath,
+                            'args': (img_dict_list, [values[deps[0]], values[name]])})
+    return figures
+
+
+def submitCardFigures(figures, preview_max_side=None):
+    """
+    submitCardFigures schedules the rendering of the figures listed by getCardFigures on the background thread
+
+    Parameters
+    - figures:list, dicts with keys kind, filepath and args of each figure
+    - preview_max_side:int, maximum side in pixels of the previews, None disables them
+
+    Return
+    - :list, futures of the renderings
+    """
+    submit = {"improvement": submitImprovement, "calib_segs": submitCalibSegs}
+    return [submit[figure['kind']](figure['filepath'], *figure['args'], preview_max_side=preview_max_side)
+            for figure in figures]
+
+
+def runCard(card_name, stages, paths=None, options=None):
+    """
+    runCard runs the selected stages over a card, saving every calibration produced, and reusing the
+    memoized value of every stage whose inputs didn't change
+
+    Parameters
+    - card_name:str, name of the card
+    - stages:list, names of the stages to run, subset of STAGES
+    - paths:dict, folders of images and calibrations as in DEFAULT_PATHS
+    - options:dict, options of the run (crops_only, align_split, disparity_level, guided_matching, slide_ends, memo,
+    edge_operator, stream, profile, track_memory, cprofile_path, diagnostics_path)
+
+    Return
+    - result:dict, summary of the run with keys card, status, steps, outputs, error and profile, plus the
+    figures to render if diagnostics_path is given
+    """
+    paths = dict(DEFAULT_PATHS, **(paths or {}))
+    options = options or {}
+    memo_path = paths['MAIN_FOLDER'] + \
+        paths['MEMO'] if options.get('memo', True) else None
+    result = {'card': card_name, 'status': "ok",
+              'steps': [], 'outputs': [], 'error': None}
+    if options.get('profile', False):
+        cprofile_path = None
+        if options.get('cprofile_path') is not None:
+            os.makedirs(options['cprofile_path'], exist_ok=True)
+            cprofile_path = os.path.join(
+                options['cprofile_path'], card_name + ".prof")
+        startProfiling(options.get('track_memory', False), cprofile_path)
+    try:
+        graph, steps, current = buildCardGraph(
+            card_name, stages, paths, options)
+        targets = [name for name in steps if name is not None]
+        # The figures need the images, so they're only released without diagnostics
+        release = options.get('stream', False) and options.get(
+            'diagnostics_path') is None
+        values, status = runGraph(graph, targets, memo_path, release)
+
+        step_names = [stage if side is None else stage + "_" + side
+                      for stage, side in STEPS if stage in stages]
+        for step_name, name in zip(step_names, steps):
+            result['steps'].append({'step': step_name,
+                                    'status': "skipped" if name is None else status[name]})
+
+        for side in ["left", "right"]:
+            if current[side] is None or current[side].startswith("annotation_"):
+                continue
+            img_calib = values[current[side]]
+            output_path = paths['MAIN_FOLDER'] + paths['CALIB'] + \
+                img_calib['nomeImagem'] + ".json"
+            saveToFile(img_calib, output_path)
+            result['outputs'].append(output_path)
+        if "disparity" in values:
+            result['outputs'] += values["disparity"]['outputs']
+
+        if options.get('diagnostics_path') is not None:
+            result['figures'] = getCardFigures(card_name, graph, values, status,
+                                               options['diagnostics_path'])
+    except Exception as ex:
+        result['status'] = "failed"
+        # The type tells apart errors without message, such as the MemoryError of a memory budget
+        result['error'] = type(ex).__name__ + (": " + str(ex) if str(ex) else "")
+        result['traceback'] = traceback.format_exc()
+    finally:
+        if options.get('stream', False):
+            # The image cache would otherwise keep the released images of every card alive
+            clearImageCache()
+    if options.get('profile', False):
+        result['profile'] = stopProfiling()
+    return result
+
+
+def initCardWorker(memory_budget=None):
+    """
+    initCardWorker prepares a process of the pool to run cards, limiting opencv to one thread and, if a budget
+    is given, limiting the memory of the process so a card exceeding it fails instead of the node running
+    out of memory, while the image cache takes at most a quarter of the budget
+
+    Parameters
+    - memory_budget:int, maximum bytes of data memory of the process, None for no limit
+
+    Return
+    - :None
+    """
+    initSplitWorker()
+    if memory_budget is not None:
+        resource.setrlimit(resource.RLIMIT_DATA, (memory_budget,
+                                                  resource.getrlimit(resource.RLIMIT_DATA)[1]))
+        setImageCache(max_bytes=memory_budget // 4)
+
+
+def iterCards(card_names, stages, paths=None, options=None, workers=1):
+    """
+    iterCards runs the selected stages over many cards, yielding the summary of each card as soon as it's
+    finished, with at most twice workers cards submitted at a time so the list of cards is consumed lazily
+
+    Parameters
+    - card_names:iterable, names of the cards
+    - stages:list, names of the stages to run, subset of STAGES
+    - paths:dict, folders of images and calibrations as in DEFAULT_PATHS
+    - options:dict, options of the run as in runCard, plus memory_budget per process in bytes
+    - workers:int, number of processes
+
+    Return
+    - :generator, summaries as returned by runCard in order of completion
+    """
+    options = options or {}
+    memory_budget = options.get('memory_budget')
+    if workers <= 1 and memory_budget is None:
+        for card_name in card_names:
+            yield runCard(card_name, stages, paths, options)
+        return
+
+    card_names = iter(card_names)
+    with ProcessPoolExecutor(max_workers=workers, initializer=initCardWorker,
+                             initargs=(memory_budget,)) as executor:
+        futures = set()
+        for card_name in card_names:
+            futures.add(executor.submit(
+                runCard, card_name, stages, paths, options))
+            if len(futures) < 2 * workers:
+                continue
+            done, futures = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def runCards(card_names, stages, paths=None, options=None, workers=1):
+    """
+    runCards runs the selected stages over many cards, on a pool of processes if workers is greater than one,
+    while the diagnostic figures of finished cards are rendered on a background thread
+
+    Parameters
+    - card_names:iterable, names of the cards, consumed lazily by iterCards
+    - stages:list, names of the stages to run, subset of STAGES
+    - paths:dict, folders of images and calibrations as in DEFAULT_PATHS
+    - options:dict, options of the run as in iterCards, plus preview_max_side for the diagnostics
+    - workers:int, number of processes
+
+    Return
+    - results:list, one summary per card as returned by runCard in the order of card_names, with the rendered
+    figures on key diagnostics
+    """
+    options = options or {}
+    renderings = {}
+    results = {}
+    submitted = []
+
+    def recordCards():
+        # The names are kept as iterCards consumes them, since an iterator can only be read once
+        for card_name in card_names:
+            submitted.append(card_name)
+            yield card_name
+
+    for result in iterCards(recordCards(), stages, paths, options, workers):
+        figures = result.pop('figures', [])
+        renderings[result['card']] = submitCardFigures(
+            figures, options.get('preview_max_side'))
+        results[result['card']] = result
+    results = [results[card_name] for card_name in submitted]
+
+    if options.get('diagnostics_path') is not None:
+        waitDiagnostics()
+        for result in results:
+            result['diagnostics'] = []
+            for future in renderings[result['card']]:
+                if future.exception() is None:
+                    result['diagnostics'] += future.result()
+    return results
@@ -0,0 +1,173 @@
+"""
+profiling.py is a collection of functions to instrument the routines of the other scripts, measuring wall time,
+cpu time and peak memory of each stage, counting events such as keypoints or candidate pairs, and optionally
+profiling a whole run with cProfile
+"""
+import time
+import json
+import cProfile
+import resource
+import tracemalloc
+from contextlib import contextmanager
+
+
+PROFILER = {
+    "enabled": False,
+    "track_memory": False,
+    "stages": [],
+    "stack": [],
+    "counters": {},
+    "cprofile": None,
+    "cprofile_path": None,
+    "start_wall": 0,
+    "start_cpu": 0
+}
+
+
+def startProfiling(track_memory=False, cprofile_path=None):
+    """
+    startProfiling enables the instrumentation of every stage until stopProfiling is called
+
+    Parameters
+    - track_memory:bool, to measure peak memory of each stage with tracemalloc, which slows down python code
+    - cprofile_path:str, path to dump the cProfile statistics of the run, None disables it
+
+    Return
+    - :None
+    """
+    PROFILER.update({"enabled": True, "track_memory": track_memory, "stages": [], "stack": [],
+                     "counters": {}, "cprofile": None, "cprofile_path": cprofile_path,
+                     "start_wall": time.perf_counter(), "start_cpu": time.process_time()})
+    if track_memory:
+        tracemalloc.start()
+    if cprofile_path is not None:
+        PROFILER["cprofile"] = cProfile.Profile()
+        PROFILER["cprofile"].enable()
+
+
+def stopProfiling():
+    """
+    stopProfiling disables the instrumentation and returns the report of everything measured since startProfiling
+
+    Parameters
+    - :None
+
+    Return
+    - report:dict, object with total times, stages and counters
+    """
+    if not PROFILER["enabled"]:
+        return None
+    if PROFILER["cprofile"] is not None:
+        PROFILER["cprofile"].disable()
+        PROFILER["cprofile"].dump_stats(PROFILER["cprofile_path"])
+    if PROFILER["track_memory"]:
+        tracemalloc.stop()
+
+    report = {"wall": time.perf_counter() - PROFILER["start_wall"],
+              "cpu": time.process_time() - PROFILER["start_cpu"],
+              "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              "stages": PROFILER["stages"],
+              "counters": PROFILER["counters"],
+              "cprofile": PROFILER["cprofile_path"]}
+    PROFILER.update({"enabled": False, "stages": [], "stack": [],
+                     "counters": {}, "cprofile": None})
+    return report
+
+
+def saveReport(report, filepath):
+    """
+    saveReport dumps a report returned by stopProfiling as json
+
+    Parameters
+    - report:dict, object with total times, stages and counters
+    - filepath:str, path of the json file
+
+    Return
+    - :None
+    """
+    with open(filepath, 'w') as file:
+        json.dump(report, file, indent=4)
+
+
+@contextmanager
+def stageTimer(name):
+    """
+    stageTimer measures the code inside a with block as a stage, nested stages are named after their parents
+
+    Parameters
+    - name:str, name of the stage
+
+    Return
+    - :None
+    """
+    if not PROFILER["enabled"]:
+        yield
+        return
+
+    path = "/".join([stage["name"] for stage in PROFILER["stack"]] + [name])
+    stage = {"name": name, "counters": {}}
+    if PROFILER["track_memory"]:
+        # The peak is reset for each stage, so the parent keeps the peak seen so far
+        current, peak = tracemalloc.get_traced_memory()
+        if PROFILER["stack"]:
+            parent = PROFILER["stack"][-1]
+            parent["peak_seen"] = max(parent["peak_seen"], peak)
+        stage["start_traced"], stage["peak_seen"] = current, current
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+    PROFILER["stack"].append(stage)
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        wall, cpu = time.perf_counter() - start_wall, time.process_time() - start_cpu
+        PROFILER["stack"].pop()
+        record = {"stage": path, "wall": wall, "cpu": cpu,
+                  "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  "counters": stage["counters"]}
+        if PROFILER["track_memory"]:
+            peak = max(stage["peak_seen"], tracemalloc.get_traced_memory()[1])
+            record["peak_traced_bytes"] = peak - stage["start_traced"]
+            if PROFILER["stack"]:
+                parent = PROFILER["stack"][-1]
+                parent["peak_seen"] = max(parent["peak_seen"], peak)
+        PROFILER["stages"].append(record)
+
+
+def countEvent(name, value=1):
+    """
+    countEvent adds value to a counter of the current stage and of the whole run
+
+    Parameters
+    - name:str, name of the counter
+    - value:int, amount to add
+
+    Return
+    - :None
+    """
+    if not PROFILER["enabled"]:
+        return
+    PROFILER["counters"][name] = PROFILER["counters"].get(name, 0) + value
+    if PROFILER["stack"]:
+        counters = PROFILER["stack"][-1]["counters"]
+        counters[name] = counters.get(name, 0) + value
+
+
+def printReport(report):
+    """
+    printReport prints the time of each stage of a report in a table
+
+    Parameters
+    - report:dict, object with total times, stages and counters
+
+    Return
+    - :None
+    """
+    print("\n{:<50}{:>10}{:>10}".format("Stage", "Wall (s)", "CPU (s)"))
+    for record in report["stages"]:
+        print("{:<50}{:>10.3f}{:>10.3f}".format(
+            record["stage"], record["wall"], record["cpu"]))
+    print("{:<50}{:>10.3f}{:>10.3f}".format(
+        "Total", report["wall"], report["cpu"]))
+    for name, value in report["counters"].items():
+        print(name, ":", value)
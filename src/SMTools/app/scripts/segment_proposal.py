@@ -0,0 +1,352 @@
+"""
+segment_proposal.py is a collection of functions to propose the calibration segments of an image without an
+annotation, detecting line segments on the edge map of improve_edge.py and grouping them by the vanishing points
+of three orthogonal directions, so annotators only correct a draft instead of drawing every segment
+"""
+import numpy as np
+import cv2 as cv
+
+from scripts.improve_edge import findEdges
+from scripts.camera_projection import imageToCanvas, projectPoints
+from scripts.camera_calibration import calibrateCamera
+from scripts.profiling import stageTimer, countEvent
+
+
+def detectSegments(edgesMatrix, min_length=None, threshold=0.3, max_gap=5, margin=0.02):
+    """
+    detectSegments finds the line segments of an edge map with the probabilistic Hough transform
+
+    Parameters
+    - edgesMatrix:np.array, of shape (m,n) with values on [0,1] for edge likelihood, as returned by findEdges
+    - min_length:float, minimum length in pixels of a segment, 1/40 of the diagonal by default
+    - threshold:float, minimum likelihood of an edge pixel
+    - max_gap:int, maximum gap in pixels between pixels of a segment
+    - margin:float, segments with both ends within this fraction of the size of the image from the same side are
+    its border, or the frame of the photograph
+
+    Return
+    - segments:np.array, float64 x0,y0,x1,y1 of each segment of shape (k,4)
+    """
+    diagonal = np.hypot(*edgesMatrix.shape)
+    min_length = diagonal / 40 if min_length is None else min_length
+    edges = np.uint8(edgesMatrix > threshold) * 255
+    segments = cv.HoughLinesP(edges, 1, np.pi / 360, int(min_length / 2),
+                              minLineLength=min_length, maxLineGap=max_gap)
+    segments = np.zeros((0, 4)) if segments is None else segments.reshape(-1, 4).astype(np.float64)
+    height, width = edgesMatrix.shape
+    sides = np.array([0, 0, width - 1, height - 1])
+    margins = margin * np.array([width, height, width, height])
+    border = np.abs(segments[:, [0, 1, 0, 1]] - sides) <= margins
+    border &= np.abs(segments[:, [2, 3, 2, 3]] - sides) <= margins
+    segments = segments[~np.any(border, axis=1)]
+    countEvent("segments_detected", len(segments))
+    return segments
+
+
+def getConsistency(vanishing_points, segments, max_angle=2.0):
+    """
+    getConsistency tells which segments point to each vanishing point, where a segment is consistent if the
+    angle between it and the line from its middle to the vanishing point is small
+
+    Parameters
+    - vanishing_points:np.array, homogeneous x,y,w of shape (h,3), w = 0 for points at infinity
+    - segments:np.array, x0,y0,x1,y1 of each segment of shape (k,4)
+    - max_angle:float, maximum angle in degrees
+
+    Return
+    - :np.array, boolean of shape (h,k)
+    """
+    middles = (segments[:, :2] + segments[:, 2:]) / 2
+    directions = segments[:, 2:] - segments[:, :2]
+    directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+    to_points = vanishing_points[:, None, :2] - vanishing_points[:, None, 2:] * middles[None]
+    sines = np.abs(directions[None, :, 0] * to_points[..., 1] - directions[None, :, 1] * to_points[..., 0])
+    norms = np.linalg.norm(to_points, axis=2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(norms > 0, sines / norms, 1) < np.sin(np.radians(max_angle))
+
+
+def getThirdVanishingPoint(v1, v2, center):
+    """
+    getThirdVanishingPoint completes two vanishing points of orthogonal directions with the third one, for a
+    camera whose optical center is the given point
+
+    Parameters
+    - v1:np.array, homogeneous x,y,w of the first vanishing point
+    - v2:np.array, homogeneous x,y,w of the second vanishing point
+    - center:np.array, x,y of the optical center
+
+    Return
+    - v3:np.array, homogeneous x,y,w of the third vanishing point, None if the points can't be orthogonal
+    - focal:float, distance in pixels between the camera and the image, None if the points can't be orthogonal
+    """
+    a1, a2 = v1[:2] - center * v1[2], v2[:2] - center * v2[2]
+    if abs(v1[2] * v2[2]) < 1e-12:
+        return None, None
+    focal2 = -(a1 @ a2) / (v1[2] * v2[2])
+    if focal2 <= 0:
+        return None, None
+    focal = np.sqrt(focal2)
+    # Directions of the camera, orthogonal when the focal is right
+    r3 = np.cross(np.append(a1 / focal, v1[2]), np.append(a2 / focal, v2[2]))
+    v3 = np.append(r3[:2] * focal + center * r3[2], r3[2])
+    return v3 / np.linalg.norm(v3), focal
+
+
+def findVanishingPoints(segments, size, rng, hypotheses=500, candidates=30, max_angle=2.0, focal_range=(0.3, 5),
+                        max_tilt=30):
+    """
+    findVanishingPoints finds the vanishing points of three orthogonal directions, voting each intersection of
+    random pairs of segments with the length of its consistent segments, then completing each pair of the best
+    candidates with its orthogonal third point and keeping the triple with the most consistent length
+
+    Parameters
+    - segments:np.array, x0,y0,x1,y1 of each segment of shape (k,4)
+    - size:tuple, width and height of the image
+    - rng:np.random.Generator, source of randomness
+    - hypotheses:int, number of pairs of segments intersected
+    - candidates:int, number of best distinct intersections paired
+    - max_angle:float, maximum angle in degrees between a segment and its vanishing point
+    - focal_range:tuple, range of the focal as fractions of the diagonal of the image
+    - max_tilt:float, maximum angle in degrees between the vertical of the image and the closest direction, as
+    one of the axes is the vertical of the buildings
+
+    Return
+    - vanishing_points:np.array, homogeneous x,y,w of shape (3,3)
+    - labels:np.array, index of the vanishing point of each segment, -1 for none
+    - focal:float, distance in pixels between the camera and the image
+    """
+    width, height = size
+    diagonal = np.hypot(width, height)
+    center = np.array([width / 2, height / 2])
+    if len(segments) < 4:
+        raise ValueError("Not enough segments to find vanishing points: " + str(len(segments)))
+    # Coordinates scaled by the diagonal, so the homogeneous points are well conditioned
+    ends = np.concatenate([segments.reshape(-1, 2) / diagonal, np.ones((2 * len(segments), 1))], axis=1)
+    lines = np.cross(ends[0::2], ends[1::2])
+    lengths = np.linalg.norm(segments[:, 2:] - segments[:, :2], axis=1)
+
+    pairs = rng.choice(len(segments), size=(hypotheses, 2), p=lengths / np.sum(lengths))
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    points = np.cross(lines[pairs[:, 0]], lines[pairs[:, 1]])
+    points = points[np.linalg.norm(points, axis=1) > 0]
+    points /= np.linalg.norm(points, axis=1, keepdims=True)
+    scaled = segments / diagonal
+    consistent = getConsistency(points, scaled, max_angle)
+    votes = consistent @ lengths
+
+    # Best intersections, skipping the ones mostly voted by the segments of a better one
+    chosen = []
+    for i in np.argsort(-votes):
+        if len(chosen) == candidates or votes[i] == 0:
+            break
+        if all(np.sum(lengths[consistent[i] & consistent[j]]) < 0.5 * votes[i] for j in chosen):
+            chosen.append(i)
+    countEvent("vanishing_candidates", len(chosen))
+
+    best = (0, None, None)
+    scaled_center = center / diagonal
+    for a in range(len(chosen)):
+        for b in range(a + 1, len(chosen)):
+            v1, v2 = points[chosen[a]], points[chosen[b]]
+            v3, focal = getThirdVanishingPoint(v1, v2, scaled_center)
+            if v3 is None or not focal_range[0] < focal < focal_range[1]:
+                continue
+            triple = np.array([v1, v2, v3])
+            directions = np.concatenate([(triple[:, :2] - scaled_center * triple[:, 2:]) / focal, triple[:, 2:]], axis=1)
+            if np.max(np.abs(directions[:, 1]) / np.linalg.norm(directions, axis=1)) < np.cos(np.radians(max_tilt)):
+                continue
+            score = lengths @ np.any(getConsistency(triple, scaled, max_angle), axis=0)
+            if score > best[0]:
+                best = (score, triple, focal)
+    if best[1] is None:
+        raise ValueError("Couldn't find three orthogonal vanishing points")
+
+    _, triple, focal = best
+    # Least squares point of the lines of the consistent segments of each vanishing point, weighted by length
+    normals = lines / np.linalg.norm(lines[:, :2], axis=1, keepdims=True)
+    for _ in range(2):
+        consistent = getConsistency(triple, scaled, max_angle)
+        for dim in range(3):
+            if np.sum(consistent[dim]) >= 2:
+                weighted = normals[consistent[dim]] * lengths[consistent[dim], None]
+                triple[dim] = np.linalg.eigh(weighted.T @ normals[consistent[dim]])[1][:, 0]
+    consistent = getConsistency(triple, scaled, max_angle)
+    # Each segment goes to the vanishing point it points to most closely, as long as it points to only one of
+    # them, since a segment on the line of two vanishing points (as the horizon) doesn't tell them apart
+    middles = (scaled[:, :2] + scaled[:, 2:]) / 2
+    to_points = triple[:, None, :2] - triple[:, None, 2:] * middles[None]
+    directions = (scaled[:, 2:] - scaled[:, :2]) / lengths[:, None] * diagonal
+    cosines = np.abs(np.sum(to_points * directions[None], axis=2)) / np.maximum(
+        np.linalg.norm(to_points, axis=2), 1e-12)
+    labels = np.where(np.sum(consistent, axis=0) == 1, np.argmax(np.where(consistent, cosines, -1), axis=0), -1)
+    triple = triple * [1, 1, 1 / diagonal]
+    return triple / np.linalg.norm(triple, axis=1, keepdims=True), labels, focal * diagonal
+
+
+def getAxesOrder(vanishing_points, size, focal):
+    """
+    getAxesOrder tells which vanishing point belongs to each axis, Z being the most vertical direction and X the
+    direction pointing most to the right, as the segments drawn on TextureExtractor
+
+    Parameters
+    - vanishing_points:np.array, homogeneous x,y,w of shape (3,3)
+    - size:tuple, width and height of the image
+    - focal:float, distance in pixels between the camera and the image
+
+    Return
+    - :list, index of the vanishing point of the axes X, Y and Z
+    """
+    center = np.array([size[0] / 2, size[1] / 2])
+    directions = np.concatenate([(vanishing_points[:, :2] - center * vanishing_points[:, 2:]) / focal,
+                                 vanishing_points[:, 2:]], axis=1)
+    directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+    # Pointing away from the camera
+    directions *= np.where(directions[:, 2:] < 0, -1, 1)
+    z = int(np.argmax(np.abs(directions[:, 1])))
+    x, y = sorted([dim for dim in range(3) if dim != z], key=lambda dim: -directions[dim, 0])
+    return [x, y, z]
+
+
+def snapSegments(segments, labels, vanishing_points):
+    """
+    snapSegments moves the ends of each segment onto the line from its middle to its vanishing point, so the
+    segments of an axis meet exactly on it
+
+    Parameters
+    - segments:np.array, x0,y0,x1,y1 of each segment of shape (k,4)
+    - labels:np.array, index of the vanishing point of each segment, -1 for none
+    - vanishing_points:np.array, homogeneous x,y,w of shape (3,3)
+
+    Return
+    - :np.array, snapped segments of shape (k,4), unlabeled segments are kept
+    """
+    snapped = segments.copy()
+    labeled = labels >= 0
+    middles = (segments[labeled, :2] + segments[labeled, 2:]) / 2
+    lines = np.cross(np.concatenate([middles, np.ones((len(middles), 1))], axis=1), vanishing_points[labels[labeled]])
+    lines /= np.linalg.norm(lines[:, :2], axis=1, keepdims=True)
+    for k in [0, 2]:
+        ends = segments[labeled, k:k + 2]
+        snapped[labeled, k:k + 2] = ends - lines[:, :2] * (np.sum(lines[:, :2] * ends, axis=1, keepdims=True)
+                                                          + lines[:, 2:])
+    return snapped
+
+
+def selectSegments(segments, labels, n_edges=4, min_distance=8):
+    """
+    selectSegments picks the longest lines of each vanishing point, joining the segments on the same line, such
+    as the pieces of an edge broken by noise or the aligned sides of windows, which makes longer lines and so
+    steadier vanishing points, and skipping lines parallel to a picked one once their ends are
+    whole pixels, since parallel lines never meet
+
+    Parameters
+    - segments:np.array, x0,y0,x1,y1 of each segment of shape (k,4)
+    - labels:np.array, index of the vanishing point of each segment, -1 for none
+    - n_edges:int, maximum number of lines of each vanishing point
+    - min_distance:float, maximum distance between the middle of a segment and the line it joins
+
+    Return
+    - :list, for each vanishing point an array of its picked segments of shape (n,4) with whole pixels
+    """
+    lengths = np.linalg.norm(segments[:, 2:] - segments[:, :2], axis=1)
+    picked = []
+    for label in range(3):
+        joined = []
+        for i in np.nonzero(labels == label)[0][np.argsort(-lengths[labels == label])]:
+            ends = segments[i].reshape(2, 2)
+            for line in joined:
+                direction = line[1] - line[0]
+                if abs(np.cross(direction, np.mean(ends, axis=0) - line[0])) / np.linalg.norm(direction) < min_distance:
+                    steps = (ends - line[0]) @ direction / (direction @ direction)
+                    line[:] = line[0] + np.outer([min(0, np.min(steps)), max(1, np.max(steps))], direction)
+                    break
+            else:
+                joined.append(ends.copy())
+        joined = sorted([np.round(line) for line in joined], key=lambda line: -np.linalg.norm(line[1] - line[0]))
+        chosen = []
+        for line in joined:
+            if len(chosen) == n_edges:
+                break
+            direction = line[1] - line[0]
+            if np.any(direction != 0) and all(np.cross(other[1] - other[0], direction) != 0 for other in chosen):
+                chosen.append(line)
+        picked.append(np.array(chosen).reshape(-1, 4))
+    return picked
+
+
+def proposeCalibration(img_dict, image_name, extension="jpg", n_edges=4, seed=0, edge_operator="canny"):
+    """
+    proposeCalibration proposes the calibration segments of an image, as a draft calibration which
+    improveEdgesDict and calibrateCamera take as an annotation, reusing the key edgesMatrix of the image dict
+    when already computed, where an axis with less than two segments is left empty for a centrado calibration
+
+    Parameters
+    - img_dict:dict, object with data about an image and its parameters
+    - image_name:str, name of the image without extension
+    - extension:str, extension of the image
+    - n_edges:int, maximum number of segments of each axis
+    - seed:int, seed of the randomness of the voting
+    - edge_operator:str, operator of findEdges computing the edges matrix when missing
+
+    Return
+    - img_calib:dict, object with data about an image calibration (only calibration segments)
+    """
+    img = img_dict['img']
+    size = (img.shape[1], img.shape[0])
+    edgesMatrix = img_dict.get('edgesMatrix')
+    if edgesMatrix is None:
+        with stageTimer("findEdges"):
+            edgesMatrix = findEdges(img, edge_operator)
+    with stageTimer("detectSegments"):
+        segments = detectSegments(edgesMatrix)
+    with stageTimer("findVanishingPoints"):
+        vanishing_points, labels, focal = findVanishingPoints(segments, size, np.random.default_rng(seed))
+    segments = snapSegments(segments, labels, vanishing_points)
+    segments = imageToCanvas(segments.reshape(-1, 2), img_dict).reshape(-1, 4)
+    picked = selectSegments(segments, labels, n_edges)
+
+    pontosguia = []
+    for dim in getAxesOrder(vanishing_points, size, focal):
+        pontosguia.append(np.int64(picked[dim]).reshape(-1, 2).tolist() if len(picked[dim]) >= 2 else [])
+    if sum(len(points) > 0 for points in pontosguia) < 2:
+        raise ValueError("Couldn't propose segments for two axes of " + image_name)
+    return {"nomeImagem": image_name, "extensao": extension, "pontosguia": pontosguia}
+
+
+def createDraftAnnotation(img_calib):
+    """
+    createDraftAnnotation turns a proposed calibration into an annotation TextureExtractor can open, calibrating
+    its camera with the three vanishing points and adding the empty planes, where a camera which can't be
+    calibrated from the proposed segments is replaced by a neutral one looking at the center of the canvas, to be
+    fixed once the segments are corrected
+
+    Parameters
+    - img_calib:dict, object with data about an image calibration (only calibration segments)
+
+    Return
+    - img_calib:dict, object with data about an image calibration (calibration segments + camera + planes)
+    """
+    draft = {"nomeImagem": img_calib['nomeImagem'], "extensao": img_calib['extensao'],
+             "pontosguia": [list(points) for points in img_calib['pontosguia']]}
+    try:
+        draft = calibrateCamera(draft)
+        if len(draft['pontosfuga']) < 3:
+            # A centered calibration keeps only the vanishing points of the annotated axes, the one of the
+            # missing axis is the projection of its direction
+            draft['pontosfuga'] = projectPoints(np.eye(3), draft)
+        camera = np.concatenate([np.ravel(draft[key]) for key in ['pontosfuga', 'base', 'centrooptico', 'camera']])
+        calibrated = len(draft['pontosfuga']) == 3 and bool(np.all(np.isfinite(camera)))
+    except Exception:
+        calibrated = False
+    if calibrated:
+        for key in ['pontosfuga', 'base', 'centrooptico', 'camera']:
+            draft[key] = np.asarray(draft[key], dtype=np.float64).tolist()
+    else:
+        # Canvas of 1200x800 seen by a camera at a distance of its width, with axes aligned to the canvas
+        draft.update({"pontosfuga": [[1e6, 400.0], [600.0, 1e6], [600.0, 400.0]],
+                      "base": [1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0],
+                      "centrooptico": [600.0, 400.0],
+                      "camera": [600.0, 400.0, -1200.0]})
+    draft.update({"tiposPlanos": {}, "planos": "[]"})
+    return draft
@@ -0,0 +1,484 @@
+"""
+service.py is a local HTTP service exposing the routines of the other scripts to TextureExtractor, where each
+request runs on a pool of warm worker processes which keep decoded images, edge maps and SIFT features in memory
+"""
+import os
+import json
+import zlib
+import copy
+import traceback
+import threading
+import numpy as np
+import cv2 as cv
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from scripts.shared_functions import readJson, readImage, saveToFile, createImageDict, getStereoFilename, getCropsFilename
+from scripts.image_loader import loadImage, getImageKey
+from scripts.improve_edge import improveEdges, findEdges
+from scripts.improve_edges import improveEdgesDict
+from scripts.camera_calibration import calibrateCamera, createCalibState, updateCalibState, calibrateState
+from scripts.stereo_matching import stereoEdgesMatching, detectFeatures
+from scripts.split_image import getStereoSplit
+from scripts.segment_proposal import proposeCalibration, createDraftAnnotation
+from scripts.pipeline import DEFAULT_PATHS
+
+
+SERVICE_CONFIG = {
+    "CACHED_IMAGES": 8,
+    "CACHED_CALIBS": 32,
+    # Pages allowed to call the service from a browser, TextureExtractor serves its pages on port 8000
+    "ALLOWED_ORIGINS": ["http://localhost:8000", "http://127.0.0.1:8000"],
+    # Operator of findEdges computing the cached edge maps
+    "EDGE_OPERATOR": "canny"
+}
+
+_IMAGE_DICTS = OrderedDict()
+
+_CALIB_STATES = OrderedDict()
+
+
+class RequestError(ValueError):
+    """
+    RequestError is raised when the body of a request is missing a key or has an invalid value
+    """
+
+
+def checkBodyKeys(body, keys, name="body"):
+    """
+    checkBodyKeys checks that a json object of a request has every required key
+
+    Parameters
+    - body:dict, json object of the request
+    - keys:list, required keys
+    - name:str, name of the object on the error message
+
+    Return
+    - :None
+    """
+    if not isinstance(body, dict):
+        raise RequestError("Expected an object as " + name)
+    missing = [key for key in keys if key not in body]
+    if missing:
+        raise RequestError("Missing keys on " + name + ": " + ", ".join(missing))
+
+
+def getSafePath(folder, name):
+    """
+    getSafePath joins a file name sent on a request to a folder, refusing names with a path so a request can
+    only read and write files directly inside the data folders
+
+    Parameters
+    - folder:str, path of the folder, ending with a separator
+    - name:str, file name sent on the request
+
+    Return
+    - :str, path of the file
+    """
+    if not isinstance(name, str) or name in ["", os.curdir, os.pardir] or os.path.basename(name) != name:
+        raise RequestError("Invalid file name: " + repr(name))
+    filepath = folder + name
+    real_folder = os.path.realpath(folder)
+    if os.path.commonpath([real_folder, os.path.realpath(filepath)]) != real_folder:
+        raise RequestError("File outside of the data folders: " + repr(name))
+    return filepath
+
+
+def initServiceWorker(edge_operator="canny"):
+    """
+    initServiceWorker limits opencv to one thread, sets the edge operator and compiles the numba kernels before
+    the first request
+
+    Parameters
+    - edge_operator:str, operator of findEdges computing the cached edge maps
+
+    Return
+    - :None
+    """
+    cv.setNumThreads(1)
+    SERVICE_CONFIG["EDGE_OPERATOR"] = edge_operator
+    img = np.zeros((32, 32, 3), dtype=np.uint8)
+    img[16, :, :] = 255
+    improveEdges(img, [[[4, 15], [28, 17]]], edgesMatrix=findEdges(img, edge_operator))
+
+
+def createServiceWorker(edge_operator):
+    """
+    createServiceWorker creates the single-process executor of a worker of the service
+
+    Parameters
+    - edge_operator:str, operator of findEdges computing the cached edge maps
+
+    Return
+    - :ProcessPoolExecutor, executor with one process
+    """
+    return ProcessPoolExecutor(max_workers=1, initializer=initServiceWorker, initargs=(edge_operator,))
+
+
+def getImageDictCached(img_calib, images_path, features=False):
+    """
+    getImageDictCached returns the image dict of a calibration, reusing it with its edges matrix and
+    SIFT features while the image file isn't modified
+
+    Parameters
+    - img_calib:dict, object with data about an image calibration
+    - images_path:str, folder of the images
+    - features:bool, to also compute the SIFT features of the image
+
+    Return
+    - img_dict:dict, object with data about an image and its parameters
+    """
+    img_path = images_path + \
+        img_calib['nomeImagem'] + "." + img_calib['extensao']
+    if not os.path.exists(img_path):
+        img_path = images_path + \
+            getCropsFilename('_'.join(img_calib['nomeImagem'].split('_')[:-1]))
+    key = (img_calib['nomeImagem'], getImageKey(img_path))
+
+    if key not in _IMAGE_DICTS:
+        img_dict = createImageDict(readImage(img_calib, images_path))
+        img_dict['edgesMatrix'] = findEdges(img_dict['img'], SERVICE_CONFIG["EDGE_OPERATOR"])
+        _IMAGE_DICTS[key] = img_dict
+        while len(_IMAGE_DICTS) > SERVICE_CONFIG["CACHED_IMAGES"]:
+            _IMAGE_DICTS.popitem(last=False)
+    _IMAGE_DICTS.move_to_end(key)
+
+    img_dict = _IMAGE_DICTS[key]
+    if features and 'sift_features' not in img_dict:
+        img_dict['sift_features'] = detectFeatures(img_dict['img'])
+    return img_dict
+
+
+def getRequestCalib(body, paths):
+    """
+    getRequestCalib returns the calibration sent on the request body or read from the calibration folder,
+    checking the names it uses to find its image
+
+    Parameters
+    - body:dict, json body of the request with key calib or calib_file
+    - paths:dict, folders of images and calibrations as in DEFAULT_PATHS
+
+    Return
+    - :dict, object with data about an image calibration
+    """
+    checkBodyKeys(body, [])
+    if 'calib' in body:
+        img_calib = copy.deepcopy(body['calib'])
+    elif 'calib_file' in body:
+        img_calib = readJson(getSafePath(paths['MAIN_FOLDER'] + paths['CALIB'], body['calib_file']))
+    else:
+        raise RequestError("Missing keys on body: calib or calib_file")
+    checkBodyKeys(img_calib, ['nomeImagem'], "calib")
+    getSafePath(paths['MAIN_FOLDER'] + paths['CALIB'], str(img_calib['nomeImagem']) + ".json")
+    if 'extensao' in img_calib:
+        getSafePath(paths['MAIN_FOLDER'] + paths['IMAGES'],
+                    str(img_calib['nomeImagem']) + "." + str(img_calib['extensao']))
+    return img_calib
+
+
+def saveRequestCalib(body, img_calib, paths, annotation=False):
+    """
+    saveRequestCalib saves the resulting calibration on the calibration folder if the request asks to, as
+    <nomeImagem>.json like the calibrated output of the pipeline, or over the annotation of the image
+
+    Parameters
+    - body:dict, json body of the request with optional key save
+    - img_calib:dict, object with data about an image calibration
+    - paths:dict, folders of images and calibrations as in DEFAULT_PATHS
+    - annotation:bool, to save as the annotation of the image, with the prefix of the annotations
+
+    Return
+    - :None
+    """
+    if body.get('save', False):
+        filename = (paths['CALIB_PREFIX'] if annotation else "") + img_calib['nomeImagem'] + ".json"
+        saveToFile(img_calib, getSafePath(paths['MAIN_FOLDER'] + paths['CALIB'], filename))
+
+
+def splitRequest(body, paths):
+    """
+    splitRequest splits a stereo image of the images folder
+
+    Parameters
+    - body:dict, json body with keys image and optional crops_only
+    - paths:dict, folders of images and calibrations as in DEFAULT_PATHS
+
+    Return
+    - :dict, crop rectangles and saved files
+    """
+    checkBodyKeys(body, ['image'])
+    images_path = paths['MAIN_FOLDER'] + paths['IMAGES']
+    img = loadImage(getSafePath(images_path, body['image']))
+    crops = getStereoSplit(img, crops_only=True)
+    base_name = os.path.splitext(body['image'])[0]
+    outputs = []
+    if body.get('crops_only', False):
+        outputs.append(getCropsFilename(base_name))
+        saveToFile({"source": body['image'], "crops": crops},
+                   images_path + outputs[-1])
+    else:
+        for side, (x0, y0, x1, y1) in crops.items():
+            outputs.append(base_name + "_" + side + ".jpg")
+            if not cv.imwrite(images_path + outputs[-1], img[y0:y1, x0:x1]):
+                raise IOError("Couldn't write image at " + images_path + outputs[-1])
+    return {"crops": crops, "outputs": outputs}
+
+
+def proposeRequest(body, paths):
+    """
+    proposeRequest proposes the calibration segments of an image, reusing its cached edges matrix
+
+    Parameters
+    - body:dict, json body with key calib or calib_file (with at least nomeImagem and extensao), and optional save
+    to save the proposal as a draft annotation TextureExtractor opens
+    - paths:dict, folders of images and calibrations as in DEFAULT_PATHS
+
+    Return
+    - :dict, object with data about an image calibration (only calibration segments)
+    """
+    img_calib = getRequestCalib(body, paths)
+    checkBodyKeys(img_calib, ['extensao'], "calib")
+    img_dict = getImageDictCached(
+        img_calib, paths['MAIN_FOLDER'] + paths['IMAGES'])
+    img_calib = proposeCalibration(img_dict, img_calib['nomeImagem'], img_calib['extensao'])
+    saveRequestCalib(body, createDraftAnnotation(img_calib), paths, annotation=True)
+    return img_calib
+
+
+def improveRequest(body, paths):
+    """
+    improveRequest improves the segments of a calibration
+
+    Parameters
+    - body:dict, json body with key calib or calib_file, and optional save to save over the annotation
+    - paths:dict, folders of images and calibrations as in DEFAULT_PATHS
+
+    Return
+    - :dict, object with data about an image calibration with segments improved
+    """
+    img_calib = getRequestCalib(body, paths)
+    checkBodyKeys(img_calib, ['extensao', 'pontosguia'], "calib")
+    img_dict = getImageDictCached(
+        img_calib, paths['MAIN_FOLDER'] + paths['IMAGES'])
+    img_calib = improveEdgesDict(img_dict, img_calib)
+    saveRequestCalib(body, img_calib, paths, annotation=True)
+    return img_calib
+
+
+def calibrateRequest(body, paths):
+    """
+    calibrateRequest calibrates the camera of a calibration
+
+    Parameters
+    - body:dict, json body with key calib or calib_file, and optional save
+    - paths:dict, folders of images and calibrations as in DEFAULT_PATHS
+
+    Return
+    - :dict, object with data about an image calibration with camera
+    """
+    img_calib = getRequestCalib(body, paths)
+    checkBodyKeys(img_calib, ['pontosguia'], "calib")
+    img_calib = calibrateCamera(img_calib)
+    saveRequestCalib(body, img_calib, paths)
+    return img_calib
+
+
+def calibrateLiveRequest(body, paths):
+    """
+    calibrateLiveRequest calibrates the camera of a calibration being edited, keeping the intersections of its
+    segments between requests so only the segments changed since the last request of the image are computed
+
+    Parameters
+    - body:dict, json body with key calib or calib_file, and optional save
+    - paths:dict, folders of images and calibrations as in DEFAULT_PATHS
+
+    Return
+    - :dict, object with data about an image calibration with camera
+    """
+    img_calib = getRequestCalib(body, paths)
+    checkBodyKeys(img_calib, ['pontosguia'], "calib")
+    key = img_calib['nomeImagem']
+    if key in _CALIB_STATES:
+        updateCalibState(_CALIB_STATES[key], img_calib)
+    else:
+        _CALIB_STATES[key] = createCalibState(img_calib)
+        while len(_CALIB_STATES) > SERVICE_CONFIG["CACHED_CALIBS"]:
+            _CALIB_STATES.popitem(last=False)
+    _CALIB_STATES.move_to_end(key)
+    img_calib = calibrateState(_CALIB_STATES[key])
+    saveRequestCalib(body, img_calib, paths)
+    return img_calib
+
+
+def propagateRequest(body, paths):
+    """
+    propagateRequest creates the calibration of the stereo pair of a calibration through stereo matching
+
+    Parameters
+    - body:dict, json body with key calib or calib_file, and optional save to save as the annotation of the pair
+    - paths:dict, folders of images and calibrations as in DEFAULT_PATHS
+
+    Return
+    - :dict, object with data about the calibration of the stereo pair
+    """
+    images_path = paths['MAIN_FOLDER'] + paths['IMAGES']
+    img1_calib = getRequestCalib(body, paths)
+    checkBodyKeys(img1_calib, ['extensao', 'pontosguia'], "calib")
+    if str(img1_calib['nomeImagem']).split('_')[-1] not in ["left", "right"]:
+        raise RequestError("Invalid nomeImagem on calib: " + str(img1_calib['nomeImagem']) +
+                           ", expected a name ending with _left or _right")
+    img2_calib = copy.deepcopy(img1_calib)
+    img2_calib['nomeImagem'] = getStereoFilename(img1_calib['nomeImagem'])
+    img1_dict = getImageDictCached(img1_calib, images_path, features=True)
+    img2_dict = getImageDictCached(img2_calib, images_path, features=True)
+    img2_calib = stereoEdgesMatching(
+        img1_calib, img1_dict, img2_calib, img2_dict)
+    saveRequestCalib(body, img2_calib, paths, annotation=True)
+    return img2_calib
+
+
+ROUTES = {
+    "/split": splitRequest,
+    "/propose": proposeRequest,
+    "/improve-edges": improveRequest,
+    "/calibrate": calibrateRequest,
+    "/calibrate-live": calibrateLiveRequest,
+    "/propagate": propagateRequest
+}
+
+
+def getRequestAffinity(body):
+    """
+    getRequestAffinity returns a number identifying the card of a request, so requests of the same card
+    go to the same worker and find its caches warm
+
+    Parameters
+    - body:dict, json body of the request
+
+    Return
+    - :int, identifier of the card
+    """
+    if not isinstance(body, dict):
+        return 0
+    if 'image' in body:
+        name = os.path.splitext(str(body['image']))[0]
+    else:
+        calib = body.get('calib') if isinstance(body.get('calib'), dict) else {}
+        name = str(calib.get('nomeImagem', body.get('calib_file', "")))
+        name = '_'.join(name.replace(".json", "").split('_')[:-1])
+    return zlib.crc32(name.encode())
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """
+    ServiceHandler answers the requests of the service, running each route on a worker of the server
+    """
+
+    def isOriginAllowed(self):
+        # Requests without origin don't come from a browser page
+        origin = self.headers.get("Origin")
+        return origin is None or origin in self.server.origins
+
+    def sendCorsHeaders(self):
+        origin = self.headers.get("Origin")
+        if origin is not None and origin in self.server.origins:
+            self.send_header("Access-Control-Allow-Origin", origin)
+        self.send_header("Vary", "Origin")
+
+    def sendJson(self, status, data):
+        content = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.sendCorsHeaders()
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_OPTIONS(self):
+        self.send_response(204)
+        self.sendCorsHeaders()
+        self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "Content-Type")
+        self.end_headers()
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.sendJson(200, {"status": "ok", "routes": list(ROUTES.keys()),
+                                "workers": len(self.server.workers)})
+        else:
+            self.sendJson(404, {"error": "Unknown route " + self.path})
+
+    def do_POST(self):
+        if self.path not in ROUTES:
+            self.sendJson(404, {"error": "Unknown route " + self.path})
+            return
+        # Browsers send simple requests of other pages without asking first, so they are refused here
+        if not self.isOriginAllowed():
+            self.sendJson(403, {"error": "Origin not allowed: " + self.headers.get("Origin")})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except Exception as ex:
+            self.sendJson(400, {"error": "Invalid json body: " + str(ex)})
+            return
+
+        index = getRequestAffinity(body) % len(self.server.workers)
+        worker = self.server.workers[index]
+        try:
+            result = worker.submit(
+                ROUTES[self.path], body, self.server.paths).result()
+            self.sendJson(200, result)
+        except BrokenProcessPool as ex:
+            # The process died (e.g. out of memory), it is replaced so the next requests of its cards work again
+            with self.server.workers_lock:
+                if self.server.workers[index] is worker:
+                    self.server.workers[index] = createServiceWorker(self.server.edge_operator)
+                    worker.shutdown(wait=False)
+            self.sendJson(500, {"error": "Worker process died: " + str(ex)})
+        except (ValueError, FileNotFoundError) as ex:
+            # Invalid keys or missing files of the request, or data the routines can't process
+            self.sendJson(400, {"error": "Invalid request: " + str(ex)})
+        except Exception as ex:
+            self.sendJson(500, {"error": str(ex),
+                                "traceback": traceback.format_exc()})
+
+
+def runService(host="127.0.0.1", port=8001, workers=None, paths=None, origins=None, edge_operator=None):
+    """
+    runService serves the routes until interrupted, with one single-process executor per worker so every
+    card is always handled by the same process
+
+    Parameters
+    - host:str, address to listen on, localhost by default
+    - port:int, port to listen on
+    - workers:int, number of worker processes, defaults to the number of cores
+    - paths:dict, folders of images and calibrations as in DEFAULT_PATHS
+    - origins:list, origins of the pages allowed to call the service, defaults to the ones of SERVICE_CONFIG
+    - edge_operator:str, operator of findEdges computing the edge maps, defaults to the one of SERVICE_CONFIG
+
+    Return
+    - :None
+    """
+    workers = workers if workers is not None else (os.cpu_count() or 1)
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    server.paths = dict(DEFAULT_PATHS, **(paths or {}))
+    server.origins = list(origins if origins is not None else SERVICE_CONFIG["ALLOWED_ORIGINS"])
+    server.edge_operator = edge_operator if edge_operator is not None else SERVICE_CONFIG["EDGE_OPERATOR"]
+    server.workers = [createServiceWorker(server.edge_operator) for _ in range(workers)]
+    server.workers_lock = threading.Lock()
+    # Start every worker right away so numba compiles before the first request
+    for worker in server.workers:
+        worker.submit(int).result()
+
+    print("SMTools service listening on http://" + host + ":" + str(port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        for worker in server.workers:
+            worker.shutdown()
@@ -0,0 +1,79 @@
+"""
+shared_arrays.py is a collection of functions to share read-only arrays between processes through
+multiprocessing.shared_memory, where workers receive a small handle and attach a zero-copy view instead of
+unpickling their own copy of the array
+"""
+import numpy as np
+from multiprocessing import shared_memory
+
+
+# Shared memory blocks created or attached by this process, indexed by name
+_SHARED_BLOCKS = {}
+
+
+def shareArray(arr):
+    """
+    shareArray copies an array to a new shared memory block owned by this process
+
+    Parameters
+    - arr:np.array, array to share
+
+    Return
+    - handle:dict, keys name, shape and dtype of the shared array
+    """
+    block = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    shared = np.ndarray(arr.shape, dtype=arr.dtype, buffer=block.buf)
+    shared[...] = arr
+    _SHARED_BLOCKS[block.name] = block
+    return {'name': block.name, 'shape': list(arr.shape), 'dtype': arr.dtype.str}
+
+
+def attachArray(handle):
+    """
+    attachArray returns a read-only view of a shared array, attaching its block unless this process already has
+    it attached, where the block stays attached until detachArray, so the views of a task can share one attachment
+
+    Parameters
+    - handle:dict, keys name, shape and dtype as returned by shareArray
+
+    Return
+    - :np.array, view of the shared array
+    """
+    block = _SHARED_BLOCKS.get(handle['name'])
+    if block is None:
+        block = shared_memory.SharedMemory(name=handle['name'])
+        _SHARED_BLOCKS[handle['name']] = block
+    arr = np.ndarray(tuple(handle['shape']), dtype=np.dtype(handle['dtype']), buffer=block.buf)
+    arr.flags.writeable = False
+    return arr
+
+
+def detachArray(handle):
+    """
+    detachArray closes the block of a shared array attached by a worker, its views must not be used anymore
+
+    Parameters
+    - handle:dict, keys name, shape and dtype as returned by shareArray
+
+    Return
+    - :None
+    """
+    block = _SHARED_BLOCKS.pop(handle['name'], None)
+    if block is not None:
+        block.close()
+
+
+def releaseArray(handle):
+    """
+    releaseArray frees the block of a shared array created by shareArray, once no worker uses it anymore
+
+    Parameters
+    - handle:dict, keys name, shape and dtype as returned by shareArray
+
+    Return
+    - :None
+    """
+    block = _SHARED_BLOCKS.pop(handle['name'], None)
+    if block is not None:
+        block.close()
+        block.unlink()
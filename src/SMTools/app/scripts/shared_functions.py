@@ -1,11 +1,14 @@
 """
 shared_functions.py offers some utility functions such as file manipulation for all scripts
 """
+import os
 import json
 import numpy as np
 import cv2 as cv
 import matplotlib.pyplot as plt
 
+from scripts.image_loader import loadImage
+
 
 def saveToFile(data, filepath):
     """
@@ -39,33 +42,91 @@ def readJson(filepath):
     return data
 
 
-def readImage(img_calib, filepath):
+def readImage(img_calib, filepath, reduce=1):
     """
-    readImage returns an object data inside a given filepath of extension type readable by opencv
+    readImage returns an object data inside a given filepath of extension type readable by opencv,
+    the decoded image is cached and shared so it must not be modified in place
 
     Parameters
     - img_calib:dict, object with data about an image calibration 
     - filepath:str, text with the path to load the data 
+    - reduce:int, reduction factor of the decoding (1, 2, 4 or 8) for stages which don't need full detail
 
     Return
     - img:np.array, float of shape (m,n,3)
     """
     img_path = filepath + img_calib['nomeImagem'] + "." + img_calib['extensao']
-    img = cv.imread(img_path)
+    if not os.path.exists(img_path):
+        # Piece of a stereo image splitted only through crop rectangles
+        name_split = img_calib['nomeImagem'].split(sep='_')
+        crops_path = filepath + getCropsFilename('_'.join(name_split[:-1]))
+        if len(name_split) > 1 and os.path.exists(crops_path):
+            return readImageCrop(readJson(crops_path), name_split[-1], filepath, reduce)
+    img = loadImage(img_path, reduce)
     return img
 
 
-def createImageDict(img):
+def getCropsFilename(image_name):
     """
-    createImageDict returns a dictionary with the original image and all needed attributes and properties as keys
+    getCropsFilename returns the filename of the sidecar json with the crop rectangles of a stereo image
+
+    Parameters
+    - image_name:str, name of the stereo image without extension
+
+    Return
+    - :str, filename of the sidecar json
+    """
+    return image_name + "_crops.json"
+
+
+def cropImage(img, crop):
+    """
+    cropImage returns a view of the rectangle crop inside img, without copying it
+
+    Parameters
+    - img:np.array, of shape (m,n,3)
+    - crop:list, rectangle as [x0, y0, x1, y1]
+
+    Return
+    - :np.array, of shape (y1-y0,x1-x0,3)
+    """
+    x0, y0, x1, y1 = crop
+    return img[y0:y1, x0:x1, :]
+
+
+def readImageCrop(img_crops, side, filepath, reduce=1):
+    """
+    readImageCrop returns a piece of a stereo image as a view of the decoded source image, so both
+    pieces share a single decoding
 
     Parameters
+    - img_crops:dict, object with the source image and its crop rectangles
+    - side:str, piece to return (left, right or middle)
+    - filepath:str, text with the path of the folder of the sidecar json
+    - reduce:int, reduction factor of the decoding (1, 2, 4 or 8)
+
+    Return
     - img:np.array, float of shape (m,n,3)
+    """
+    source = loadImage(filepath + img_crops['source'], reduce)
+    crop = [value // reduce for value in img_crops['crops'][side]]
+    img = cropImage(source, crop)
+    return img
+
+
+def getCanvasParams(iWidth, iHeight):
+    """
+    getCanvasParams returns how an image of the given size is fitted and centered on the 1200x800 canvas
+
+    Parameters
+    - iWidth:int, width of the image
+    - iHeight:int, height of the image
 
     Return
-    - img_dict:dict, object with data about an image and its parameters
+    - cEscala:float, pixels of the canvas per pixel of the image
+    - wInicio:int, horizontal offset of the image on the canvas
+    - hInicio:int, vertical offset of the image on the canvas
     """
-    iWidth, iHeight = img.shape[1], img.shape[0]
     cWidth, cHeight = 1200, 800
     wInicio = 0
     hInicio = 0
@@ -79,6 +140,21 @@ def createImageDict(img):
     else:
         cEscala = cWidth/iWidth
         hInicio = int(np.trunc((cHeight - cEscala*iHeight)/2))
+    return cEscala, wInicio, hInicio
+
+
+def createImageDict(img):
+    """
+    createImageDict returns a dictionary with the original image and all needed attributes and properties as keys
+
+    Parameters
+    - img:np.array, float of shape (m,n,3)
+
+    Return
+    - img_dict:dict, object with data about an image and its parameters
+    """
+    iWidth, iHeight = img.shape[1], img.shape[0]
+    cEscala, wInicio, hInicio = getCanvasParams(iWidth, iHeight)
     img_canvas = cv.resize(img, (int(cEscala*iWidth), int(cEscala*iHeight)))
 
     if wInicio == 0:
@@ -129,6 +205,22 @@ def plotCalibSegs(img_dict_list, img_calib_list):
     - :None
     """
     fig, axs = plt.subplots(1, len(img_dict_list), figsize=(10, 20), dpi=80)
+    drawCalibSegs(axs, img_dict_list, img_calib_list)
+    plt.show()
+
+
+def drawCalibSegs(axs, img_dict_list, img_calib_list):
+    """
+    drawCalibSegs draws the calibration segments of multiple images, each on a different plot area
+
+    Parameters
+    - axs:list, matplotlib plot areas, one per image
+    - img_dict_list:list, list of objects with data about an image and its parameters
+    - img_calib_list:list, list of objects with data about an image calibration 
+
+    Return
+    - :None
+    """
     for idx, ax in enumerate(axs):
         ax.imshow(img_dict_list[idx]["img_canvas"])
         for i, c in enumerate(['r', 'g', 'b']):
@@ -136,7 +228,6 @@ def plotCalibSegs(img_dict_list, img_calib_list):
                      for j in range(len(img_calib_list[idx]['pontosguia'][i]) // 2)]
             for p0, p1 in edges:
                 plotEdge(p0, p1, c, ax)
-    plt.show()
 
 
 def getStereoFilename(filename):
@@ -1,30 +1,249 @@
 """
 split_image.py is a collection of functions to build an algorithm that automatically splits a stereo image in left, middle and right
 """
+import os
+import sys
 import cv2 as cv
 import numpy as np
-import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from scripts.image_loader import decodeImage
+from scripts.shared_functions import saveToFile, cropImage, getCropsFilename
+from scripts.profiling import stageTimer, countEvent
 
 
-def getLogDist(array):
+def getLogDist(array, length=None, offset=0):
     """
     getLogDist creates a array of weights with shape of the input, where the earlier observations have more weight
 
     Parameters
     - array:np.array, numpy array of shape (n,)
+    - length:int, total length of the distribution in case array is only a window of it
+    - offset:int, index of the first element of array inside the distribution
 
     Return
     - weight:np.array, numpy array of shape (n,) and float values between [0, 1] * array
     """
-    L = array.shape[0]
-    X = np.arange(L)
+    L = array.shape[0] if length is None else length
+    X = offset + np.arange(array.shape[0])
     weight = array * (np.log(1 + L - X) / np.log(1 + L))
     return weight
 
 
-def findBestAdds(img, c_x, c_y, r_x, r_y, image_left, ds=5):
+def getSplitScale(img, max_side=1024):
+    """
+    getSplitScale returns the integer downscale factor used for searching borders on a coarse version of img
+
+    Parameters
+    - img:np.array, numpy array of shape (m,n,3)
+    - max_side:int, maximum length of the coarse image side
+
+    Return
+    - scale:int, downscale factor
+    """
+    return max(1, int(np.ceil(max(img.shape[0], img.shape[1]) / max_side)))
+
+
+def getGraySmall(img, scale):
+    """
+    getGraySmall creates a grayscale copy of img downscaled by scale
+
+    Parameters
+    - img:np.array, numpy array of shape (m,n,3)
+    - scale:int, downscale factor
+
+    Return
+    - gray:np.array, uint8 numpy array of shape (m/scale, n/scale)
+    """
+    height, width = img.shape[0] // scale, img.shape[1] // scale
+    small = img[:height * scale, :width * scale]
+    if scale > 4:
+        # Nearest decimation only touches the sampled pixels, the area average then removes most of its aliasing
+        small = cv.resize(small, (4 * width, 4 * height),
+                          interpolation=cv.INTER_NEAREST)
+    if scale > 1:
+        small = cv.resize(small, (width, height), interpolation=cv.INTER_AREA)
+    gray = cv.cvtColor(small, cv.COLOR_BGR2GRAY)
+    return gray
+
+
+def getGrayIntegral(img, scale, gray=None):
+    """
+    getGrayIntegral creates the integral image of a grayscale copy of img downscaled by scale
+
+    Parameters
+    - img:np.array, numpy array of shape (m,n,3)
+    - scale:int, downscale factor
+    - gray:np.array, downscaled grayscale copy from getGraySmall, to share it between calls
+
+    Return
+    - gray_integral:np.array, float numpy array of shape (m/scale + 1, n/scale + 1)
+    """
+    gray = getGraySmall(img, scale) if gray is None else gray
+    gray_integral = cv.integral(gray, sdepth=cv.CV_64F)
+    return gray_integral
+
+
+def getPhaseAlignment(gray, scale):
+    """
+    getPhaseAlignment finds the translation between the left and right halves of a stereo image by phase
+    correlation of a downscaled grayscale copy, where a Hanning window keeps the borders of the halves from
+    adding a false peak at zero
+
+    Parameters
+    - gray:np.array, downscaled grayscale copy of the stereo image from getGraySmall
+    - scale:int, downscale factor of gray
+
+    Return
+    - alignment:dict, keys dx and dy with the sub-pixel offset on the full image from a point of the left piece
+    to the same point on the right piece, and response with the height of the correlation peak on [0, 1]
+    """
+    height, width = gray.shape[0], gray.shape[1] // 2
+    left = np.float32(gray[:, :width])
+    right = np.float32(gray[:, width:2 * width])
+    window = cv.createHanningWindow((width, height), cv.CV_32F)
+    (dx, dy), response = cv.phaseCorrelate(left, right, window)
+    alignment = {"dx": float((width + dx) * scale), "dy": float(dy * scale), "response": float(response)}
+    return alignment
+
+
+def alignStereoCrops(crops, alignment, shape):
+    """
+    alignStereoCrops moves the left and right rectangles by half of the difference between their offset and the
+    one found by phase correlation each, in opposite directions, so the pieces become aligned around the same
+    centre, then keeps both inside the image and updates the middle rectangle, where the rectangles are kept
+    unaligned when the aligned ones can't fit inside the image or the left one would overlap the right one
+
+    Parameters
+    - crops:dict, keys left, right and middle with rectangles [x0, y0, x1, y1]
+    - alignment:dict, keys dx and dy as returned by getPhaseAlignment
+    - shape:tuple, shape of the stereo image
+
+    Return
+    - crops:dict, keys left, right and middle with the aligned rectangles, or the given ones
+    """
+    left, right = np.array(crops["left"]), np.array(crops["right"])
+    residual = np.int64(np.round(right[:2] - left[:2] - [alignment["dx"], alignment["dy"]]))
+    left[[0, 2]] += residual[0] // 2
+    left[[1, 3]] += residual[1] // 2
+    right[[0, 2]] -= residual[0] - residual[0] // 2
+    right[[1, 3]] -= residual[1] - residual[1] // 2
+
+    # Both pieces move together so their offset is kept when one of them would leave the image
+    for axis, size in [(0, shape[1]), (1, shape[0])]:
+        low = min(left[axis], right[axis])
+        high = max(left[axis + 2], right[axis + 2])
+        move = -low if low < 0 else min(size - high, 0)
+        left[[axis, axis + 2]] += move
+        right[[axis, axis + 2]] += move
+
+    left, right = [int(value) for value in left], [int(value) for value in right]
+    inside = all(rect[0] >= 0 and rect[1] >= 0 and rect[2] <= shape[1] and rect[3] <= shape[0]
+                 for rect in [left, right])
+    if not inside or left[2] > right[0]:
+        countEvent("alignment_rejected")
+        return {key: list(crops[key]) for key in ["left", "right", "middle"]}
+    return {"left": left, "right": right, "middle": [left[2], 0, right[0], shape[0]]}
+
+
+def getBorderProfiles(gray_integral, x0, x1, y0, y1, x_start, x_end):
+    """
+    getBorderProfiles uses an integral image to get the mean intensity of every column (row) outside the rectangle,
+    spanning its rows (columns), ordered from the rectangle outwards
+
+    Parameters
+    - gray_integral:np.array, integral image of shape (m+1,n+1)
+    - x0, x1:int, columns of the rectangle as [x0, x1)
+    - y0, y1:int, rows of the rectangle as [y0, y1)
+    - x_start, x_end:int, columns of the image to consider as [x_start, x_end)
+
+    Return
+    - profiles:list, four np.array of mean intensities for directions x minus, x plus, y minus and y plus
+    """
+    I = gray_integral
+    col_means = ((I[y1, 1:] - I[y1, :-1]) -
+                 (I[y0, 1:] - I[y0, :-1])) / max(y1 - y0, 1)
+    row_means = ((I[1:, x1] - I[:-1, x1]) -
+                 (I[1:, x0] - I[:-1, x0])) / max(x1 - x0, 1)
+    profiles = [col_means[x_start:x0][::-1], col_means[x1:x_end],
+                row_means[:y0][::-1], row_means[y1:]]
+    return profiles
+
+
+def getBestProfileAdds(profiles, ds):
+    """
+    getBestProfileAdds finds, for all profiles at once, the distance with the highest log weighted difference
+    between intensities ds apart
+
+    Parameters
+    - profiles:list, list of np.array of shape (n_i,)
+    - ds:int, length of difference between segments
+
+    Return
+    - best_adds:np.array, int array with one value per profile
+    """
+    lengths = np.array([profile.shape[0] for profile in profiles])
+    stacked = np.full((len(profiles), max(lengths.max(), ds + 1)), np.nan)
+    for idx, profile in enumerate(profiles):
+        stacked[idx, :profile.shape[0]] = profile
+
+    diff_lengths = (lengths - ds).reshape(-1, 1)
+    X = np.arange(stacked.shape[1] - ds).reshape(1, -1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weight = np.log(1 + diff_lengths - X) / np.log(1 + diff_lengths)
+    segs_diff = np.abs(stacked[:, ds:] - stacked[:, :-ds]) * weight
+    segs_diff[~(X < diff_lengths)] = -1
+    best_adds = ds + np.argmax(segs_diff, axis=1)
+    return best_adds
+
+
+def refineAdd(img, direction, x0, x1, y0, y1, add, ds, radius):
+    """
+    refineAdd searches the best add at full resolution only in a window of the given radius around a coarse estimate
+
+    Parameters
+    - img:np.array, numpy array of shape (m,n,3)
+    - direction:int, index of direction (x minus, x plus, y minus, y plus)
+    - x0, x1:int, columns of the rectangle as [x0, x1)
+    - y0, y1:int, rows of the rectangle as [y0, y1)
+    - add:int, coarse estimate of the add at full resolution
+    - ds:int, length of difference between segments
+    - radius:int, amount of pixels to search around add
+
+    Return
+    - best_add:int, refined add
+    """
+    length = [x0, img.shape[1] - x1, y0, img.shape[0] - y1][direction]
+    diff_length = length - ds
+    if diff_length <= 0:
+        return ds
+    k_min = min(max(0, add - ds - radius), diff_length - 1)
+    k_max = max(min(diff_length - 1, add - ds + radius), k_min)
+    ks = np.arange(k_min, k_max + ds + 1)
+
+    if direction == 0:
+        segs = img[y0:y1, x0 - 1 - ks]
+    elif direction == 1:
+        segs = img[y0:y1, x1 + ks]
+    elif direction == 2:
+        segs = img[y0 - 1 - ks, x0:x1]
+    else:
+        segs = img[y1 + ks, x0:x1]
+
+    # Mean intensity of each column (row), as on the coarse search
+    segs = cv.cvtColor(np.ascontiguousarray(segs), cv.COLOR_BGR2GRAY)
+    segs = cv.reduce(segs, int(direction >= 2), cv.REDUCE_AVG,
+                     dtype=cv.CV_32F).ravel()
+    segs_diff = np.abs(segs[ds:] - segs[:-ds])
+    segs_diff = getLogDist(segs_diff, diff_length, k_min)
+    best_add = ds + k_min + int(np.argmax(segs_diff))
+    return best_add
+
+
+def findBestAdds(img, c_x, c_y, r_x, r_y, image_left, ds=5, gray_integral=None, scale=None):
     """
-    findBestAdds expands the rectangle looking for the two segments of distance ds with the highest difference in RGB values
+    findBestAdds expands the rectangle looking for the two segments of distance ds with the highest difference in
+    intensity values, searching first on a downscaled grayscale integral image and then refining locally at full resolution
 
     Parameters
     - img:np.array, numpy array of shape (m,n,3)
@@ -34,61 +253,68 @@ def findBestAdds(img, c_x, c_y, r_x, r_y, image_left, ds=5):
     - r_y:list, list of two integers indicating the positive radius for up and down from center
     - image_left:bool, indicates if padding is needed (in case of right image)
     - ds:int, length of difference between segments
+    - gray_integral:np.array, integral image of img from getGrayIntegral, to share it between calls
+    - scale:int, downscale factor of gray_integral
 
     Return
     - best_adds:list, four values to add to each radius (r_x[0], r_x[1], r_y[0], r_y[1]), respectively
     """
+    if gray_integral is None:
+        scale = getSplitScale(img) if scale is None else scale
+        gray_integral = getGrayIntegral(img, scale)
+
     # X axis padding necessary for right image
     x_padding = int(0.5*img.shape[1])
     if image_left:
-        img = img[:, :-x_padding, :]
+        x_start, x_end = 0, img.shape[1] - x_padding
     else:
-        x_padding -= 100
-        img = img[:, x_padding:, :]
-        c_x -= x_padding
+        x_start, x_end = x_padding - 100, img.shape[1]
+
+    x0, x1 = c_x - r_x[0], c_x + r_x[1]
+    y0, y1 = c_y - r_y[0], c_y + r_y[1]
+
+    # Coarse search over every direction on the downscaled image
+    def toCoarse(value, size):
+        return min(max(int(round(value / scale)), 0), size - 1)
+    coarse_w, coarse_h = gray_integral.shape[1], gray_integral.shape[0]
+    profiles = getBorderProfiles(gray_integral,
+                                 toCoarse(x0, coarse_w), toCoarse(x1, coarse_w),
+                                 toCoarse(y0, coarse_h), toCoarse(y1, coarse_h),
+                                 toCoarse(x_start, coarse_w), toCoarse(x_end, coarse_w))
+    coarse_ds = max(1, int(round(ds / scale)))
+    coarse_adds = getBestProfileAdds(profiles, coarse_ds)
 
-    # Finding best adds for each rectangle side
+    # Local refinement at full resolution around the coarse borders
+    img = img[:, x_start:x_end]
+    x0, x1 = x0 - x_start, x1 - x_start
     best_adds = []
-    for coord in ['x', 'y']:
-        for direction in ["minus", "plus"]:
-            # Segs to test the best add based on for loop variables
-            if coord == 'x':
-                if direction == "minus":
-                    segs = img[(c_y - r_y[0]): (c_y + r_y[1]),
-                               0: (c_x - r_x[0])]
-                else:
-                    segs = img[(c_y - r_y[0]): (c_y + r_y[1]),
-                               (c_x + r_x[1]): img.shape[1]]
-            else:
-                if direction == "minus":
-                    segs = img[0: (c_y - r_y[0]),
-                               (c_x - r_x[0]): (c_x + r_x[1])]
-                else:
-                    segs = img[(c_y + r_y[1]): img.shape[0],
-                               (c_x - r_x[0]): (c_x + r_x[1])]
-            if direction == "minus":
-                segs = np.flip(segs)
-
-            # Get best add
-            segs = np.mean(segs, axis=int(coord == 'y'))
-            segs_diff = np.sum(np.abs(segs[ds:] - segs[:-ds]), axis=1)
-            segs_diff = getLogDist(segs_diff)
-            best_add = ds + np.argmax(segs_diff)
-            best_adds.append(best_add)
+    for direction, coarse_add in enumerate(coarse_adds):
+        add = int(coarse_add) * scale
+        if scale > 1:
+            add = refineAdd(img, direction, x0, x1, y0, y1,
+                            add, ds, radius=2 * scale)
+        best_adds.append(add)
     return best_adds
 
 
-def getStereoSplit(img):
+def getStereoSplit(img, crops_only=False, align=False, min_response=0.3):
     """
-    getStereoSplit splits an img into three pieces (left, middle, right) using a deterministic heuristic
+    getStereoSplit splits an img into three pieces (left, middle, right) using a deterministic heuristic,
+    optionally refining the offset between left and right by phase correlation
 
     Parameters
     - img:np.array, numpy array of shape (m,n,3)
+    - crops_only:bool, to return only the crop rectangles instead of the pieces
+    - align:bool, to align the left and right pieces by getPhaseAlignment, adding the key alignment to crops
+    - min_response:float, minimum response of the phase correlation to move the pieces
 
     Return
     - imgL:np.array, numpy array of shape (mS,nS,3)
     - imgR:np.array, numpy array of shape (mS,nS,3)
     - imgM:np.array, numpy array of shape (mM,nM,3)
+    or, if crops_only
+    - crops:dict, keys left, right and middle with rectangles [x0, y0, x1, y1] of each piece, plus alignment as
+    returned by getPhaseAlignment if align
     """
     # Initial centers and radius of images left and right
     imgL_c_x = int(1/4 * img.shape[1])
@@ -100,12 +326,18 @@ def getStereoSplit(img):
     imgL_r_y = 2*[int((1/2 * 0.7) * img.shape[0])]
     imgR_r_y = 2*[int((1/2 * 0.7) * img.shape[0])]
 
-    # Find the amount to add to borders
+    # Find the amount to add to borders, sharing a single coarse integral image
+    scale = getSplitScale(img)
+    with stageTimer("getGrayIntegral"):
+        gray = getGraySmall(img, scale)
+        gray_integral = getGrayIntegral(img, scale, gray)
     imgL_adds = findBestAdds(img, imgL_c_x, imgL_c_y,
-                             imgL_r_x, imgL_r_y, image_left=True, ds=20)
+                             imgL_r_x, imgL_r_y, image_left=True, ds=20,
+                             gray_integral=gray_integral, scale=scale)
     imgL_add_x, imgL_add_y = imgL_adds[0:2], imgL_adds[2:]
     imgR_adds = findBestAdds(img, imgR_c_x, imgR_c_y,
-                             imgR_r_x, imgR_r_y, image_left=False, ds=20)
+                             imgR_r_x, imgR_r_y, image_left=False, ds=20,
+                             gray_integral=gray_integral, scale=scale)
     imgR_add_x, imgR_add_y = imgR_adds[0:2], imgR_adds[2:]
 
     # Update centers to the new rectangle
@@ -128,14 +360,214 @@ def getStereoSplit(img):
     r_y = min(imgL_r_y, imgR_r_y)
 
     # Get our image through its boundaries
-    imgL = img[(imgL_c_y - r_y): (imgL_c_y + r_y),
-               (imgL_c_x - r_x): (imgL_c_x + r_x), :]
-    imgR = img[(imgR_c_y - r_y): (imgR_c_y + r_y),
-               (imgR_c_x - r_x): (imgR_c_x + r_x), :]
-    imgM = img[:, (imgL_c_x + r_x): (imgR_c_x - r_x), :]
+    crops = {"left": [max(imgL_c_x - r_x, 0), max(imgL_c_y - r_y, 0), imgL_c_x + r_x, imgL_c_y + r_y],
+             "right": [max(imgR_c_x - r_x, 0), max(imgR_c_y - r_y, 0), imgR_c_x + r_x, imgR_c_y + r_y],
+             "middle": [imgL_c_x + r_x, 0, imgR_c_x - r_x, img.shape[0]]}
+    if align:
+        with stageTimer("getPhaseAlignment"):
+            alignment = getPhaseAlignment(gray, scale)
+        if alignment["response"] >= min_response:
+            crops = alignStereoCrops(crops, alignment, img.shape)
+        crops["alignment"] = alignment
+    if crops_only:
+        return crops
 
+    imgL = cropImage(img, crops["left"])
+    imgR = cropImage(img, crops["right"])
+    imgM = cropImage(img, crops["middle"])
     return imgL, imgR, imgM
 
+
+SPLIT_SUFFIXES = ["_left", "_right", "_middle"]
+IMAGE_EXTENSIONS = [".jpg", ".jpeg", ".png", ".tif", ".tiff"]
+
+
+def listStereoImages(input_path, recursive=True):
+    """
+    listStereoImages walks a folder returning every image which is not itself the output of a split
+
+    Parameters
+    - input_path:str, folder to look for stereo images
+    - recursive:bool, to also look inside the subfolders
+
+    Return
+    - image_paths:list, sorted list of paths of the images found
+    """
+    image_paths = []
+    for root, dirnames, filenames in os.walk(input_path):
+        if not recursive:
+            dirnames.clear()
+        for filename in filenames:
+            base_name, extension = os.path.splitext(filename)
+            if extension.lower() not in IMAGE_EXTENSIONS:
+                continue
+            if any(base_name.endswith(suffix) for suffix in SPLIT_SUFFIXES):
+                continue
+            image_paths.append(os.path.join(root, filename))
+    return sorted(image_paths)
+
+
+def getSplitPaths(image_path, output_path, extension=".jpg"):
+    """
+    getSplitPaths returns the paths of the left, right and middle pieces of a stereo image
+
+    Parameters
+    - image_path:str, path of the stereo image
+    - output_path:str, folder to save the pieces
+    - extension:str, extension of the saved pieces
+
+    Return
+    - output_paths:list, paths of the left, right and middle pieces
+    """
+    base_name = os.path.splitext(os.path.basename(image_path))[0]
+    output_paths = [os.path.join(output_path, base_name + suffix + extension)
+                    for suffix in SPLIT_SUFFIXES]
+    return output_paths
+
+
+def getSplitFolder(image_path, input_path, output_path):
+    """
+    getSplitFolder returns the folder to save the pieces of a stereo image found inside input_path, keeping its
+    subfolder so images with the same name on different subfolders don't overwrite each other
+
+    Parameters
+    - image_path:str, path of the stereo image
+    - input_path:str, folder where the stereo images were looked for
+    - output_path:str, folder to save the pieces
+
+    Return
+    - :str, folder to save the pieces of the image
+    """
+    subfolder = os.path.relpath(os.path.dirname(os.path.abspath(image_path)), os.path.abspath(input_path))
+    if subfolder == os.curdir:
+        return output_path
+    return os.path.join(output_path, subfolder)
+
+
+def saveStereoCrops(image_path, crops, output_path):
+    """
+    saveStereoCrops writes the sidecar json with the crop rectangles of a stereo image, which readImage
+    uses to load each piece as a view of the source image
+
+    Parameters
+    - image_path:str, path of the stereo image
+    - crops:dict, crop rectangles returned by getStereoSplit
+    - output_path:str, folder to save the sidecar json, must be the same folder or a parent of the source image
+
+    Return
+    - crops_path:str, path of the sidecar json
+    """
+    base_name = os.path.splitext(os.path.basename(image_path))[0]
+    source = os.path.relpath(image_path, output_path).replace(os.sep, "/")
+    crops_path = os.path.join(output_path, getCropsFilename(base_name))
+    saveToFile({"source": source, "crops": crops}, crops_path)
+    return crops_path
+
+
+def initSplitWorker():
+    """
+    initSplitWorker limits opencv to one thread, since parallelism comes from the pool of processes
+
+    Parameters
+    - :None
+
+    Return
+    - :None
+    """
+    cv.setNumThreads(1)
+
+
+def splitImageFile(image_path, output_path, extension=".jpg", crops_only=False):
+    """
+    splitImageFile reads a stereo image, splits it and writes the three pieces encoding them concurrently
+
+    Parameters
+    - image_path:str, path of the stereo image
+    - output_path:str, folder to save the pieces
+    - extension:str, extension of the saved pieces
+    - crops_only:bool, to write only the sidecar json with crop rectangles instead of encoding the pieces
+
+    Return
+    - output_paths:list, paths of the left, right and middle pieces (or of the sidecar json)
+    """
+    img = decodeImage(image_path)
+    os.makedirs(output_path, exist_ok=True)
+    if crops_only:
+        crops_path = saveStereoCrops(image_path, getStereoSplit(img, crops_only=True),
+                                     output_path)
+        return [crops_path]
+
+    imgs = getStereoSplit(img)
+    output_paths = getSplitPaths(image_path, output_path, extension)
+
+    # opencv releases the GIL while encoding, so the three pieces are encoded at the same time
+    with ThreadPoolExecutor(max_workers=len(output_paths)) as executor:
+        results = list(executor.map(cv.imwrite, output_paths, imgs))
+    if not all(results):
+        raise IOError("Couldn't write the pieces of " + image_path)
+    return output_paths
+
+
+def splitImageFolder(input_path, output_path, workers=None, max_in_flight=None, skip_existing=True, crops_only=False):
+    """
+    splitImageFolder splits every stereo image of a folder and its subfolders on a pool of processes, keeping at
+    most max_in_flight images submitted at a time to bound memory, where the pieces of an image inside a subfolder
+    are saved on the same subfolder of output_path
+
+    Parameters
+    - input_path:str, folder to look for stereo images
+    - output_path:str, folder to save the pieces
+    - workers:int, number of processes, defaults to the number of cores
+    - max_in_flight:int, maximum number of images submitted and not finished, defaults to twice the workers
+    - skip_existing:bool, to skip images whose pieces were already saved
+    - crops_only:bool, to write only the sidecar json with crop rectangles of each image
+
+    Return
+    - results:list, one dict per image with keys image, outputs and error
+    """
+    workers = workers if workers is not None else (os.cpu_count() or 1)
+    max_in_flight = max_in_flight if max_in_flight is not None else 2 * workers
+    os.makedirs(output_path, exist_ok=True)
+
+    image_paths = listStereoImages(input_path)
+    split_folders = {image_path: getSplitFolder(image_path, input_path, output_path)
+                     for image_path in image_paths}
+    if skip_existing:
+        if crops_only:
+            image_paths = [image_path for image_path in image_paths
+                           if not os.path.exists(os.path.join(split_folders[image_path], getCropsFilename(
+                               os.path.splitext(os.path.basename(image_path))[0])))]
+        else:
+            image_paths = [image_path for image_path in image_paths
+                           if not all(os.path.exists(split_path)
+                                      for split_path in getSplitPaths(image_path, split_folders[image_path]))]
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=initSplitWorker) as executor:
+        in_flight = {}
+        image_paths_iter = iter(image_paths)
+        while True:
+            for image_path in image_paths_iter:
+                future = executor.submit(splitImageFile, image_path, split_folders[image_path],
+                                         crops_only=crops_only)
+                in_flight[future] = image_path
+                if len(in_flight) >= max_in_flight:
+                    break
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                image_path = in_flight.pop(future)
+                try:
+                    results.append({"image": image_path,
+                                    "outputs": future.result(), "error": None})
+                except Exception as ex:
+                    results.append({"image": image_path,
+                                    "outputs": [], "error": str(ex)})
+    results.sort(key=lambda result: result["image"])
+    return results
+
 # Testing setup
 # def main():
 #     filename = sys.argv[1]
@@ -0,0 +1,178 @@
+"""
+stage_graph.py is a collection of functions to execute a dependency graph of stages, where the output of each stage
+is memoized by a hash of its version, its parameters, its input files and the hashes of the stages it depends on
+"""
+import os
+import json
+import hashlib
+
+from scripts.shared_functions import saveToFile, readJson
+from scripts.profiling import stageTimer, countEvent
+
+
+_FILE_HASHES = {}
+
+
+def createStage(name, func, deps=None, params=None, memo=True, files=None, outputs=None, version=1):
+    """
+    createStage creates a stage of the graph, which is called as func(*deps_values, **params)
+
+    Parameters
+    - name:str, unique name of the stage on the graph
+    - func:function, computes the value of the stage
+    - deps:list, names of the stages whose values are the inputs of func
+    - params:dict, json serializable keyword arguments of func, part of the hash
+    - memo:bool, to memoize the value, which must then be json serializable
+    - files:list, paths of input files whose contents are part of the hash
+    - outputs:list, paths of files written by func which must exist to reuse a memoized value
+    - version:int, version of the algorithm of func, part of the hash, to be increased whenever its value
+    changes for the same inputs
+
+    Return
+    - stage:dict, object with data about a stage
+    """
+    stage = {"name": name, "func": func, "deps": list(deps or []), "params": dict(params or {}),
+             "memo": memo, "files": list(files or []), "outputs": list(outputs or []), "version": version}
+    return stage
+
+
+def hashFile(filepath):
+    """
+    hashFile returns the sha256 of the contents of a file, reusing it while the file isn't modified
+
+    Parameters
+    - filepath:str, path of the file
+
+    Return
+    - :str, hexadecimal digest of the file contents
+    """
+    stat = os.stat(filepath)
+    stat_key = (os.path.abspath(filepath), stat.st_mtime_ns, stat.st_size)
+    if stat_key not in _FILE_HASHES:
+        file_hash = hashlib.sha256()
+        with open(filepath, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                file_hash.update(chunk)
+        _FILE_HASHES[stat_key] = file_hash.hexdigest()
+    return _FILE_HASHES[stat_key]
+
+
+def getStageKeys(graph):
+    """
+    getStageKeys computes the hash of every stage of the graph, which only depends on hashes of its inputs,
+    so it's known before executing anything
+
+    Parameters
+    - graph:dict, stages indexed by name
+
+    Return
+    - keys:dict, hexadecimal digest indexed by name of stage
+    """
+    keys = {}
+
+    def getKey(name, visiting):
+        if name in keys:
+            return keys[name]
+        if name in visiting:
+            raise ValueError("Cycle on graph through stage " + name)
+        visiting.add(name)
+        stage = graph[name]
+        key_data = [stage['name'], stage['version'], stage['params'],
+                    [getKey(dep, visiting) for dep in stage['deps']],
+                    [hashFile(filepath) for filepath in stage['files']]]
+        key_text = json.dumps(key_data, sort_keys=True)
+        keys[name] = hashlib.sha256(key_text.encode()).hexdigest()
+        visiting.remove(name)
+        return keys[name]
+
+    for name in graph:
+        getKey(name, set())
+    return keys
+
+
+def getDependents(graph, targets):
+    """
+    getDependents counts how many stages needed by the targets depend on each stage
+
+    Parameters
+    - graph:dict, stages indexed by name
+    - targets:list, names of the stages to evaluate
+
+    Return
+    - dependents:dict, number of dependent stages indexed by name
+    """
+    dependents = {}
+    needed = set()
+    pending = list(targets)
+    while pending:
+        name = pending.pop()
+        if name in needed:
+            continue
+        needed.add(name)
+        for dep in graph[name]['deps']:
+            dependents[dep] = dependents.get(dep, 0) + 1
+            pending.append(dep)
+    return dependents
+
+
+def runGraph(graph, targets, memo_path=None, release=False):
+    """
+    runGraph evaluates the target stages of the graph, executing only stages whose memoized value isn't
+    available and which are needed by some target
+
+    Parameters
+    - graph:dict, stages indexed by name
+    - targets:list, names of the stages to evaluate
+    - memo_path:str, folder of memoized values, None disables memoization
+    - release:bool, to drop the value of a stage which isn't a target as soon as every stage depending
+    on it is evaluated, so large intermediate values such as images don't stay alive until the end
+
+    Return
+    - values:dict, value of each evaluated stage indexed by name, only targets if release is True
+    - status:dict, computed or cached for each evaluated stage indexed by name
+    """
+    keys = getStageKeys(graph)
+    dependents = getDependents(graph, targets)
+    values = {}
+    status = {}
+
+    def releaseDeps(name):
+        for dep in graph[name]['deps']:
+            dependents[dep] -= 1
+            if dependents[dep] == 0 and dep not in targets:
+                values.pop(dep, None)
+
+    def evaluate(name):
+        if name in values:
+            return values[name]
+        stage = graph[name]
+        memo_filepath = None
+        if stage['memo'] and memo_path is not None:
+            memo_filepath = os.path.join(memo_path, keys[name] + ".json")
+            outputs_exist = all(os.path.exists(filepath)
+                                for filepath in stage['outputs'])
+            if outputs_exist and os.path.exists(memo_filepath):
+                values[name] = readJson(memo_filepath)['value']
+                status[name] = "cached"
+                countEvent("stages_cached")
+                if release:
+                    releaseDeps(name)
+                return values[name]
+
+        inputs = [evaluate(dep) for dep in stage['deps']]
+        with stageTimer(name):
+            values[name] = stage['func'](*inputs, **stage['params'])
+        status[name] = "computed"
+        countEvent("stages_computed")
+        if memo_filepath is not None:
+            os.makedirs(memo_path, exist_ok=True)
+            tmp_filepath = memo_filepath + "." + str(os.getpid()) + ".tmp"
+            saveToFile({"stage": name, "value": values[name]}, tmp_filepath)
+            os.replace(tmp_filepath, memo_filepath)
+        if release:
+            releaseDeps(name)
+        return values[name]
+
+    for target in targets:
+        evaluate(target)
+    return values, status
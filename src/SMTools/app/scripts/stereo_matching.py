@@ -3,19 +3,41 @@ stereo_matching.py is a collection of functions to build an algorithm that autom
 """
 import cv2 as cv
 import numpy as np
+from scipy.spatial import cKDTree
 import sys
 import copy
 
 from scripts.shared_functions import saveToFile, readJson, readImage, createImageDict, plotCalibSegs, getStereoFilename
+from scripts.profiling import stageTimer, countEvent
 
 
-def sift(img1_BGR, img2_BGR):
+def detectFeatures(img_BGR):
+    """
+    detectFeatures finds the SIFT keypoints of an image and their descriptors
+
+    Parameters
+    - img_BGR:np.array, numpy array of shape (m,n,3)
+
+    Return
+    - pts:np.array, float32 array of shape (k,2) with the keypoints coordinates x,y
+    - des:np.array, float32 array of shape (k,128) with the keypoints descriptors
+    """
+    img_GRAY = cv.cvtColor(img_BGR, cv.COLOR_BGR2GRAY)
+    kp, des = cv.SIFT_create().detectAndCompute(img_GRAY, None)
+    pts = np.float32([point.pt for point in kp]).reshape(-1, 2)
+    countEvent("keypoints_detected", len(kp))
+    return pts, des
+
+
+def sift(img1_BGR, img2_BGR, features1=None, features2=None):
     """
     sift creates two lists of points which are roughly equivalent between img1 and img2 
 
     Parameters
     - img1_BGR:np.array, numpy array of shape (m,n,3)
     - img2_BGR:np.array, numpy array of shape (m,n,3)
+    - features1:tuple, keypoints and descriptors of img1 already found by detectFeatures
+    - features2:tuple, keypoints and descriptors of img2 already found by detectFeatures
 
     Return
     - pts1:list, list of lists of len 2 indicating points on img1
@@ -23,37 +45,203 @@ def sift(img1_BGR, img2_BGR):
     """
     # SOURCE: https://docs.opencv.org/3.4/da/de9/tutorial_py_epipolar_geometry.html
 
-    img1_GRAY = cv.cvtColor(img1_BGR, cv.COLOR_BGR2GRAY)
-    img2_GRAY = cv.cvtColor(img2_BGR, cv.COLOR_BGR2GRAY)
-
     # So first we need to find as many possible matches between two images to find the best translation.
     # For this, we use SIFT descriptors with FLANN based matcher and ratio test.
-    sift = cv.SIFT_create()
     # find the keypoints and descriptors with SIFT
-    kp1, des1 = sift.detectAndCompute(img1_GRAY, None)
-    kp2, des2 = sift.detectAndCompute(img2_GRAY, None)
+    with stageTimer("sift_detect"):
+        kp1, des1 = features1 if features1 is not None else detectFeatures(img1_BGR)
+        kp2, des2 = features2 if features2 is not None else detectFeatures(img2_BGR)
 
     # FLANN parameters
-    FLANN_INDEX_KDTREE = 1
-    index_params = dict(algorithm=FLANN_INDEX_KDTREE, trees=5)
-    search_params = dict(checks=50)
-    flann = cv.FlannBasedMatcher(index_params, search_params)
-    matches = flann.knnMatch(des1, des2, k=2)
-    pts1 = []
-    pts2 = []
-    # ratio test as per Lowe's paper
-    for i, (m, n) in enumerate(matches):
-        if m.distance < 0.8*n.distance:
-            pts2.append(kp2[m.trainIdx].pt)
-            pts1.append(kp1[m.queryIdx].pt)
+    with stageTimer("sift_match"):
+        FLANN_INDEX_KDTREE = 1
+        index_params = dict(algorithm=FLANN_INDEX_KDTREE, trees=5)
+        search_params = dict(checks=50)
+        flann = cv.FlannBasedMatcher(index_params, search_params)
+        matches = flann.knnMatch(des1, des2, k=2)
+        pts1 = []
+        pts2 = []
+        # ratio test as per Lowe's paper
+        for i, (m, n) in enumerate(matches):
+            if m.distance < 0.8*n.distance:
+                pts2.append(kp2[m.trainIdx])
+                pts1.append(kp1[m.queryIdx])
+    countEvent("matches_found", len(matches))
+    countEvent("matches_kept", len(pts1))
 
     # Now we have the list of best matches from both the images. Let's find the mean translation
-    pts1 = np.int32(pts1)
-    pts2 = np.int32(pts2)
+    pts1 = np.int32(pts1).reshape(-1, 2)
+    pts2 = np.int32(pts2).reshape(-1, 2)
     return pts1, pts2
 
 
-def edgeMatch(img1_pts_match, img2_pts_match, edge):
+def estimateFundamental(pts1, pts2, threshold=1.5):
+    """
+    estimateFundamental finds the fundamental matrix between two images from their matches with RANSAC
+
+    Parameters
+    - pts1:np.array, x,y of the matches on img1 of shape (k,2)
+    - pts2:np.array, x,y of the matches on img2 of shape (k,2)
+    - threshold:float, maximum distance in pixels of an inlier to its epipolar line
+
+    Return
+    - F:np.array, fundamental matrix of shape (3,3), such that x2^T F x1 = 0, or None if not found
+    - inliers:np.array, boolean array of shape (k,)
+    """
+    pts1, pts2 = np.float64(pts1).reshape(-1, 2), np.float64(pts2).reshape(-1, 2)
+    if len(pts1) < 8:
+        return None, np.zeros(len(pts1), dtype=bool)
+    F, mask = cv.findFundamentalMat(pts1, pts2, cv.FM_RANSAC, threshold, 0.999)
+    if F is None or F.shape != (3, 3):
+        return None, np.zeros(len(pts1), dtype=bool)
+    return F, mask.ravel() == 1
+
+
+def getEpipolarLines(F, pts1):
+    """
+    getEpipolarLines returns the epipolar lines on img2 of points of img1, normalized so a*x + b*y + c is
+    the distance in pixels of a point x,y to the line
+
+    Parameters
+    - F:np.array, fundamental matrix of shape (3,3)
+    - pts1:np.array, x,y of points on img1 of shape (k,2)
+
+    Return
+    - :np.array, a,b,c of each line of shape (k,3)
+    """
+    pts1 = np.float64(pts1).reshape(-1, 2)
+    lines = np.concatenate([pts1, np.ones((len(pts1), 1))], axis=1) @ F.T
+    return lines / np.linalg.norm(lines[:, :2], axis=1, keepdims=True)
+
+
+def guidedMatch(pts1, des1, pts2, des2, F, center, band=3.0, bin_size=32, ratio=0.8, shift=None, radius=None):
+    """
+    guidedMatch matches each keypoint of img1 only against the keypoints of img2 close to its epipolar line,
+    comparing descriptors only for those pairs, where with shift the candidates are first bounded to the keypoints
+    of img2 within radius of the expected position, and otherwise the keypoints of img1 are processed in bins of
+    nearby epipolar lines, as rows of rectified images
+
+    Parameters
+    - pts1:np.array, x,y of the keypoints of img1 of shape (k1,2)
+    - des1:np.array, descriptors of the keypoints of img1 of shape (k1,128)
+    - pts2:np.array, x,y of the keypoints of img2 of shape (k2,2)
+    - des2:np.array, descriptors of the keypoints of img2 of shape (k2,128)
+    - F:np.array, fundamental matrix of shape (3,3)
+    - center:tuple, x,y of the center of img2, where the offsets of the epipolar lines are measured
+    - band:float, maximum distance in pixels of a candidate to the epipolar line
+    - bin_size:float, pixels of offset between the epipolar lines of each bin
+    - ratio:float, ratio of Lowe's test between the best and the second best candidates
+    - shift:np.array, expected displacement x,y between the keypoints of a match, None to accept any
+    - radius:float, maximum distance in pixels between the displacement of a match and shift
+
+    Return
+    - idx1:np.array, indexes of the matched keypoints of img1
+    - idx2:np.array, indexes of the matched keypoints of img2
+    """
+    lines = np.float32(getEpipolarLines(F, pts1))
+    pts2_hom = np.concatenate([pts2, np.ones((len(pts2), 1))], axis=1).astype(np.float32)
+    des1, des2 = np.float32(des1), np.float32(des2)
+    norms1, norms2 = np.sum(des1 ** 2, axis=1), np.sum(des2 ** 2, axis=1)
+    pairs1, pairs2 = [], []
+
+    if shift is not None:
+        # Repeated patterns along the epipolar line, such as windows, are only told apart by the disparity, and the
+        # few keypoints of img2 around the expected position of each keypoint are found with a kd-tree
+        tree1 = cKDTree(np.asarray(pts1, dtype=np.float64) + shift)
+        tree2 = cKDTree(np.asarray(pts2, dtype=np.float64))
+        near = tree1.sparse_distance_matrix(tree2, radius, output_type='ndarray')
+        rows, cols = np.int64(near['i']), np.int64(near['j'])
+        on_line = np.abs(np.sum(lines[rows] * pts2_hom[cols], axis=1)) <= band
+        pairs1.append(rows[on_line])
+        pairs2.append(cols[on_line])
+    else:
+        # Signed distance of each epipolar line to the center of img2
+        offsets = lines @ np.float32([center[0], center[1], 1])
+        bins1 = np.floor(offsets / bin_size).astype(np.int64)
+        for bin1 in np.unique(bins1):
+            group = np.nonzero(bins1 == bin1)[0]
+            rows, cols = np.nonzero(np.abs(lines[group] @ pts2_hom.T) <= band)
+            pairs1.append(group[rows])
+            pairs2.append(cols)
+
+    pairs1 = np.concatenate(pairs1) if pairs1 else np.zeros(0, dtype=np.int64)
+    pairs2 = np.concatenate(pairs2) if pairs2 else np.zeros(0, dtype=np.int64)
+    countEvent("guided_candidates", len(pairs1))
+    if len(pairs1) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    # Descriptors are only compared for the pairs inside the band, instead of every keypoint of the group
+    # against every keypoint of the band
+    des_distances = np.empty(len(pairs1), dtype=np.float32)
+    for start in range(0, len(pairs1), 65536):
+        chunk1, chunk2 = pairs1[start:start + 65536], pairs2[start:start + 65536]
+        des_distances[start:start + 65536] = norms1[chunk1] + norms2[chunk2] - \
+            2 * np.einsum('ij,ij->i', des1[chunk1], des2[chunk2])
+
+    # Candidates of each keypoint sorted by distance, the first is the best and the next one the second best
+    order = np.lexsort((des_distances, pairs1))
+    pairs1, pairs2, des_distances = pairs1[order], pairs2[order], des_distances[order]
+    first = np.nonzero(np.r_[True, pairs1[1:] != pairs1[:-1]])[0]
+    has_second = np.r_[first[1:], len(pairs1)] - first > 1
+    second = np.full(len(first), np.inf, dtype=np.float32)
+    second[has_second] = des_distances[first[has_second] + 1]
+    # Squared distances, so the ratio is squared
+    accepted = des_distances[first] < (ratio ** 2) * second
+    return pairs1[first[accepted]], pairs2[first[accepted]]
+
+
+def siftGuided(img1_BGR, img2_BGR, features1=None, features2=None, sample_size=1500, band=3.0, bin_size=32):
+    """
+    siftGuided matches two images in two passes, first estimating the fundamental matrix from the matches of a
+    sample of the keypoints, then matching every keypoint only against the keypoints close to its epipolar line
+    whose displacement is near the displacements of the sampled matches
+
+    Parameters
+    - img1_BGR:np.array, numpy array of shape (m,n,3)
+    - img2_BGR:np.array, numpy array of shape (m,n,3)
+    - features1:tuple, keypoints and descriptors of img1 already found by detectFeatures
+    - features2:tuple, keypoints and descriptors of img2 already found by detectFeatures
+    - sample_size:int, number of keypoints of each image matched on the first pass
+    - band:float, maximum distance in pixels of a match to its epipolar line
+    - bin_size:float, pixels of offset between the epipolar lines of each bin
+
+    Return
+    - pts1:np.array, int32 array of shape (k,2) indicating points on img1
+    - pts2:np.array, int32 array of shape (k,2) indicating points on img2
+    - F:np.array, fundamental matrix of shape (3,3), such that x2^T F x1 = 0
+    """
+    with stageTimer("sift_detect"):
+        kp1, des1 = features1 if features1 is not None else detectFeatures(img1_BGR)
+        kp2, des2 = features2 if features2 is not None else detectFeatures(img2_BGR)
+
+    with stageTimer("sift_sample_match"):
+        sample1 = np.linspace(0, len(kp1) - 1, min(sample_size, len(kp1))).astype(np.int64)
+        sample2 = np.linspace(0, len(kp2) - 1, min(sample_size, len(kp2))).astype(np.int64)
+        matches = cv.BFMatcher(cv.NORM_L2).knnMatch(des1[sample1], des2[sample2], k=2)
+        pairs = [(sample1[m.queryIdx], sample2[m.trainIdx]) for m, n in
+                 (match for match in matches if len(match) == 2) if m.distance < 0.8 * n.distance]
+        pairs = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+        F, inliers = estimateFundamental(kp1[pairs[:, 0]], kp2[pairs[:, 1]])
+    if F is None:
+        # Not enough matches on the sample, so every keypoint is matched
+        pts1, pts2 = sift(img1_BGR, img2_BGR, (kp1, des1), (kp2, des2))
+        F, inliers = estimateFundamental(pts1, pts2)
+        return pts1, pts2, F
+
+    with stageTimer("sift_guided_match"):
+        center = (img2_BGR.shape[1] / 2, img2_BGR.shape[0] / 2)
+        # Displacements of the sampled inliers bound the disparities searched along the epipolar lines
+        displacements = kp2[pairs[inliers, 1]] - kp1[pairs[inliers, 0]]
+        shift = np.median(displacements, axis=0)
+        radius = max(6 * np.median(np.linalg.norm(displacements - shift, axis=1)), 8 * band)
+        idx1, idx2 = guidedMatch(kp1, des1, kp2, des2, F, center, band, bin_size, shift=shift, radius=radius)
+    countEvent("matches_kept", len(idx1))
+    pts1 = np.int32(kp1[idx1]).reshape(-1, 2)
+    pts2 = np.int32(kp2[idx2]).reshape(-1, 2)
+    return pts1, pts2, F
+
+
+def edgeMatch(img1_pts_match, img2_pts_match, edge, F=None):
     """
     edgeMatch finds the best possible match for an edge using a list of equivalent points of two images
 
@@ -61,6 +249,7 @@ def edgeMatch(img1_pts_match, img2_pts_match, edge):
     - img1_pts_match:list, list of lists of len 2 indicating points on img1
     - img2_pts_match:list, list of lists of len 2 indicating points on img2
     - edge:np.array, array of size (2,2) indicating two points (an edge) over axis 0
+    - F:np.array, fundamental matrix of shape (3,3), if given each point is moved onto its epipolar line
 
     Return
     - edge:np.array, array of size (2,2) indicating two points (an edge) over axis 0
@@ -82,25 +271,41 @@ def edgeMatch(img1_pts_match, img2_pts_match, edge):
                                            :] - img1_pts_match[closest_points_indexes, :]
         closest_ds += np.mean(translation_diffs, axis=0)
 
-    edge += closest_ds / 2
+    if F is not None:
+        lines = getEpipolarLines(F, edge)
+        edge += closest_ds / 2
+        # Closest point of each epipolar line
+        edge -= lines[:, :2] * (np.sum(lines[:, :2] * edge, axis=1, keepdims=True) + lines[:, 2:])
+    else:
+        edge += closest_ds / 2
     edge = np.round(edge).astype(np.int64)
     return edge
 
 
-def stereoEdgesMatching(img1_calib, img1_dict, img2_calib, img2_dict):
+def stereoEdgesMatching(img1_calib, img1_dict, img2_calib, img2_dict, guided=False):
     """
-    stereoEdgesMatching creates a routine to automatically copy and modify a calibration for img2 from img1
+    stereoEdgesMatching creates a routine to automatically copy and modify a calibration for img2 from img1,
+    reusing the key sift_features of the image dicts when already computed
 
     Parameters
     - img1_dict:dict, object with data about an image and its parameters
     - img1_calib:dict, object with data about an image calibration 
     - img2_dict:dict, object with data about an image and its parameters
     - img2_calib:dict, object with data about an image calibration 
+    - guided:bool, if True the matches are found by siftGuided and the edges are moved onto their epipolar lines
 
     Return
     - img2_calib:dict, object with data about an image calibration 
     """
-    img1_pts_match, img2_pts_match = sift(img1_dict['img'], img2_dict['img'])
+    F = None
+    with stageTimer("sift"):
+        if guided:
+            img1_pts_match, img2_pts_match, F = siftGuided(img1_dict['img'], img2_dict['img'],
+                                                           img1_dict.get('sift_features'),
+                                                           img2_dict.get('sift_features'))
+        else:
+            img1_pts_match, img2_pts_match = sift(img1_dict['img'], img2_dict['img'],
+                                                  img1_dict.get('sift_features'), img2_dict.get('sift_features'))
 
     cEscala, wInicio, hInicio = img2_dict['cEscala'], img2_dict['wInicio'], img2_dict['hInicio']
     for i in range(3):
@@ -113,8 +318,9 @@ def stereoEdgesMatching(img1_calib, img1_dict, img2_calib, img2_dict):
                   img2_calib['pontosguia'][i][2*j + 1]]
                  for j in range(int(len(img2_calib['pontosguia'][i]) / 2))]
         # match each edge on the other image
-        edges = [edgeMatch(img1_pts_match, img2_pts_match, np.array(edge))
-                 for edge in edges]
+        with stageTimer("edgeMatch"):
+            edges = [edgeMatch(img1_pts_match, img2_pts_match, np.array(edge), F)
+                     for edge in edges]
         # conver to list
         edges = [edge[point_idx, :].tolist()
                  for edge in edges for point_idx in range(edge.shape[0])]
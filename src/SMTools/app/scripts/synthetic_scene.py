@@ -0,0 +1,543 @@
+"""
+synthetic_scene.py is a collection of functions to render synthetic scenes of boxes from known cameras, as single
+images or as stereo cards, with noisy calibration segments in the format of TextureExtractor and the ground truth
+of the camera and of each annotated edge, so the stages can be benchmarked against exact values
+"""
+import os
+import numpy as np
+import cv2 as cv
+
+from scripts.shared_functions import saveToFile, getCanvasParams
+from scripts.camera_projection import projectPoints, canvasToImage
+
+
+# Faces of a box as (axis of the normal, side), corners indexed by the bits x,y,z of their position
+BOX_FACES = [(axis, side) for axis in range(3) for side in range(2)]
+
+# Shade of the faces orthogonal to each axis, so the edges between faces have contrast
+FACE_SHADES = [0.55, 0.95, 1.25]
+
+# Height of the camera above the ground, in units of the space
+CAMERA_HEIGHT = 1.6
+
+
+def getRotation(yaw, pitch, roll):
+    """
+    getRotation returns the matrix whose columns are the X, Y and Z axes of the space on the camera, where Z is
+    the vertical and X, Y the horizontal axes of the scene
+
+    Parameters
+    - yaw:float, angle in radians between the X axis and the plane of the image
+    - pitch:float, angle in radians the camera looks above the horizon
+    - roll:float, angle in radians of rotation around the optical axis
+
+    Return
+    - :np.array, of shape (3,3)
+    """
+    level = np.array([[np.cos(yaw), -np.sin(yaw), 0],
+                      [0, 0, -1],
+                      [np.sin(yaw), np.cos(yaw), 0]])
+    tilt = np.array([[1, 0, 0],
+                     [0, np.cos(pitch), np.sin(pitch)],
+                     [0, -np.sin(pitch), np.cos(pitch)]])
+    spin = np.array([[np.cos(roll), -np.sin(roll), 0],
+                     [np.sin(roll), np.cos(roll), 0],
+                     [0, 0, 1]])
+    return spin @ tilt @ level
+
+
+def createCamera(rng, focal_range=(800, 1400), center_jitter=20, yaw_range=(25, 65), pitch_range=(4, 12),
+                 roll_range=(-2, 2)):
+    """
+    createCamera draws a random camera looking at the scene and returns it as a calibration of TextureExtractor
+
+    Parameters
+    - rng:np.random.Generator, source of randomness
+    - focal_range:tuple, range of the distance in pixels of the canvas between the camera and the canvas
+    - center_jitter:float, maximum distance in pixels between the optical center and the center of the canvas
+    - yaw_range:tuple, range of the yaw in degrees
+    - pitch_range:tuple, range of the pitch in degrees
+    - roll_range:tuple, range of the roll in degrees
+
+    Return
+    - img_calib:dict, object with keys base, centrooptico, camera and pontosfuga
+    """
+    M = getRotation(*np.radians([rng.uniform(*yaw_range), rng.uniform(*pitch_range), rng.uniform(*roll_range)]))
+    CO = np.array([600, 400]) + rng.uniform(-center_jitter, center_jitter, 2)
+    C = np.array([CO[0], CO[1], -rng.uniform(*focal_range)])
+    # Every axis points away from the camera, so its vanishing point is where it crosses the canvas
+    vanishing_points = [(C[:2] - C[2] / M[2, dim] * M[:2, dim]).tolist() for dim in range(3)]
+    return {"base": M.T.ravel().tolist(), "centrooptico": CO.tolist(), "camera": C.tolist(),
+            "pontosfuga": vanishing_points}
+
+
+def getBoxCorners(box):
+    """
+    getBoxCorners returns the corners of a box, where the corner i has the bits x,y,z of i as position
+
+    Parameters
+    - box:dict, object with keys min and max, opposite corners of the box
+
+    Return
+    - :np.array, of shape (8,3)
+    """
+    bounds = np.array([box['min'], box['max']])
+    return np.array([[bounds[(i >> dim) & 1, dim] for dim in range(3)] for i in range(8)])
+
+
+def getFaceQuad(axis, side):
+    """
+    getFaceQuad returns the corners of a face of a box in order around it, starting at the top left corner of
+    its texture, where the vertical faces have Z going up
+
+    Parameters
+    - axis:int, axis of the normal of the face
+    - side:int, 0 for the face at the minimum of the axis, 1 for the maximum
+
+    Return
+    - :list, indexes of the 4 corners as in getBoxCorners
+    """
+    u, v = [dim for dim in range(3) if dim != axis]
+    top = 1 if v == 2 else 0
+    corner = (lambda bit_u, bit_v: (side << axis) | (bit_u << u) | (bit_v << v))
+    return [corner(0, top), corner(1, top), corner(1, 1 - top), corner(0, 1 - top)]
+
+
+def isFaceVisible(box, axis, side, position):
+    """
+    isFaceVisible tells if a face of a box faces a camera
+
+    Parameters
+    - box:dict, object with keys min and max, opposite corners of the box
+    - axis:int, axis of the normal of the face
+    - side:int, 0 for the face at the minimum of the axis, 1 for the maximum
+    - position:np.array, position of the camera in the space
+
+    Return
+    - :bool
+    """
+    plane = box['max'][axis] if side else box['min'][axis]
+    return (plane - position[axis]) * (1 if side else -1) < 0
+
+
+def createScene(rng, img_calib, n_boxes=3, distance_range=(20, 40), size_range=(4, 10), height_range=(6, 18)):
+    """
+    createScene places boxes on the ground in front of the camera, without overlapping each other
+
+    Parameters
+    - rng:np.random.Generator, source of randomness
+    - img_calib:dict, camera as returned by createCamera
+    - n_boxes:int, number of boxes
+    - distance_range:tuple, range of the horizontal distance of the boxes to the camera
+    - size_range:tuple, range of the sides of the boxes on the ground
+    - height_range:tuple, range of the heights of the boxes
+
+    Return
+    - boxes:list, dicts with keys min, max and color
+    """
+    M = np.array(img_calib['base']).reshape(3, 3).T
+    forward = np.array([M[2, 0], M[2, 1]]) / np.linalg.norm(M[2, :2])
+    lateral = np.array([-forward[1], forward[0]])
+    boxes = []
+    for _ in range(50 * n_boxes):
+        if len(boxes) == n_boxes:
+            break
+        distance = rng.uniform(*distance_range)
+        center = forward * distance + lateral * distance * rng.uniform(-0.35, 0.35)
+        half = rng.uniform(*size_range, 2) / 2
+        box = {"min": np.array([center[0] - half[0], center[1] - half[1], -CAMERA_HEIGHT]),
+               "max": np.array([center[0] + half[0], center[1] + half[1], rng.uniform(*height_range) - CAMERA_HEIGHT]),
+               "color": rng.uniform(60, 200, 3)}
+        overlaps = any(np.all(box['min'][:2] < other['max'][:2] + 1) and np.all(other['min'][:2] < box['max'][:2] + 1)
+                       for other in boxes)
+        if not overlaps and np.all(getBoxCorners(box) @ M[2] > 1):
+            boxes.append(box)
+    return boxes
+
+
+def createFaceTexture(rng, color, shade, width, height, px_per_unit=24, windows=True):
+    """
+    createFaceTexture draws the texture of a face of a box, a noisy wall with a grid of windows of random tints,
+    so matchers find distinctive keypoints
+
+    Parameters
+    - rng:np.random.Generator, source of randomness
+    - color:np.array, BGR color of the box
+    - shade:float, factor of the color of the face
+    - width:float, width of the face in units of the space
+    - height:float, height of the face in units of the space
+    - px_per_unit:int, pixels of the texture per unit of the space
+    - windows:bool, to draw the windows
+
+    Return
+    - texture:np.array, float32 of shape (h,w,3)
+    """
+    w = int(np.clip(width * px_per_unit, 8, 2048))
+    h = int(np.clip(height * px_per_unit, 8, 2048))
+    texture = np.empty((h, w, 3), dtype=np.float32)
+    texture[:] = np.clip(color * shade, 0, 255)
+    if windows:
+        rows, cols = int(height / 3), int(width / 2.5)
+        for row in range(rows):
+            for col in range(cols):
+                x0, y0 = int((col + 0.3) * w / cols), int((row + 0.3) * h / rows)
+                x1, y1 = int((col + 0.7) * w / cols), int((row + 0.75) * h / rows)
+                texture[y0:y1, x0:x1] = rng.uniform(20, 230, 3) * shade
+    texture += rng.normal(0, 6, texture.shape).astype(np.float32)
+    return texture
+
+
+def drawQuad(img, ids, texture, corners, quad_id):
+    """
+    drawQuad draws a texture over a quadrilateral of the image, blending its borders with antialiasing, and marks
+    its pixels on the map of ids
+
+    Parameters
+    - img:np.array, float32 image of shape (m,n,3) drawn in place
+    - ids:np.array, int32 map of shape (m,n) of the quad seen at each pixel, drawn in place
+    - texture:np.array, float32 of shape (h,w,3)
+    - corners:np.array, x,y on the image of the top left, top right, bottom right and bottom left corners of the
+    texture of shape (4,2)
+    - quad_id:int, value marked on ids
+
+    Return
+    - :None
+    """
+    h, w = texture.shape[:2]
+    x0, y0 = np.maximum(np.floor(np.min(corners, axis=0)).astype(int) - 1, 0)
+    x1, y1 = np.minimum(np.ceil(np.max(corners, axis=0)).astype(int) + 2, [img.shape[1], img.shape[0]])
+    if x0 >= x1 or y0 >= y1:
+        return
+    # Borders of the texture pixels, so the blended border of the quad lies on the projected edge
+    texture_corners = np.float32([[-0.5, -0.5], [w - 0.5, -0.5], [w - 0.5, h - 0.5], [-0.5, h - 0.5]])
+    H = cv.getPerspectiveTransform(texture_corners, np.float32(corners - [x0, y0]))
+    size = (int(x1 - x0), int(y1 - y0))
+    warped = cv.warpPerspective(texture, H, size, flags=cv.INTER_LINEAR, borderMode=cv.BORDER_REPLICATE)
+    alpha = cv.warpPerspective(np.ones((h, w), dtype=np.float32), H, size, flags=cv.INTER_LINEAR)[..., None]
+    roi = img[y0:y1, x0:x1]
+    roi *= 1 - alpha
+    roi += alpha * warped
+    cv.fillConvexPoly(ids, np.int32(np.round(corners * 16)), int(quad_id), lineType=cv.LINE_8, shift=4)
+
+
+def projectView(points, img_calib, canvas, position):
+    """
+    projectView projects points of the space on the image seen by a camera at a position
+
+    Parameters
+    - points:np.array, x,y,z of the points of shape (k,3)
+    - img_calib:dict, camera as returned by createCamera
+    - canvas:dict, object with keys cEscala, wInicio and hInicio of the image
+    - position:np.array, position of the camera in the space
+
+    Return
+    - :np.array, x,y of the points on the image of shape (k,2)
+    """
+    return canvasToImage(projectPoints(points - position, img_calib), canvas)
+
+
+def renderView(rng, boxes, ground, img_calib, canvas, size, position):
+    """
+    renderView renders the scene seen by a camera, painting the sky, the ground and the boxes from the farthest
+
+    Parameters
+    - rng:np.random.Generator, source of randomness
+    - boxes:list, boxes as returned by createScene, with key textures
+    - ground:np.array, float32 texture of the ground
+    - img_calib:dict, camera as returned by createCamera
+    - canvas:dict, object with keys cEscala, wInicio and hInicio of the image
+    - size:tuple, width and height of the image
+    - position:np.array, position of the camera in the space
+
+    Return
+    - img:np.array, uint8 of shape (m,n,3)
+    - ids:np.array, int32 of shape (m,n), 1 + index of the box seen at each pixel, 0 for the ground, -1 for the sky
+    """
+    width, height = size
+    sky = np.linspace(235, 180, height, dtype=np.float32)[:, None, None] * np.float32([1, 0.9, 0.75])
+    img = np.repeat(sky, width, axis=1)
+    ids = -np.ones((height, width), dtype=np.int32)
+
+    M = np.array(img_calib['base']).reshape(3, 3).T
+    forward = np.array([M[2, 0], M[2, 1], 0]) / np.linalg.norm(M[2, :2])
+    lateral = np.array([-forward[1], forward[0], 0])
+    # Trapezoid in front of the camera, so every corner projects on the canvas
+    quad = [forward * 200 - lateral * 180, forward * 200 + lateral * 180,
+            forward * 3 + lateral * 2.5, forward * 3 - lateral * 2.5]
+    quad = np.array(quad) + [position[0], position[1], -CAMERA_HEIGHT]
+    drawQuad(img, ids, ground, projectView(quad, img_calib, canvas, position), 0)
+
+    order = sorted(range(len(boxes)), reverse=True,
+                   key=lambda i: np.linalg.norm((boxes[i]['min'] + boxes[i]['max']) / 2 - position))
+    for i in order:
+        corners = getBoxCorners(boxes[i])
+        for axis, side in BOX_FACES:
+            if isFaceVisible(boxes[i], axis, side, position):
+                quad = projectView(corners[getFaceQuad(axis, side)], img_calib, canvas, position)
+                drawQuad(img, ids, boxes[i]['textures'][(axis, side)], quad, i + 1)
+    img += rng.normal(0, 2, img.shape).astype(np.float32)
+    return np.uint8(np.clip(np.round(img), 0, 255)), ids
+
+
+def getEdgeRun(p0, p1, ids, box_id, size, samples=41, margin=3):
+    """
+    getEdgeRun returns the longest part of a projected edge inside the image which is not occluded
+
+    Parameters
+    - p0:np.array, x,y of an end of the edge on the image
+    - p1:np.array, x,y of the other end of the edge on the image
+    - ids:np.array, map of the box seen at each pixel as returned by renderView
+    - box_id:int, id of the box of the edge on ids
+    - size:tuple, width and height of the image
+    - samples:int, number of points tested along the edge
+    - margin:int, pixels around each point where the box must be seen, and minimum distance to the borders
+
+    Return
+    - :tuple, t0 and t1 of the run on the edge p0 + t * (p1 - p0), or None if no point is visible
+    """
+    width, height = size
+    ts = np.linspace(0, 1, samples)
+    points = p0 + ts[:, None] * (p1 - p0)
+    inside = np.all((points >= margin) & (points < [width - margin, height - margin]), axis=1)
+    visible = np.zeros(samples, dtype=bool)
+    for k in np.nonzero(inside)[0]:
+        x, y = np.int32(np.round(points[k]))
+        visible[k] = np.any(ids[y - margin:y + margin + 1, x - margin:x + margin + 1] == box_id)
+
+    best, start = None, None
+    for k in range(samples + 1):
+        if k < samples and visible[k]:
+            start = k if start is None else start
+        elif start is not None:
+            if best is None or k - 1 - start > best[1] - best[0]:
+                best = (start, k - 1)
+            start = None
+    if best is None or best[0] == best[1]:
+        return None
+    return ts[best[0]], ts[best[1]]
+
+
+def getVisibleEdges(boxes, img_calib, canvas, views, min_length=40):
+    """
+    getVisibleEdges lists the edges of the boxes seen on every view, parallel to each axis
+
+    Parameters
+    - boxes:list, boxes as returned by createScene
+    - img_calib:dict, camera as returned by createCamera
+    - canvas:dict, object with keys cEscala, wInicio and hInicio of the images
+    - views:list, dicts with keys position, ids and size of each rendered view
+    - min_length:float, minimum length in pixels of the canvas of the visible part of an edge
+
+    Return
+    - edges:list, for each axis a list of dicts with keys points (ends on the space of shape (2,3)), run
+    (t0, t1 seen on the first view) and length (of the run on the canvas of the first view)
+    """
+    edges = [[], [], []]
+    for i, box in enumerate(boxes):
+        corners = getBoxCorners(box)
+        for axis in range(3):
+            others = [dim for dim in range(3) if dim != axis]
+            for bits in range(4):
+                start = ((bits & 1) << others[0]) | (((bits >> 1) & 1) << others[1])
+                points = corners[[start, start | (1 << axis)]]
+                runs, lengths = [], []
+                for view in views:
+                    # An edge is hidden by its own box unless a face next to it is seen
+                    faces = [(dim, (start >> dim) & 1) for dim in others]
+                    if not any(isFaceVisible(box, dim, side, view['position']) for dim, side in faces):
+                        break
+                    p0, p1 = projectView(points, img_calib, canvas, view['position'])
+                    run = getEdgeRun(p0, p1, view['ids'], i + 1, view['size'])
+                    if run is None:
+                        break
+                    lengths.append((run[1] - run[0]) * np.linalg.norm(p1 - p0) * canvas['cEscala'])
+                    if lengths[-1] < min_length:
+                        break
+                    runs.append(run)
+                if len(runs) == len(views):
+                    edges[axis].append({"points": points, "run": runs[0], "runs": runs, "length": lengths[0]})
+    return edges
+
+
+def annotateEdges(rng, edges, img_calib, noise=1.0, n_edges=4, shrink=0.08):
+    """
+    annotateEdges simulates the calibration segments of an user, picking the longest edges of each axis and
+    clicking their ends with noise, a little inside the visible part of the edge
+
+    Parameters
+    - rng:np.random.Generator, source of randomness
+    - edges:list, edges of each axis as returned by getVisibleEdges
+    - img_calib:dict, camera as returned by createCamera
+    - noise:float, standard deviation in pixels of the canvas of the clicked points
+    - n_edges:int, maximum number of segments of each axis
+    - shrink:float, maximum fraction of the edge left out at each end
+
+    Return
+    - pontosguia:list, for each axis a list of int points x,y on the canvas, two per segment
+    - chosen:list, for each axis the list of annotated edges
+    """
+    pontosguia, chosen = [], []
+    for axis_edges in edges:
+        axis_edges = sorted(axis_edges, key=lambda edge: -edge['length'])[:n_edges]
+        points = []
+        for edge in axis_edges:
+            t0, t1 = edge['run']
+            ts = [t0 + (t1 - t0) * rng.uniform(0, shrink), t1 - (t1 - t0) * rng.uniform(0, shrink)]
+            ends = projectPoints(np.array([edge['points'][0] + t * (edge['points'][1] - edge['points'][0])
+                                           for t in ts]), img_calib)
+            ends += rng.normal(0, noise, ends.shape)
+            points += np.int64(np.round(ends)).tolist()
+        pontosguia.append(points)
+        chosen.append(axis_edges)
+    return pontosguia, chosen
+
+
+def joinCard(rng, img_left, img_right, margin=0.08):
+    """
+    joinCard mounts the two views side by side on a card, centered on each half as the split stage expects
+
+    Parameters
+    - rng:np.random.Generator, source of randomness
+    - img_left:np.array, of shape (m,n,3)
+    - img_right:np.array, of shape (m,n,3)
+    - margin:float, horizontal margin of the card as a fraction of the width of a view
+
+    Return
+    - card:np.array, of shape (M,N,3)
+    - crops:dict, keys left and right with the rectangles [x0, y0, x1, y1] of each view on the card
+    """
+    height, width = img_left.shape[:2]
+    mx, my = int(margin * width), int(0.12 * height)
+    card = np.empty((height + 2 * my, 2 * width + 4 * mx, 3), dtype=np.float32)
+    card[:] = [150, 190, 215]
+    card += rng.normal(0, 4, card.shape).astype(np.float32)
+    card = np.uint8(np.clip(card, 0, 255))
+    crops = {"left": [mx, my, mx + width, my + height],
+             "right": [width + 3 * mx, my, 2 * width + 3 * mx, my + height]}
+    for img, side in [(img_left, "left"), (img_right, "right")]:
+        x0, y0, x1, y1 = crops[side]
+        card[y0:y1, x0:x1] = img
+    return card, crops
+
+
+def createSyntheticCard(seed, width=1600, height=1200, stereo=True, baseline=0.5, n_boxes=3, noise=1.0,
+                        n_edges=4, attempts=20):
+    """
+    createSyntheticCard renders a synthetic scene from a random camera, and a second view moved by baseline along
+    the X axis of the camera if stereo, retrying new scenes until every axis has two annotated segments
+
+    Parameters
+    - seed:int, seed of the randomness, the same seed renders the same card
+    - width:int, width of each view
+    - height:int, height of each view
+    - stereo:bool, to render the second view and join both on a card
+    - baseline:float, distance between the cameras of the views in units of the space
+    - n_boxes:int, number of boxes of the scene
+    - noise:float, standard deviation in pixels of the canvas of the annotated points
+    - n_edges:int, maximum number of segments of each axis
+    - attempts:int, number of scenes tried
+
+    Return
+    - card:dict, object with keys views (images of each side), image (the card if stereo), pontosguia (of the left
+    view) and truth (camera, crops, and ends and visible ends on the canvas of the annotated edges on each view)
+    """
+    rng = np.random.default_rng(seed)
+    cEscala, wInicio, hInicio = getCanvasParams(width, height)
+    canvas = {"cEscala": cEscala, "wInicio": wInicio, "hInicio": hInicio}
+    for _ in range(attempts):
+        img_calib = createCamera(rng)
+        boxes = createScene(rng, img_calib, n_boxes)
+        if not boxes:
+            continue
+        for box in boxes:
+            dims = box['max'] - box['min']
+            box['textures'] = {}
+            for axis, side in BOX_FACES:
+                u, v = [dim for dim in range(3) if dim != axis]
+                box['textures'][(axis, side)] = createFaceTexture(rng, box['color'], FACE_SHADES[axis],
+                                                                  dims[u], dims[v], windows=axis != 2)
+        ground = cv.GaussianBlur(rng.uniform(70, 140, (512, 512, 3)).astype(np.float32), (3, 3), 0)
+
+        M = np.array(img_calib['base']).reshape(3, 3).T
+        positions = {"left": np.zeros(3)}
+        if stereo:
+            # X axis of the camera on the space
+            positions["right"] = baseline * M[0]
+        views = {}
+        for side, position in positions.items():
+            img, ids = renderView(rng, boxes, ground, img_calib, canvas, (width, height), position)
+            views[side] = {"img": img, "ids": ids, "position": position, "size": (width, height)}
+        edges = getVisibleEdges(boxes, img_calib, canvas, list(views.values()))
+        if all(len(axis_edges) >= 2 for axis_edges in edges):
+            break
+    else:
+        raise ValueError("Couldn't create a scene with two visible edges on each axis, seed " + str(seed))
+
+    pontosguia, chosen = annotateEdges(rng, edges, img_calib, noise, n_edges)
+    truth = {"seed": seed, "width": width, "height": height, "stereo": stereo, "baseline": baseline,
+             "noise": noise, "calib": img_calib, "edges": {}, "ends": {}}
+    for k, (side, view) in enumerate(views.items()):
+        truth["edges"][side] = [[projectPoints(edge['points'] - view['position'], img_calib).tolist()
+                                 for edge in axis_edges] for axis_edges in chosen]
+        # Ends of the visible part of each edge, where its segment should start and finish
+        truth["ends"][side] = [[[(np.array(p) + t * (np.array(q) - p)).tolist() for t in edge['runs'][k]]
+                                for edge, (p, q) in zip(axis_edges, axis_truth)]
+                               for axis_edges, axis_truth in zip(chosen, truth["edges"][side])]
+    card = {"views": {side: view['img'] for side, view in views.items()}, "image": None,
+            "pontosguia": pontosguia, "truth": truth}
+    if stereo:
+        card["image"], truth["crops"] = joinCard(rng, views["left"]["img"], views["right"]["img"])
+    return card
+
+
+def saveSyntheticCard(card, card_name, paths, truth_path):
+    """
+    saveSyntheticCard saves a synthetic card as a collection expects it, the card image (or the left view if
+    not stereo) on the images folder, the annotated calibration of the left view on the calibrations folder
+    and the ground truth as <card_name>.json on truth_path
+
+    Parameters
+    - card:dict, object as returned by createSyntheticCard
+    - card_name:str, name of the card
+    - paths:dict, folders of images and calibrations as in DEFAULT_PATHS
+    - truth_path:str, folder to save the ground truth
+
+    Return
+    - outputs:list, paths of the saved files
+    """
+    images_path = paths['MAIN_FOLDER'] + paths['IMAGES']
+    calib_path = paths['MAIN_FOLDER'] + paths['CALIB']
+    for folder in [images_path, calib_path, truth_path]:
+        os.makedirs(folder, exist_ok=True)
+    if card["image"] is not None:
+        image_path = images_path + card_name + ".jpg"
+        img = card["image"]
+    else:
+        image_path = images_path + card_name + "_left.jpg"
+        img = card["views"]["left"]
+    if not cv.imwrite(image_path, img, [cv.IMWRITE_JPEG_QUALITY, 95]):
+        raise IOError("Couldn't write image at " + image_path)
+
+    annotation = {"nomeImagem": card_name + "_left", "extensao": "jpg", "pontosguia": card["pontosguia"]}
+    annotation_path = calib_path + paths['CALIB_PREFIX'] + card_name + "_left.json"
+    saveToFile(annotation, annotation_path)
+    truth_filepath = os.path.join(truth_path, card_name + ".json")
+    saveToFile(dict(card["truth"], card=card_name), truth_filepath)
+    return [image_path, annotation_path, truth_filepath]
+
+
+def generateSyntheticCard(seed, card_name, paths, truth_path, **card_options):
+    """
+    generateSyntheticCard creates a synthetic card and saves it, see createSyntheticCard and saveSyntheticCard
+
+    Parameters
+    - seed:int, seed of the randomness
+    - card_name:str, name of the card
+    - paths:dict, folders of images and calibrations as in DEFAULT_PATHS
+    - truth_path:str, folder to save the ground truth
+    - card_options:dict, keyword arguments of createSyntheticCard
+
+    Return
+    - :list, paths of the saved files
+    """
+    return saveSyntheticCard(createSyntheticCard(seed, **card_options), card_name, paths, truth_path)
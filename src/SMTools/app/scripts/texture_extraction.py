@@ -0,0 +1,161 @@
+"""
+texture_extraction.py is a collection of functions to extract the rectified textures of the planes of a calibrated
+image, as Plano.obterTextura of TextureExtractor, but sampling the original image instead of its canvas
+"""
+import os
+import json
+import numpy as np
+import cv2 as cv
+
+from scripts.shared_functions import readImage, createImageDict
+from scripts.camera_projection import projectPoints, canvasToImage
+
+
+def readPlanes(img_calib):
+    """
+    readPlanes returns the planes of a calibration saved by TextureExtractor, where planos is a json string
+
+    Parameters
+    - img_calib:dict, object with data about an image calibration with camera
+
+    Return
+    - planes:list, dicts with keys tipoPlano, v (canvas vertices of shape (4,2)) and P (space vertices of shape (4,3))
+    """
+    planes_data = img_calib.get('planos', [])
+    if isinstance(planes_data, str):
+        planes_data = json.loads(planes_data)
+    planes = []
+    for plane in planes_data:
+        planes.append({'tipoPlano': plane.get('tipoPlano'),
+                       'v': np.array([[vertex['x'], vertex['y']] for vertex in plane['v'][:4]], dtype=np.float64),
+                       'P': np.array([[vertex['x'], vertex['y'], vertex['z']] for vertex in plane['P'][:4]],
+                                     dtype=np.float64)})
+    return planes
+
+
+def getTextureSize(plane, scale=1):
+    """
+    getTextureSize returns the size of the texture of a plane, preserving the aspect ratio of the plane in the space
+    with the resolution of its projection on the canvas
+
+    Parameters
+    - plane:dict, plane as returned by readPlanes
+    - scale:float, pixels of the texture per pixel of the canvas
+
+    Return
+    - w:int, width of the texture
+    - h:int, height of the texture
+    """
+    v, P = plane['v'], plane['P']
+    dy = (np.linalg.norm(v[0] - v[1]) + np.linalg.norm(v[2] - v[3])) / 2
+    dx = (np.linalg.norm(v[0] - v[3]) + np.linalg.norm(v[1] - v[2])) / 2
+    a = np.linalg.norm(P[0] - P[1]) / np.linalg.norm(P[1] - P[2])
+    dx, dy = scale * dx, scale * dy
+    # Rounded half up as Math.round
+    if dy / dx > a:
+        w = int(np.floor(dx + 0.5))
+        h = int(np.floor(dx * a + 0.5))
+    else:
+        h = int(np.floor(dy + 0.5))
+        w = int(np.floor(h / a + 0.5))
+    return w, h
+
+
+def getTextureHomography(plane, img_calib, img_dict, w, h):
+    """
+    getTextureHomography returns the homography from pixels of the texture to pixels of the image, where the
+    pixel i,j of the texture is the projection of P0 + (P3 - P0) * j / w + (P1 - P0) * i / h
+
+    Parameters
+    - plane:dict, plane as returned by readPlanes
+    - img_calib:dict, object with data about an image calibration with camera
+    - img_dict:dict, object with data about an image and its parameters
+    - w:int, width of the texture
+    - h:int, height of the texture
+
+    Return
+    - :np.array, of shape (3,3)
+    """
+    P = plane['P']
+    corners = np.array([P[0], P[3], P[1], P[3] + P[1] - P[0]])
+    img_corners = canvasToImage(projectPoints(corners, img_calib), img_dict)
+    texture_corners = np.array([[0, 0], [w, 0], [0, h], [w, h]])
+    return cv.getPerspectiveTransform(texture_corners.astype(np.float32), img_corners.astype(np.float32))
+
+
+def extractTexture(img_dict, img_calib, plane, scale=None, tile_size=4096):
+    """
+    extractTexture extracts the rectified texture of a plane with bilinear interpolation, warping tiles of at most
+    tile_size pixels of side, so large textures don't exceed the limits of opencv
+
+    Parameters
+    - img_dict:dict, object with data about an image and its parameters
+    - img_calib:dict, object with data about an image calibration with camera
+    - plane:dict, plane as returned by readPlanes
+    - scale:float, pixels of the texture per pixel of the canvas, None for the resolution of the image
+    - tile_size:int, maximum side of each warped tile
+
+    Return
+    - texture:np.array, of shape (h,w,3)
+    """
+    scale = scale if scale is not None else 1 / img_dict['cEscala']
+    w, h = getTextureSize(plane, scale)
+    H = getTextureHomography(plane, img_calib, img_dict, w, h)
+    img = img_dict['img']
+    texture = np.zeros((h, w) + img.shape[2:], dtype=img.dtype)
+    for y0 in range(0, h, tile_size):
+        for x0 in range(0, w, tile_size):
+            y1, x1 = min(y0 + tile_size, h), min(x0 + tile_size, w)
+            T = np.array([[1, 0, x0], [0, 1, y0], [0, 0, 1]], dtype=np.float64)
+            texture[y0:y1, x0:x1] = cv.warpPerspective(img, H @ T, (x1 - x0, y1 - y0),
+                                                       flags=cv.INTER_LINEAR | cv.WARP_INVERSE_MAP,
+                                                       borderMode=cv.BORDER_REPLICATE)
+    return texture
+
+
+def extractTextures(img_dict, img_calib, scale=None, tile_size=4096):
+    """
+    extractTextures extracts the rectified texture of every plane of a calibration
+
+    Parameters
+    - img_dict:dict, object with data about an image and its parameters
+    - img_calib:dict, object with data about an image calibration with camera and planes
+    - scale:float, pixels of the texture per pixel of the canvas, None for the resolution of the image
+    - tile_size:int, maximum side of each warped tile
+
+    Return
+    - :list, textures as returned by extractTexture
+    """
+    return [extractTexture(img_dict, img_calib, plane, scale, tile_size)
+            for plane in readPlanes(img_calib)]
+
+
+def saveTextures(img_calib, images_path, output_path, scale=None, tile_size=4096, extension=".png"):
+    """
+    saveTextures extracts and saves the texture of every plane of a calibration as <nomeImagem>_plane<i>_<tipoPlano>
+
+    Parameters
+    - img_calib:dict, object with data about an image calibration with camera and planes
+    - images_path:str, folder of the images
+    - output_path:str, folder to save the textures
+    - scale:float, pixels of the texture per pixel of the canvas, None for the resolution of the image
+    - tile_size:int, maximum side of each warped tile
+    - extension:str, extension of the saved textures
+
+    Return
+    - outputs:list, paths of the saved textures
+    """
+    planes = readPlanes(img_calib)
+    if not planes:
+        return []
+    img_dict = createImageDict(readImage(img_calib, images_path))
+    os.makedirs(output_path, exist_ok=True)
+    outputs = []
+    for i, plane in enumerate(planes):
+        texture = extractTexture(img_dict, img_calib, plane, scale, tile_size)
+        filepath = os.path.join(output_path, img_calib['nomeImagem'] + "_plane" + str(i) + "_" +
+                                str(plane['tipoPlano']) + extension)
+        if not cv.imwrite(filepath, texture):
+            raise IOError("Couldn't write image at " + filepath)
+        outputs.append(filepath)
+    return outputs
@@ -0,0 +1,119 @@
+"""
+tile_pyramid.py is a collection of functions to export images and textures as pyramids of tiles, where each level
+halves the resolution of the next one, so viewers load the coarse levels first and stream the details
+"""
+import os
+import json
+import cv2 as cv
+from concurrent.futures import ThreadPoolExecutor
+
+from scripts.image_loader import loadImage
+
+
+TILE_FORMATS = {
+    "webp": (".webp", cv.IMWRITE_WEBP_QUALITY),
+    "jpg": (".jpg", cv.IMWRITE_JPEG_QUALITY),
+    "png": (".png", None)
+}
+
+
+def getPyramidLevels(img, tile_size=256):
+    """
+    getPyramidLevels returns the levels of the pyramid of an image, halving it until it fits in a single tile
+
+    Parameters
+    - img:np.array, of shape (m,n,3)
+    - tile_size:int, side of the tiles
+
+    Return
+    - levels:list, images from the coarsest to the original one
+    """
+    levels = [img]
+    while max(levels[0].shape[:2]) > tile_size:
+        height, width = levels[0].shape[:2]
+        levels.insert(0, cv.resize(levels[0], ((width + 1) // 2, (height + 1) // 2),
+                                   interpolation=cv.INTER_AREA))
+    return levels
+
+
+def saveTile(tile, filepath, tile_format="webp", quality=80):
+    """
+    saveTile encodes and saves a tile
+
+    Parameters
+    - tile:np.array, of shape (m,n,3)
+    - filepath:str, path of the tile without extension
+    - tile_format:str, webp, jpg or png
+    - quality:int, quality of the lossy formats, from 0 to 100
+
+    Return
+    - :str, path of the saved tile
+    """
+    extension, quality_flag = TILE_FORMATS[tile_format]
+    params = [quality_flag, quality] if quality_flag is not None else []
+    if not cv.imwrite(filepath + extension, tile, params):
+        raise IOError("Couldn't write image at " + filepath + extension)
+    return filepath + extension
+
+
+def exportPyramid(img, output_path, name, tile_size=256, tile_format="webp", quality=80, workers=4):
+    """
+    exportPyramid saves the tiles of every level of the pyramid of an image as <name>/<level>/<col>_<row> and its
+    manifest as <name>.json, encoding the tiles on a pool of threads
+
+    Parameters
+    - img:np.array, of shape (m,n,3)
+    - output_path:str, folder to save the pyramid
+    - name:str, name of the pyramid
+    - tile_size:int, side of the tiles
+    - tile_format:str, webp, jpg or png
+    - quality:int, quality of the lossy formats, from 0 to 100
+    - workers:int, number of threads encoding tiles
+
+    Return
+    - manifest_path:str, path of the manifest
+    """
+    levels = getPyramidLevels(img, tile_size)
+    manifest = {"name": name, "width": img.shape[1], "height": img.shape[0], "tile_size": tile_size,
+                "format": tile_format, "extension": TILE_FORMATS[tile_format][0], "levels": []}
+    futures = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for level, level_img in enumerate(levels):
+            height, width = level_img.shape[:2]
+            cols, rows = -(-width // tile_size), -(-height // tile_size)
+            level_path = os.path.join(output_path, name, str(level))
+            os.makedirs(level_path, exist_ok=True)
+            manifest["levels"].append({"level": level, "width": width, "height": height,
+                                       "cols": cols, "rows": rows, "scale": width / img.shape[1]})
+            for row in range(rows):
+                for col in range(cols):
+                    tile = level_img[row * tile_size:(row + 1) * tile_size,
+                                     col * tile_size:(col + 1) * tile_size]
+                    futures.append(executor.submit(saveTile, tile, os.path.join(level_path, str(col) + "_" + str(row)),
+                                                   tile_format, quality))
+    for future in futures:
+        future.result()
+
+    manifest_path = os.path.join(output_path, name + ".json")
+    with open(manifest_path, 'w') as file:
+        json.dump(manifest, file, indent=4)
+    return manifest_path
+
+
+def exportImagePyramid(image_path, output_path, tile_size=256, tile_format="webp", quality=80, workers=4):
+    """
+    exportImagePyramid exports the pyramid of an image file, named after the file
+
+    Parameters
+    - image_path:str, path of the image or texture
+    - output_path:str, folder to save the pyramid
+    - tile_size:int, side of the tiles
+    - tile_format:str, webp, jpg or png
+    - quality:int, quality of the lossy formats, from 0 to 100
+    - workers:int, number of threads encoding tiles
+
+    Return
+    - :str, path of the manifest
+    """
+    name = os.path.splitext(os.path.basename(image_path))[0]
+    return exportPyramid(loadImage(image_path), output_path, name, tile_size, tile_format, quality, workers)
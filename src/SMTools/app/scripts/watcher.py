@@ -0,0 +1,125 @@
+"""
+watcher.py is a collection of functions to watch the calibrations folder, running the stages of pipeline.py over
+every card whose annotated calibrations saved by TextureExtractor are new or changed
+"""
+import os
+import sys
+import time
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+from scripts.pipeline import DEFAULT_PATHS, runCard, submitCardFigures, initCardWorker
+from scripts.diagnostics import waitDiagnostics
+
+
+WATCH_STAGES = ["improve", "calibrate", "propagate"]
+
+
+def scanAnnotations(paths):
+    """
+    scanAnnotations returns the modification time and size of every annotated calibration of the calibrations folder
+
+    Parameters
+    - paths:dict, folders of images and calibrations as in DEFAULT_PATHS
+
+    Return
+    - annotations:dict, (mtime_ns, size) indexed by filename
+    """
+    calib_base_path = paths['MAIN_FOLDER'] + paths['CALIB']
+    annotations = {}
+    if not os.path.isdir(calib_base_path):
+        return annotations
+    with os.scandir(calib_base_path) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.startswith(paths['CALIB_PREFIX']) \
+                    and entry.name.endswith(".json"):
+                stat = entry.stat()
+                annotations[entry.name] = (stat.st_mtime_ns, stat.st_size)
+    return annotations
+
+
+def getAnnotationCard(filename, paths):
+    """
+    getAnnotationCard returns the name of the card of an annotated calibration filename
+
+    Parameters
+    - filename:str, e.g. cab-002080RJ2903_left.json
+    - paths:dict, folders of images and calibrations as in DEFAULT_PATHS
+
+    Return
+    - :str, name of the card, e.g. 002080RJ2903
+    """
+    name = filename[len(paths['CALIB_PREFIX']):-len(".json")]
+    return '_'.join(name.split('_')[:-1])
+
+
+def watchCalibrations(stages=None, paths=None, options=None, workers=1, interval=1.0, debounce=2.0,
+                      on_result=None, max_runs=None):
+    """
+    watchCalibrations polls the calibrations folder and runs the stages over a card once its annotated
+    calibrations stop changing for debounce seconds, with at most workers cards running at a time
+
+    A card changed while running is queued again, so the last annotation is always processed, and stages
+    whose inputs didn't change are reused from the memoized values
+
+    Parameters
+    - stages:list, names of the stages to run, WATCH_STAGES by default
+    - paths:dict, folders of images and calibrations as in DEFAULT_PATHS
+    - options:dict, options of the run as in runCard
+    - workers:int, number of processes
+    - interval:float, seconds between scans of the folder
+    - debounce:float, seconds without changes before a card is run
+    - on_result:function, called with the summary of each finished card, prints it as json by default
+    - max_runs:int, stops after this number of finished cards, None watches until interrupted
+
+    Return
+    - :None
+    """
+    stages = stages or WATCH_STAGES
+    paths = dict(DEFAULT_PATHS, **(paths or {}))
+    options = options or {}
+    on_result = on_result or (lambda result: print(json.dumps(result), flush=True))
+
+    def finishCard(result):
+        # Figures hold images, so they're rendered here instead of being reported
+        submitCardFigures(result.pop('figures', []),
+                          options.get('preview_max_side'))
+        on_result(result)
+
+    # Files already on the folder are processed too, memoization makes it cheap if nothing changed
+    seen = {}
+    changed = {}
+    running = {}
+    finished = 0
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=initCardWorker,
+                             initargs=(options.get('memory_budget'),)) as executor:
+        try:
+            while max_runs is None or finished < max_runs:
+                now = time.monotonic()
+                annotations = scanAnnotations(paths)
+                for filename, signature in annotations.items():
+                    if seen.get(filename) != signature:
+                        seen[filename] = signature
+                        changed[getAnnotationCard(filename, paths)] = now
+
+                for card_name, future in list(running.items()):
+                    if future.done():
+                        del running[card_name]
+                        finished += 1
+                        finishCard(future.result())
+
+                ready = [card_name for card_name, changed_time in changed.items()
+                         if now - changed_time >= debounce and card_name not in running]
+                for card_name in sorted(ready, key=changed.get):
+                    if len(running) >= workers:
+                        break
+                    del changed[card_name]
+                    running[card_name] = executor.submit(
+                        runCard, card_name, stages, paths, options)
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            print("Stopping, waiting for running cards", file=sys.stderr)
+        for card_name, future in running.items():
+            finishCard(future.result())
+    waitDiagnostics()